@@ -413,6 +413,45 @@ DICTIONARY_CONFIG = {}
 # # ================================================= #
 TG_API_ID = 1025907
 TG_API_HASH = '452b0359b988148995f22ff0f4229750'
+# 监听消息批量写入：每批条数 / 最长等待秒数 / 队列上限（背压）
+TG_MESSAGE_BATCH_SIZE = locals().get('TG_MESSAGE_BATCH_SIZE', 200)
+TG_MESSAGE_FLUSH_INTERVAL = locals().get('TG_MESSAGE_FLUSH_INTERVAL', 1.0)
+TG_MESSAGE_QUEUE_SIZE = locals().get('TG_MESSAGE_QUEUE_SIZE', 5000)
+# 监听实体缓存（按 peer id 的 LRU）：最大条目数 / 过期秒数
+TG_ENTITY_CACHE_SIZE = locals().get('TG_ENTITY_CACHE_SIZE', 10000)
+TG_ENTITY_CACHE_TTL = locals().get('TG_ENTITY_CACHE_TTL', 3600)
+# 发送连接池：单客户端并发数 / 空闲回收秒数 / 健康检查间隔秒数
+TG_CLIENT_POOL_MAX_CONCURRENCY = locals().get('TG_CLIENT_POOL_MAX_CONCURRENCY', 4)
+TG_CLIENT_POOL_IDLE_TIMEOUT = locals().get('TG_CLIENT_POOL_IDLE_TIMEOUT', 600)
+TG_CLIENT_POOL_HEALTH_INTERVAL = locals().get('TG_CLIENT_POOL_HEALTH_INTERVAL', 60)
+# 群发任务心跳（检查点）超过该秒数未更新视为执行中断，允许重新启动
+TG_BROADCAST_STALE_SECONDS = locals().get('TG_BROADCAST_STALE_SECONDS', 300)
+# 联系人在线状态合并写入间隔秒数
+TG_PRESENCE_FLUSH_INTERVAL = locals().get('TG_PRESENCE_FLUSH_INTERVAL', 5.0)
+# 联系人互动计数（消息数/最后互动）增量写入间隔秒数
+TG_INTERACTION_FLUSH_INTERVAL = locals().get('TG_INTERACTION_FLUSH_INTERVAL', 10.0)
+# 媒体下载：单账号并发数 / 队列上限 / 收到消息时是否自动下载 / 自动下载的文件大小上限（字节）
+TG_MEDIA_DOWNLOAD_CONCURRENCY = locals().get('TG_MEDIA_DOWNLOAD_CONCURRENCY', 2)
+TG_MEDIA_QUEUE_SIZE = locals().get('TG_MEDIA_QUEUE_SIZE', 1000)
+TG_MEDIA_AUTO_DOWNLOAD = locals().get('TG_MEDIA_AUTO_DOWNLOAD', False)
+TG_MEDIA_AUTO_DOWNLOAD_MAX_SIZE = locals().get('TG_MEDIA_AUTO_DOWNLOAD_MAX_SIZE', 20 * 1024 * 1024)
+# 联系人头像：同时下载数 / 定期拉取完整联系人列表比对头像的间隔秒数（头像变化不影响联系人哈希）
+TG_AVATAR_DOWNLOAD_CONCURRENCY = locals().get('TG_AVATAR_DOWNLOAD_CONCURRENCY', 4)
+TG_CONTACT_AVATAR_REFRESH_INTERVAL = locals().get('TG_CONTACT_AVATAR_REFRESH_INTERVAL', 6 * 3600)
+# 监听心跳：本地检查间隔 / 无更新多久后确认授权 / last_active 批量写入间隔（秒）
+TG_HEARTBEAT_INTERVAL = locals().get('TG_HEARTBEAT_INTERVAL', 15)
+TG_HEARTBEAT_SILENCE = locals().get('TG_HEARTBEAT_SILENCE', 300)
+TG_LAST_ACTIVE_WRITE_INTERVAL = locals().get('TG_LAST_ACTIVE_WRITE_INTERVAL', 60)
+# 监听进程巡检：巡检间隔 / 新启动宽限秒数 / 发现丢失后是否自动重启
+TG_REAPER_INTERVAL = locals().get('TG_REAPER_INTERVAL', 60)
+TG_REAPER_GRACE = locals().get('TG_REAPER_GRACE', 120)
+TG_REAPER_RESTART = locals().get('TG_REAPER_RESTART', False)
+CELERY_BEAT_SCHEDULE = {
+    'reap-telegram-listeners': {
+        'task': 'telegram_client.tasks.reap_listeners',
+        'schedule': TG_REAPER_INTERVAL,
+    },
+}
 # ================================================= #
 # ******************** 插件配置 ******************** #
 # ================================================= #
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def init_dept_paths(sender, **kwargs):
+    """迁移后补齐历史部门的路径，避免空路径参与子树查询"""
+    from dvadmin.system.models import Dept
+    Dept.ensure_paths()
 
 
 class SystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dvadmin.system'
+
+    def ready(self):
+        # 注册权限索引的失效信号（任何进程修改权限数据都会递增版本号）
+        import dvadmin.utils.permission  # noqa: F401
+        post_migrate.connect(init_dept_paths, sender=self)
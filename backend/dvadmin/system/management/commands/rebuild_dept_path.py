@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+
+from dvadmin.system.models import Dept
+
+
+class Command(BaseCommand):
+    """
+    重建部门路径: python manage.py rebuild_dept_path
+    升级后首次使用或直接改过数据库中的上级部门时执行
+    """
+
+    def handle(self, *args, **options):
+        count = Dept.rebuild_paths()
+        self.stdout.write(self.style.SUCCESS(f"部门路径重建完成，更新 {count} 条"))
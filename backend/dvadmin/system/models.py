@@ -4,7 +4,9 @@ from time import time
 from pathlib import PurePosixPath
 
 from django.contrib.auth.models import AbstractUser, UserManager
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q, Subquery, Value
+from django.db.models.functions import Concat, Substr
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from application import dispatch
 from dvadmin.utils.models import CoreModel, table_prefix, get_custom_app_models
@@ -121,25 +123,104 @@ class Dept(CoreModel):
         blank=True,
         help_text="上级部门",
     )
+    path = models.CharField(max_length=255, default='', blank=True, editable=False, db_index=True,
+                            verbose_name="部门路径", help_text="从根到自身的部门id路径，如 /1/3/7/，用于一次查询整棵子树")
+
+    def build_path(self) -> str:
+        """按数据库中上级部门的当前路径拼出自身路径（不使用内存中可能过期的上级对象）"""
+        if not self.parent_id:
+            return f"/{self.pk}/"
+        parent = Dept.objects.filter(pk=self.parent_id).only('id', 'parent_id', 'path').first()
+        if parent is None:
+            return f"/{self.pk}/"
+        parent_path = parent.path or parent.build_path()
+        if f"/{self.pk}/" in parent_path:
+            raise ValidationError("上级部门不能是自身或自身的下级部门")
+        return f"{parent_path}{self.pk}/"
+
+    def save(self, *args, **kwargs):
+        """保存时同步维护路径；上级部门变化时在同一事务内整体替换下级部门的路径前缀"""
+        with transaction.atomic():
+            # 旧路径以数据库为准，内存中的 path 不可信
+            old_path = Dept.objects.filter(pk=self.pk).values_list('path', flat=True).first() if self.pk else None
+            self.path = old_path or ''
+            super().save(*args, **kwargs)
+            new_path = self.build_path()
+            if new_path != old_path:
+                Dept.objects.filter(pk=self.pk).update(path=new_path)
+                self.path = new_path
+                if old_path:
+                    Dept.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                        path=Concat(Value(new_path), Substr('path', len(old_path) + 1),
+                                    output_field=models.CharField())
+                    )
+                transaction.on_commit(self.invalidate_scopes)
+
+    @staticmethod
+    def invalidate_scopes():
+        """路径经 update/bulk_update 修改不会触发信号，需手动递增权限版本号使数据权限缓存失效"""
+        from dvadmin.utils.permission import permission_index
+        permission_index.invalidate()
+
+    @classmethod
+    def subtree_path(cls, dept_id):
+        """
+        部门路径子查询，配合 path__startswith / dept__path__startswith 在一条 SQL 中取整棵子树
+        路径为空（尚未初始化）时结果为 NULL，startswith NULL 不匹配任何行，不会退化为全部部门
+        """
+        return Subquery(cls.objects.filter(id=dept_id).exclude(path='').values('path')[:1])
+
+    @classmethod
+    def subtree_q(cls, dept_id, prefix: str = ''):
+        """部门及其所有下级部门的过滤条件，prefix 如 'dept__'；路径缺失时只包含部门自身"""
+        return Q(**{f'{prefix}path__startswith': cls.subtree_path(dept_id)}) | Q(**{f'{prefix}id': dept_id})
 
     @classmethod
     def recursion_all_dept(cls, dept_id: int, dept_all_list=None, dept_list=None):
         """
-        递归获取部门的所有下级部门
+        获取部门及其所有下级部门id（按路径前缀一次查询）
         :param dept_id: 需要获取的id
-        :param dept_all_list: 所有列表
-        :param dept_list: 递归list
+        :param dept_all_list: 兼容旧参数，已不使用
+        :param dept_list: 兼容旧参数，已不使用
         :return:
         """
-        if not dept_all_list:
-            dept_all_list = Dept.objects.values("id", "parent")
-        if dept_list is None:
-            dept_list = [dept_id]
-        for ele in dept_all_list:
-            if ele.get("parent") == dept_id:
-                dept_list.append(ele.get("id"))
-                cls.recursion_all_dept(ele.get("id"), dept_all_list, dept_list)
-        return list(set(dept_list))
+        dept_ids = set(cls.objects.filter(cls.subtree_q(dept_id)).values_list('id', flat=True))
+        dept_ids.add(dept_id)
+        return list(dept_ids)
+
+    @classmethod
+    def rebuild_paths(cls) -> int:
+        """按 parent 关系重建全部部门路径（历史数据初始化用），返回更新条数"""
+        parents = dict(cls.objects.values_list('id', 'parent_id'))
+        paths = {}
+
+        def _path(dept_id, seen=()):
+            if dept_id not in paths:
+                parent_id = parents.get(dept_id)
+                if parent_id is None or parent_id not in parents or parent_id in seen:
+                    paths[dept_id] = f"/{dept_id}/"
+                else:
+                    paths[dept_id] = f"{_path(parent_id, seen + (dept_id,))}{dept_id}/"
+            return paths[dept_id]
+
+        changed = []
+        for dept in cls.objects.only('id', 'path'):
+            path = _path(dept.id)
+            if dept.path != path:
+                dept.path = path
+                changed.append(dept)
+        if changed:
+            with transaction.atomic():
+                cls.objects.bulk_update(changed, ['path'], batch_size=500)
+                transaction.on_commit(cls.invalidate_scopes)
+        return len(changed)
+
+    @classmethod
+    def ensure_paths(cls) -> int:
+        """存在未初始化路径的部门时重建（迁移后自动执行），返回更新条数"""
+        if not cls.objects.filter(path='').exists():
+            return 0
+        return cls.rebuild_paths()
 
     class Meta:
         db_table = table_prefix + "system_dept"
@@ -1,12 +1,25 @@
+import re
 from functools import wraps
+from unittest import mock
 
 from django.db.models import Func, F, OuterRef, Exists
-from django.test import TestCase
+from django.test import TestCase, override_settings
 import django
 import os
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "application.settings")
 django.setup()
-from dvadmin.system.models import Menu, RoleMenuPermission, RoleMenuButtonPermission, MenuButton
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from dvadmin.system.models import Menu, RoleMenuPermission, RoleMenuButtonPermission, MenuButton, Dept, Role, Users, \
+    ApiWhiteList, Post
+from dvadmin.system.views.dept import DeptViewSet
+from dvadmin.utils import filters
+from dvadmin.utils.filters import DataLevelPermissionsFilter, DataScopeResolver
+from dvadmin.utils.permission import PermissionIndex, permission_index
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
 
 
 import time
@@ -52,5 +65,339 @@ def getMenu():
         data.append(dicts)
     # print(data)
 
+class DeptPathTests(TestCase):
+    """部门物化路径：上级部门变化时整棵子树的路径随之改写"""
+
+    def setUp(self):
+        self.root = Dept.objects.create(name='root')
+        self.other = Dept.objects.create(name='other')
+        self.child = Dept.objects.create(name='child', parent=self.root)
+        self.grandchild = Dept.objects.create(name='grandchild', parent=self.child)
+
+    def path_of(self, dept):
+        return Dept.objects.values_list('path', flat=True).get(pk=dept.pk)
+
+    def test_paths_follow_parents(self):
+        self.assertEqual(self.path_of(self.root), f"/{self.root.pk}/")
+        self.assertEqual(self.path_of(self.child), f"/{self.root.pk}/{self.child.pk}/")
+        self.assertEqual(self.path_of(self.grandchild), f"/{self.root.pk}/{self.child.pk}/{self.grandchild.pk}/")
+        self.assertCountEqual(Dept.recursion_all_dept(self.root.pk),
+                              [self.root.pk, self.child.pk, self.grandchild.pk])
+
+    def test_moving_a_dept_rewrites_descendants(self):
+        self.child.parent = self.other
+        self.child.save()
+        self.assertEqual(self.path_of(self.child), f"/{self.other.pk}/{self.child.pk}/")
+        self.assertEqual(self.path_of(self.grandchild), f"/{self.other.pk}/{self.child.pk}/{self.grandchild.pk}/")
+        self.assertCountEqual(Dept.recursion_all_dept(self.root.pk), [self.root.pk])
+        self.assertCountEqual(Dept.recursion_all_dept(self.other.pk),
+                              [self.other.pk, self.child.pk, self.grandchild.pk])
+
+    def test_path_in_memory_is_ignored(self):
+        self.child.path = '/'
+        self.child.save()
+        self.assertEqual(self.path_of(self.child), f"/{self.root.pk}/{self.child.pk}/")
+        self.assertEqual(self.path_of(self.other), f"/{self.other.pk}/")
+
+    def test_cycle_is_rejected(self):
+        self.root.parent = self.grandchild
+        with self.assertRaises(ValidationError):
+            self.root.save()
+        self.assertIsNone(Dept.objects.get(pk=self.root.pk).parent_id)
+        self.assertEqual(self.path_of(self.grandchild), f"/{self.root.pk}/{self.child.pk}/{self.grandchild.pk}/")
+
+    def test_missing_path_only_matches_self(self):
+        Dept.objects.filter(pk=self.root.pk).update(path='')
+        self.assertEqual(Dept.recursion_all_dept(self.root.pk), [self.root.pk])
+        self.assertEqual(Dept.rebuild_paths(), 1)
+        self.assertEqual(self.path_of(self.root), f"/{self.root.pk}/")
+
+
+def legacy_has_permission(user, api, method):
+    """改造前 CustomPermission 的逐条匹配逻辑，用于对照"""
+    methodList = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH']
+    method = methodList.index(method)
+    api_white_list = ApiWhiteList.objects.values(permission__api=F('url'), permission__method=F('method'))
+    api_white_list = [
+        str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
+            item.get('permission__method')) + '$' for item in api_white_list if item.get('permission__api')]
+    role_id_list = user.role.values_list('id', flat=True)
+    userApiList = RoleMenuButtonPermission.objects.filter(role__in=role_id_list).values(
+        permission__api=F('menu_button__api'), permission__method=F('menu_button__method'))
+    ApiList = [
+        str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
+            item.get('permission__method')) + '$' for item in userApiList if item.get('permission__api')]
+    new_api = api + ":" + str(method)
+    return any(re.match(item, new_api, re.M | re.I) for item in api_white_list + ApiList)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PermissionIndexTests(TestCase):
+    """预编译的接口权限索引与旧的逐条正则匹配结果一致"""
+    methods = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH']
+    paths = [
+        '/api/login/', '/api/captcha/', '/api/captcha/extra/',
+        '/api/system/user/', '/api/system/user/12/', '/api/system/user/ab-12/', '/api/system/user/12/x/',
+        '/api/system/user/12/reset_password/', '/API/SYSTEM/USER/', '/api/system/role/', '/api/system/role/3/',
+        '/api/system/dept/', '/api/system/dept/dept_info/', '/api/other/',
+    ]
+
+    def setUp(self):
+        cache.clear()
+        ApiWhiteList.objects.create(url='/api/login/', method=1)
+        ApiWhiteList.objects.create(url='/api/captcha/', method=0)
+        ApiWhiteList.objects.create(url='/api/unused/', method=None)
+        menu = Menu.objects.create(name='系统管理')
+        buttons = [
+            MenuButton.objects.create(menu=menu, name='查询', value='user:Search', api='/api/system/user/', method=0),
+            MenuButton.objects.create(menu=menu, name='详情', value='user:Retrieve', api='/api/system/user/{id}/', method=0),
+            MenuButton.objects.create(menu=menu, name='编辑', value='user:Update', api='/api/system/user/{id}/', method=2),
+            MenuButton.objects.create(menu=menu, name='重置密码', value='user:ResetPwd',
+                                      api='/api/system/user/{id}/reset_password/', method=2),
+            MenuButton.objects.create(menu=menu, name='部门', value='dept:All', api='/api/system/dept/.*', method=0),
+            MenuButton.objects.create(menu=menu, name='角色', value='role:Search', api='/api/system/role/', method=0),
+        ]
+        self.role = Role.objects.create(name='运营', key='operator')
+        other_role = Role.objects.create(name='审计', key='auditor')
+        for button in buttons[:5]:
+            RoleMenuButtonPermission.objects.create(role=self.role, menu_button=button)
+        RoleMenuButtonPermission.objects.create(role=other_role, menu_button=buttons[5])
+        self.user = Users.objects.create(username='operator', name='operator')
+        self.user.role.add(self.role)
+        self.no_role = Users.objects.create(username='guest', name='guest')
+
+    def assert_parity(self, user):
+        index = PermissionIndex()
+        for path in self.paths:
+            for method in self.methods:
+                with self.subTest(user=user.username, path=path, method=method):
+                    self.assertEqual(index.has_permission(user, path, method),
+                                     legacy_has_permission(user, path, method))
+
+    def test_parity_with_roles(self):
+        self.assert_parity(self.user)
+        self.assertTrue(PermissionIndex().has_permission(self.user, '/api/system/user/12/', 'PUT'))
+        self.assertFalse(PermissionIndex().has_permission(self.user, '/api/system/role/', 'GET'))
+
+    def test_parity_whitelist_only(self):
+        self.assert_parity(self.no_role)
+
+    def test_unknown_method_is_denied(self):
+        self.assertFalse(PermissionIndex().has_permission(self.user, '/api/system/user/', 'TRACE'))
+
+    def test_changes_invalidate_index(self):
+        index = PermissionIndex()
+        self.assertFalse(index.has_permission(self.user, '/api/system/role/', 'GET'))
+        self.user.role.add(Role.objects.get(key='auditor'))
+        self.assertTrue(index.has_permission(self.user, '/api/system/role/', 'GET'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DeptInfoTests(TestCase):
+    """部门统计固定两条查询，与下级部门数量无关"""
+
+    def setUp(self):
+        cache.clear()
+        self.root = Dept.objects.create(name='root', owner='boss')
+        self.users = 0
+
+    def add_child(self, genders):
+        child = Dept.objects.create(name=f'child{Dept.objects.count()}', parent=self.root)
+        grandchild = Dept.objects.create(name=f'{child.name}-g', parent=child)
+        for gender in genders:
+            self.users += 1
+            Users.objects.create(username=f'u{self.users}', name=f'u{self.users}', dept=grandchild, gender=gender)
+        return child
+
+    def test_query_count_is_constant(self):
+        Users.objects.create(username='root-user', name='root-user', dept=self.root, gender=1)
+        self.add_child([1, 2])
+        for show_all in (0, 1):
+            with self.assertNumQueries(2):
+                DeptViewSet()._build_dept_info(str(self.root.pk), show_all)
+        for _ in range(5):
+            self.add_child([0])
+        for show_all in (0, 1):
+            with self.assertNumQueries(2):
+                data = DeptViewSet()._build_dept_info(str(self.root.pk), show_all)
+        self.assertEqual(data['dept_name'], 'root')
+        self.assertEqual(data['owner'], 'boss')
+        self.assertEqual(data['dept_user'], 8)
+        self.assertEqual(data['gender'], {'male': 2, 'female': 1, 'unknown': 5})
+        self.assertEqual(sorted(item['count'] for item in data['sub_dept_map']), [1, 1, 1, 1, 1, 2])
+        own = DeptViewSet()._build_dept_info(str(self.root.pk), 0)
+        self.assertEqual(own['dept_user'], 1)
+        self.assertEqual(own['gender'], {'male': 1, 'female': 0, 'unknown': 0})
+
+    def test_unknown_dept_is_an_error_and_not_cached(self):
+        self.assertIsNone(DeptViewSet()._build_dept_info('999999', 0))
+        for dept_id in ('999999', 'abc'):
+            with self.subTest(dept_id=dept_id):
+                request = Request(APIRequestFactory().get('/api/system/dept/dept_info/', {'dept_id': dept_id}))
+                response = DeptViewSet().dept_info(request)
+                self.assertEqual(response.data['code'], 400)
+                self.assertIsNone(cache.get(f'dept_info_{dept_id}_0'))
+
+
+def legacy_get_dept(dept_id, dept_all_list=None, dept_list=None):
+    """改造前按 parent 递归的下级部门查找"""
+    if not dept_all_list:
+        dept_all_list = Dept.objects.all().values("id", "parent")
+    if dept_list is None:
+        dept_list = [dept_id]
+    for ele in dept_all_list:
+        if ele.get("parent") == dept_id:
+            dept_list.append(ele.get("id"))
+            legacy_get_dept(ele.get("id"), dept_all_list, dept_list)
+    return list(set(dept_list))
+
+
+def legacy_filter_queryset(request, queryset):
+    """改造前 DataLevelPermissionsFilter 的逐请求解析逻辑，用于对照"""
+    api = request.path
+    method = ["GET", "POST", "PUT", "DELETE", "OPTIONS"].index(request.method)
+    api_white_list = ApiWhiteList.objects.filter(enable_datasource=False).values(
+        permission__api=F("url"), permission__method=F("method"))
+    api_white_list = [str(item.get("permission__api").replace("{id}", ".*?")) + ":" + str(item.get("permission__method"))
+                      for item in api_white_list if item.get("permission__api")]
+    for item in api_white_list:
+        if re.match(item, f"{api}:{method}", re.M | re.I):
+            return queryset
+    if request.user.is_superuser:
+        return queryset
+    user_dept_id = getattr(request.user, "dept_id", None)
+    if not user_dept_id:
+        return queryset.none()
+    re_api = api
+    _pk = request.parser_context["kwargs"].get('pk')
+    if _pk:
+        re_api = re.sub(_pk, '{id}', api)
+    role_id_list = request.user.role.values_list('id', flat=True)
+    dataScope_list = set(RoleMenuButtonPermission.objects.filter(
+        role__in=role_id_list, role__status=1, menu_button__api=re_api, menu_button__method=method
+    ).values_list('data_range', flat=True))
+    if 3 in dataScope_list:
+        return queryset
+    if 0 in dataScope_list:
+        return queryset.filter(creator=request.user, dept_belong_id=user_dept_id)
+    dept_list = []
+    for ele in dataScope_list:
+        if ele == 1:
+            dept_list.append(user_dept_id)
+            dept_list.extend(legacy_get_dept(user_dept_id))
+        elif ele == 2:
+            dept_list.append(user_dept_id)
+        elif ele == 4:
+            dept_list.extend(RoleMenuButtonPermission.objects.filter(
+                role__in=role_id_list, role__status=1, data_range=4).values_list('dept__id', flat=True))
+    return queryset.filter(dept_belong_id__in=list(set(dept_list)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class DataScopeResolverTests(TestCase):
+    """缓存的数据权限范围与改造前逐请求解析结果一致，权限、角色、部门变化后失效"""
+
+    def setUp(self):
+        cache.clear()
+        permission_index.invalidate()
+        patcher = mock.patch.object(filters, 'data_scope_resolver', DataScopeResolver())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.root = Dept.objects.create(name='root')
+        self.dept = Dept.objects.create(name='dept', parent=self.root)
+        self.sub = Dept.objects.create(name='sub', parent=self.dept)
+        self.other = Dept.objects.create(name='other')
+        self.user = Users.objects.create(username='scoped', name='scoped', dept=self.dept)
+        menu = Menu.objects.create(name='岗位管理')
+        self.list_button = MenuButton.objects.create(menu=menu, name='查询', value='post:Search',
+                                                     api='/api/system/post/', method=0)
+        self.detail_button = MenuButton.objects.create(menu=menu, name='详情', value='post:Retrieve',
+                                                       api='/api/system/post/{id}/', method=0)
+        for index, dept in enumerate((self.root, self.dept, self.sub, self.other)):
+            Post.objects.create(name=f'p{index}', code=f'p{index}', dept_belong_id=str(dept.pk))
+            Post.objects.create(name=f'own{index}', code=f'own{index}', dept_belong_id=str(dept.pk), creator=self.user)
+        self.roles = {}
+
+    def grant(self, *data_ranges, button=None):
+        """为用户分配角色：每个数据范围一个角色"""
+        for data_range in data_ranges:
+            role = Role.objects.create(name=f'r{data_range}', key=f'r{data_range}-{Role.objects.count()}')
+            permission = RoleMenuButtonPermission.objects.create(
+                role=role, menu_button=button or self.list_button, data_range=data_range)
+            if data_range == 4:
+                permission.dept.set([self.other])
+            self.user.role.add(role)
+            self.roles[data_range] = (role, permission)
+
+    def request(self, path='/api/system/post/', pk=None):
+        request = Request(APIRequestFactory().get(path), parser_context={'kwargs': {'pk': pk} if pk else {}})
+        request.user = Users.objects.get(pk=self.user.pk)
+        return request
+
+    def filtered(self, request):
+        return set(DataLevelPermissionsFilter().filter_queryset(request, Post.objects.all(), None)
+                   .values_list('id', flat=True))
+
+    def assert_parity(self, path='/api/system/post/', pk=None):
+        request = self.request(path, pk)
+        expected = set(legacy_filter_queryset(request, Post.objects.all()).values_list('id', flat=True))
+        # 第二次命中缓存
+        self.assertEqual(self.filtered(request), expected)
+        self.assertEqual(self.filtered(self.request(path, pk)), expected)
+        return expected
+
+    def test_parity_per_data_range(self):
+        for data_range in (0, 1, 2, 3, 4):
+            with self.subTest(data_range=data_range):
+                self.user.role.clear()
+                self.grant(data_range)
+                self.assertTrue(self.assert_parity())
+
+    def test_parity_combined_ranges(self):
+        for data_ranges in ((1, 2), (2, 4), (0, 1), (1, 3), ()):
+            with self.subTest(data_ranges=data_ranges):
+                self.user.role.clear()
+                self.grant(*data_ranges)
+                self.assert_parity()
+
+    def test_parity_detail_api(self):
+        self.grant(2, button=self.detail_button)
+        post = Post.objects.first()
+        self.assertTrue(self.assert_parity(f'/api/system/post/{post.pk}/', pk=str(post.pk)))
+
+    def test_parity_whitelist(self):
+        self.grant(2)
+        ApiWhiteList.objects.create(url='/api/system/post/', method=0, enable_datasource=False)
+        self.assertEqual(self.assert_parity(), set(Post.objects.values_list('id', flat=True)))
+        ApiWhiteList.objects.create(url='/api/system/other/{id}/', method=0, enable_datasource=False)
+        self.assert_parity()
+
+    def test_dept_move_invalidates_scope(self):
+        self.grant(1)
+        before = self.filtered(self.request())
+        self.assertIn(str(self.sub.pk), set(Post.objects.filter(id__in=before).values_list('dept_belong_id', flat=True)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sub.parent = self.other
+            self.sub.save()
+        after = self.filtered(self.request())
+        self.assertNotIn(str(self.sub.pk), set(Post.objects.filter(id__in=after).values_list('dept_belong_id', flat=True)))
+        self.assertEqual(after, self.assert_parity())
+
+    def test_role_change_invalidates_scope(self):
+        self.grant(2)
+        self.assertLess(len(self.filtered(self.request())), Post.objects.count())
+        role, permission = self.roles[2]
+        permission.data_range = 3
+        permission.save()
+        self.assertEqual(len(self.filtered(self.request())), Post.objects.count())
+        role.status = False
+        role.save()
+        self.assertEqual(self.filtered(self.request()), self.assert_parity())
+        self.user.role.remove(role)
+        self.grant(0)
+        self.assertEqual(self.filtered(self.request()), self.assert_parity())
+
+
 if __name__ == '__main__':
     getMenu()
\ No newline at end of file
@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 import pypinyin
-from django.db.models import Q
+from django.db.models import OuterRef, Q
 from rest_framework import serializers
 
 from dvadmin.system.models import Area
 from dvadmin.utils.field_permission import FieldPermissionMixin
 from dvadmin.utils.json_response import SuccessResponse
-from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.serializers import CustomModelSerializer, count_subquery
 from dvadmin.utils.viewset import CustomModelViewSet
 
 
@@ -18,18 +18,26 @@ class AreaSerializer(CustomModelSerializer):
     hasChild = serializers.SerializerMethodField()
     pcode_info = serializers.SerializerMethodField()
 
+    select_related_fields = ('pcode',)
+    annotate_fields = {'child_count': count_subquery(Area.objects.filter(pcode=OuterRef('code')))}
+
     def get_pcode_info(self, instance):
-        pcode = Area.objects.filter(code=instance.pcode_id).values("name", "code")
-        return pcode
+        # pcode 无数据库约束，上级地区可能已不存在
+        try:
+            pcode = instance.pcode
+        except Area.DoesNotExist:
+            pcode = None
+        if pcode is None:
+            return []
+        return [{"name": pcode.name, "code": pcode.code}]
 
     def get_pcode_count(self, instance: Area):
+        if hasattr(instance, 'child_count'):
+            return instance.child_count
         return Area.objects.filter(pcode=instance).count()
 
     def get_hasChild(self, instance):
-        hasChild = Area.objects.filter(pcode=instance.code)
-        if hasChild:
-            return True
-        return False
+        return self.get_pcode_count(instance) > 0
 
     class Meta:
         model = Area
@@ -89,6 +97,7 @@ class AreaViewSet(CustomModelViewSet, FieldPermissionMixin):
                 queryset = self.queryset.filter(enable=True, pcode=pcode)
             else:
                 queryset = self.queryset.filter(enable=True, level=1)
+        queryset = self.setup_eager_loading(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True, request=request)
@@ -5,6 +5,9 @@
 @contact: QQ:2505811377
 @Remark: 部门管理
 """
+from django.core.cache import cache
+from django.db.models import F, OuterRef, Q, Value
+from django.db.models.functions import NullIf
 from rest_framework import serializers
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
@@ -12,7 +15,7 @@ from rest_framework.permissions import IsAuthenticated
 from dvadmin.system.models import Dept, RoleMenuButtonPermission, Users
 from dvadmin.utils.filters import DataLevelPermissionsFilter
 from dvadmin.utils.json_response import DetailResponse, SuccessResponse, ErrorResponse
-from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.serializers import CustomModelSerializer, count_subquery
 from dvadmin.utils.viewset import CustomModelViewSet
 
 
@@ -27,14 +30,24 @@ class DeptSerializer(CustomModelSerializer):
 
     dept_user_count = serializers.SerializerMethodField()
 
+    select_related_fields = ('parent',)
+    annotate_fields = {
+        'user_count': count_subquery(Users.objects.filter(dept_id=OuterRef('pk'))),
+        'child_count': count_subquery(Dept.objects.filter(parent_id=OuterRef('pk'))),
+    }
+
     def get_dept_user_count(self, obj: Dept):
+        if hasattr(obj, 'user_count'):
+            return obj.user_count
         return Users.objects.filter(dept=obj).count()
 
+    def get_child_count(self, obj: Dept):
+        if hasattr(obj, 'child_count'):
+            return obj.child_count
+        return Dept.objects.filter(parent_id=obj.id).count()
+
     def get_hasChild(self, instance):
-        hasChild = Dept.objects.filter(parent=instance.id)
-        if hasChild:
-            return True
-        return False
+        return self.get_child_count(instance) > 0
 
     def get_status_label(self, obj: Dept):
         if obj.status:
@@ -42,7 +55,7 @@ class DeptSerializer(CustomModelSerializer):
         return "禁用"
 
     def get_has_children(self, obj: Dept):
-        return Dept.objects.filter(parent_id=obj.id).count()
+        return self.get_child_count(obj)
 
     class Meta:
         model = Dept
@@ -96,6 +109,8 @@ class DeptViewSet(CustomModelViewSet):
     serializer_class = DeptSerializer
     create_serializer_class = DeptCreateUpdateSerializer
     update_serializer_class = DeptCreateUpdateSerializer
+    # 部门统计缓存秒数，人员变动后最多延迟这么久反映到看板
+    dept_info_cache_ttl = 30
     filter_fields = ['name', 'id', 'parent']
     search_fields = []
     # extra_filter_class = []
@@ -120,7 +135,7 @@ class DeptViewSet(CustomModelViewSet):
             queryset = self.queryset.filter(status=True, parent=parent)
         else:
             queryset = self.queryset.filter(status=True)
-        queryset = self.filter_queryset(queryset)
+        queryset = self.setup_eager_loading(self.filter_queryset(queryset), DeptSerializer)
         serializer = DeptSerializer(queryset, many=True, request=request)
         data = serializer.data
         return SuccessResponse(data=data)
@@ -163,50 +178,76 @@ class DeptViewSet(CustomModelViewSet):
 
     @action(methods=['GET'], detail=False, permission_classes=[])
     def dept_info(self, request):
-        """部门信息"""
-        def inner(did, li):
-            sub = Dept.objects.filter(parent_id=did)
-            if not sub.exists():
-                return li
-            for i in sub:
-                li.append(i.pk)
-                inner(i, li)
-            return li
+        """部门信息（按部门和是否含下级短暂缓存）"""
         dept_id = request.query_params.get('dept_id')
         show_all = request.query_params.get('show_all')
         if dept_id is None:
             return ErrorResponse(msg="部门不存在")
         if not show_all:
             show_all = 0
-        if int(show_all):  # 递归当前部门下的所有部门，查询用户
-            all_did = [dept_id]
-            inner(dept_id, all_did)
-            users = Users.objects.filter(dept_id__in=all_did)
-        else:
-            if dept_id != '':
-                users = Users.objects.filter(dept_id=dept_id)
-            else:
-                users = Users.objects.none()
-        dept_obj = Dept.objects.get(id=dept_id) if dept_id != '' else None
-        sub_dept = Dept.objects.filter(parent_id=dept_obj.pk) if dept_id != '' else []
+        if dept_id != '' and not dept_id.isdigit():
+            return ErrorResponse(msg="部门不存在")
+        cache_key = f"dept_info_{dept_id}_{int(show_all)}"
+        data = cache.get(cache_key)
+        if data is None:
+            data = self._build_dept_info(dept_id, int(show_all))
+            if data is None:
+                return ErrorResponse(msg="部门不存在")
+            cache.set(cache_key, data, timeout=self.dept_info_cache_ttl)
+        return SuccessResponse(data)
+
+    def _build_dept_info(self, dept_id, show_all):
+        """
+        部门统计，固定两条查询：
+        部门本身连同总人数与性别分布（标量子查询）一条，下级部门及其子树人数（关联子查询）一条；
+        部门不存在时返回 None
+        """
         data = {
-            'dept_name': dept_obj and dept_obj.name,
-            'dept_user': users.count(),
-            'owner': dept_obj and dept_obj.owner,
-            'description': dept_obj and dept_obj.description,
-            'gender': {
-                'male': users.filter(gender=1).count(),
-                'female': users.filter(gender=2).count(),
-                'unknown': users.filter(gender=0).count(),
-            },
+            'dept_name': None,
+            'dept_user': 0,
+            'owner': None,
+            'description': None,
+            'gender': {'male': 0, 'female': 0, 'unknown': 0},
             'sub_dept_map': []
         }
+        if dept_id == '':
+            return data
+        if show_all:  # 当前部门及所有下级部门的用户
+            users = Users.objects.filter(Dept.subtree_q(dept_id, 'dept__'))
+        else:
+            users = Users.objects.filter(dept_id=dept_id)
+        dept_obj = Dept.objects.filter(id=dept_id).annotate(
+            total=count_subquery(users),
+            male=count_subquery(users.filter(gender=1)),
+            female=count_subquery(users.filter(gender=2)),
+            unknown=count_subquery(users.filter(gender=0)),
+        ).values('name', 'owner', 'description', 'total', 'male', 'female', 'unknown').first()
+        if dept_obj is None:
+            return None
+        data.update({
+            'dept_name': dept_obj['name'],
+            'dept_user': dept_obj['total'],
+            'owner': dept_obj['owner'],
+            'description': dept_obj['description'],
+            'gender': {
+                'male': dept_obj['male'],
+                'female': dept_obj['female'],
+                'unknown': dept_obj['unknown'],
+            },
+        })
+        # 下级部门及其整棵子树的用户数，一条关联子查询完成
+        # 路径为空的下级部门只统计自身用户（NULL 前缀不匹配任何行）
+        sub_dept = Dept.objects.filter(parent_id=dept_id).annotate(
+            sub_path=NullIf(F('path'), Value('')),
+        ).annotate(
+            user_count=count_subquery(
+                Users.objects.filter(Q(dept__path__startswith=OuterRef('sub_path')) | Q(dept_id=OuterRef('pk')))
+            )
+        ).values('name', 'user_count')
         for dept in sub_dept:
-            all_did = [dept.pk]
-            inner(dept.pk, all_did)
             sub_data = {
-                'name': dept.name,
-                'count': Users.objects.filter(dept_id__in=all_did).count()
+                'name': dept['name'],
+                'count': dept['user_count'] or 0
             }
             data['sub_dept_map'].append(sub_data)
-        return SuccessResponse(data)
+        return data
@@ -6,13 +6,14 @@
 @Created on: 2021/6/1 001 22:38
 @Remark: 菜单模块
 """
+from django.db.models import OuterRef, Prefetch
 from rest_framework import serializers
 from rest_framework.decorators import action
 
-from dvadmin.system.models import Menu, RoleMenuPermission
+from dvadmin.system.models import Menu, MenuButton, RoleMenuPermission
 from dvadmin.system.views.menu_button import MenuButtonSerializer
 from dvadmin.utils.json_response import SuccessResponse, ErrorResponse
-from dvadmin.utils.serializers import CustomModelSerializer
+from dvadmin.utils.serializers import CustomModelSerializer, count_subquery
 from dvadmin.utils.viewset import CustomModelViewSet
 
 
@@ -23,8 +24,14 @@ class MenuSerializer(CustomModelSerializer):
     menuPermission = serializers.SerializerMethodField(read_only=True)
     hasChild = serializers.SerializerMethodField()
 
+    prefetch_related_fields = (Prefetch('menuPermission', queryset=MenuButton.objects.order_by('-name')),)
+    annotate_fields = {'child_count': count_subquery(Menu.objects.filter(parent_id=OuterRef('pk')))}
+
     def get_menuPermission(self, instance):
-        queryset = instance.menuPermission.order_by('-name').values('id', 'name', 'value')
+        if 'menuPermission' in getattr(instance, '_prefetched_objects_cache', {}):
+            queryset = [{'id': i.id, 'name': i.name, 'value': i.value} for i in instance.menuPermission.all()]
+        else:
+            queryset = instance.menuPermission.order_by('-name').values('id', 'name', 'value')
         # MenuButtonSerializer(instance.menuPermission.all(), many=True)
         if queryset:
             return queryset
@@ -32,10 +39,9 @@ class MenuSerializer(CustomModelSerializer):
             return None
 
     def get_hasChild(self, instance):
-        hasChild = Menu.objects.filter(parent=instance.id)
-        if hasChild:
-            return True
-        return False
+        if hasattr(instance, 'child_count'):
+            return instance.child_count > 0
+        return Menu.objects.filter(parent=instance.id).exists()
 
     class Meta:
         model = Menu
@@ -110,7 +116,7 @@ class MenuViewSet(CustomModelViewSet):
                 queryset = self.queryset.filter()
         else:
             queryset = self.queryset.filter(parent__isnull=True)
-        queryset = self.filter_queryset(queryset)
+        queryset = self.setup_eager_loading(self.filter_queryset(queryset), MenuSerializer)
         serializer = MenuSerializer(queryset, many=True, request=request)
         data = serializer.data
         return SuccessResponse(data=data)
@@ -36,6 +36,9 @@ class UserSerializer(CustomModelSerializer):
     role_info = DynamicSerializerMethodField()
     dept_name_all = serializers.SerializerMethodField()
 
+    select_related_fields = ('dept',)
+    prefetch_related_fields = ('role',)
+
     class Meta:
         model = Users
         read_only_fields = ["id"]
@@ -401,16 +404,7 @@ class UserViewSet(CustomModelViewSet):
         if not show_all:
             show_all = 0
         if int(show_all):
-            all_did = [dept_id]
-            def inner(did):
-                sub = Dept.objects.filter(parent_id=did)
-                if not sub.exists():
-                    return
-                for i in sub:
-                    all_did.append(i.pk)
-                    inner(i)
             if dept_id != '':
-                inner(dept_id)
                 searchs = [
                     Q(**{f+'__icontains':i})
                     for f in self.search_fields
@@ -421,12 +415,14 @@ class UserViewSet(CustomModelViewSet):
                     for i in searchs[1:]:
                         q |= i
                     q_obj.append(Q(q))
-                queryset = Users.objects.filter(*q_obj, dept_id__in=all_did)
+                # 按部门路径前缀一次取出整棵子树下的用户
+                queryset = Users.objects.filter(Dept.subtree_q(dept_id, 'dept__'), *q_obj)
             else:
                 queryset = self.filter_queryset(self.get_queryset())
         else:
             queryset = self.filter_queryset(self.get_queryset())
         # print(queryset.values('id','name','dept__id'))
+        queryset = self.setup_eager_loading(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True, request=request)
@@ -6,12 +6,14 @@
 @Created on: 2021/6/6 006 12:39
 @Remark: 自定义过滤器
 """
+import hashlib
 import operator
 import re
 from collections import OrderedDict
 from functools import reduce
 
 import six
+from django.core.cache import cache
 from django.db import models
 from django.db.models import Q, F
 from django.db.models.constants import LOOKUP_SEP
@@ -24,6 +26,7 @@ from rest_framework.filters import BaseFilterBackend
 from django_filters.conf import settings
 from dvadmin.system.models import Dept, ApiWhiteList, RoleMenuButtonPermission
 from dvadmin.utils.models import CoreModel
+from dvadmin.utils.permission import permission_index
 
 class CoreModelFilterBankend(BaseFilterBackend):
     """
@@ -58,21 +61,105 @@ class CoreModelFilterBankend(BaseFilterBackend):
 
 def get_dept(dept_id: int, dept_all_list=None, dept_list=None):
     """
-    递归获取部门的所有下级部门
+    获取部门及其所有下级部门（按部门路径一次查询）
     :param dept_id: 需要获取的部门id
-    :param dept_all_list: 所有部门列表
-    :param dept_list: 递归部门list
+    :param dept_all_list: 兼容旧参数，已不使用
+    :param dept_list: 兼容旧参数，已不使用
     :return:
     """
-    if not dept_all_list:
-        dept_all_list = Dept.objects.all().values("id", "parent")
-    if dept_list is None:
-        dept_list = [dept_id]
-    for ele in dept_all_list:
-        if ele.get("parent") == dept_id:
-            dept_list.append(ele.get("id"))
-            get_dept(ele.get("id"), dept_all_list, dept_list)
-    return list(set(dept_list))
+    return Dept.recursion_all_dept(dept_id)
+
+
+class DataScopeResolver:
+    """
+    有效数据权限范围
+
+    按 (版本号, 角色集合, 接口, 方法, 用户部门) 解析一次权限范围并缓存（进程内存 + Redis），
+    结果为 {"all": True} / {"self": True} / {"dept_ids": [...]}，
+    过滤器直接拼一个 dept_belong_id__in 条件。版本号与接口权限索引共用，权限、角色、部门变化时失效。
+    """
+    SCOPE_KEY = 'data_scope_{version}_{digest}'
+    methods = ["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"]
+
+    def __init__(self):
+        self._version = None
+        self._whitelist = None
+        self._scopes = {}
+
+    def _sync_version(self):
+        version = permission_index.version()
+        if version != self._version:
+            self._version = version
+            self._whitelist = None
+            self._scopes = {}
+        return version
+
+    def is_whitelisted(self, api: str, method: int) -> bool:
+        """接口白名单中关闭数据权限的接口（合并为一个正则，按版本缓存）"""
+        self._sync_version()
+        if self._whitelist is None:
+            patterns = [
+                f'(?:{item.get("permission__api").replace("{id}", ".*?")}:{item.get("permission__method")})'
+                for item in ApiWhiteList.objects.filter(enable_datasource=False).values(
+                    permission__api=F("url"), permission__method=F("method")
+                )
+                if item.get("permission__api")
+            ]
+            self._whitelist = re.compile('|'.join(patterns), re.M | re.I) if patterns else False
+        return bool(self._whitelist and self._whitelist.match(f"{api}:{method}"))
+
+    def resolve(self, user, api: str, method: int, user_dept_id) -> dict:
+        version = self._sync_version()
+        role_ids = permission_index.user_role_ids(user)
+        local_key = (role_ids, api, method, user_dept_id)
+        scope = self._scopes.get(local_key)
+        if scope is not None:
+            return scope
+        digest = hashlib.md5(repr(local_key).encode()).hexdigest()
+        cache_key = self.SCOPE_KEY.format(version=version, digest=digest)
+        scope = cache.get(cache_key)
+        if scope is None:
+            scope = self._resolve(role_ids, api, method, user_dept_id)
+            cache.set(cache_key, scope, timeout=3600)
+        self._scopes[local_key] = scope
+        return scope
+
+    @staticmethod
+    def _resolve(role_ids, api, method, user_dept_id) -> dict:
+        # 3. 根据所有角色 获取所有权限范围
+        # (0, "仅本人数据权限"),
+        # (1, "本部门及以下数据权限"),
+        # (2, "本部门数据权限"),
+        # (3, "全部数据权限"),
+        # (4, "自定数据权限")
+        dataScope_list = set(RoleMenuButtonPermission.objects.filter(
+            role__in=role_ids,
+            role__status=1,
+            menu_button__api=api,
+            menu_button__method=method).values_list('data_range', flat=True))
+        # 判断用户是否为超级管理员角色/如果拥有[全部数据权限]则返回所有数据
+        if 3 in dataScope_list:
+            return {"all": True}
+        # 4. 只为仅本人数据权限时只返回过滤本人数据
+        if 0 in dataScope_list:
+            return {"self": True}
+        # 5. 自定数据权限 获取部门
+        dept_list = set()
+        for ele in dataScope_list:
+            if ele == 1:
+                dept_list.update(get_dept(user_dept_id))
+            elif ele == 2:
+                dept_list.add(user_dept_id)
+            elif ele == 4:
+                dept_list.update(RoleMenuButtonPermission.objects.filter(
+                    role__in=role_ids,
+                    role__status=1,
+                    data_range=4).values_list('dept__id', flat=True))
+        dept_list.discard(None)
+        return {"dept_ids": sorted(dept_list)}
+
+
+data_scope_resolver = DataScopeResolver()
 
 
 class DataLevelPermissionsFilter(BaseFilterBackend):
@@ -94,26 +181,10 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
         """
         api = request.path  # 当前请求接口
         method = request.method  # 当前请求方法
-        methodList = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
-        method = methodList.index(method)
+        method = DataScopeResolver.methods.index(method)
         # ***接口白名单***
-        api_white_list = ApiWhiteList.objects.filter(enable_datasource=False).values(
-            permission__api=F("url"), permission__method=F("method")
-        )
-        api_white_list = [
-            str(item.get("permission__api").replace("{id}", ".*?"))
-            + ":"
-            + str(item.get("permission__method"))
-            for item in api_white_list
-            if item.get("permission__api")
-        ]
-        for item in api_white_list:
-            new_api = f"{api}:{method}"
-            matchObj = re.match(item, new_api, re.M | re.I)
-            if matchObj is None:
-                continue
-            else:
-                return queryset
+        if data_scope_resolver.is_whitelisted(api, method):
+            return queryset
         """
         判断是否为超级管理员:
         如果不是超级管理员,则进入下一步权限判断
@@ -138,63 +209,26 @@ class DataLevelPermissionsFilter(BaseFilterBackend):
         if not hasattr(request.user, "role"):
             return queryset.filter(dept_belong_id=user_dept_id)
 
-        # 3. 根据所有角色 获取所有权限范围
-        # (0, "仅本人数据权限"),
-        # (1, "本部门及以下数据权限"),
-        # (2, "本部门数据权限"),
-        # (3, "全部数据权限"),
-        # (4, "自定数据权限")
+        # 3. 解析（缓存的）有效数据权限范围
         re_api = api
         _pk = request.parser_context["kwargs"].get('pk')
         if _pk: # 判断是否是单例查询
             re_api = re.sub(_pk,'{id}', api)
-        role_id_list = request.user.role.values_list('id', flat=True)
-        role_permission_list=RoleMenuButtonPermission.objects.filter(
-            role__in=role_id_list,
-            role__status=1,
-            menu_button__api=re_api,
-            menu_button__method=method).values(
-            'data_range'
-        )
-        dataScope_list = []  # 权限范围列表
-        for ele in role_permission_list:
-                # 判断用户是否为超级管理员角色/如果拥有[全部数据权限]则返回所有数据
-            if ele.get("data_range") == 3:
-                return queryset
-            dataScope_list.append(ele.get("data_range"))
-        dataScope_list = list(set(dataScope_list))
+        scope = data_scope_resolver.resolve(request.user, re_api, method, user_dept_id)
+        if scope.get("all"):
+            return queryset
 
         # 4. 只为仅本人数据权限时只返回过滤本人数据，并且部门为自己本部门(考虑到用户会变部门，只能看当前用户所在的部门数据)
-        if 0 in dataScope_list:
+        if scope.get("self"):
             return queryset.filter(
                 creator=request.user, dept_belong_id=user_dept_id
             )
 
-        # 5. 自定数据权限 获取部门，根据部门过滤
-        dept_list = []
-        for ele in dataScope_list:
-            if ele == 1:
-                dept_list.append(user_dept_id)
-                dept_list.extend(
-                    get_dept(
-                        user_dept_id,
-                    )
-                )
-            elif ele == 2:
-                dept_list.append(user_dept_id)
-            elif ele == 4:
-                dept_ids = RoleMenuButtonPermission.objects.filter(
-                    role__in=role_id_list,
-                    role__status=1,
-                    data_range=4).values_list(
-                    'dept__id',flat=True
-                )
-                dept_list.extend(
-                    dept_ids
-                )
+        # 5. 自定数据权限 根据部门过滤
+        dept_list = scope["dept_ids"]
         if queryset.model._meta.model_name == 'dept':
-            return queryset.filter(id__in=list(set(dept_list)))
-        return queryset.filter(dept_belong_id__in=list(set(dept_list)))
+            return queryset.filter(id__in=dept_list)
+        return queryset.filter(dept_belong_id__in=dept_list)
 
 
 class CustomDjangoFilterBackend(DjangoFilterBackend):
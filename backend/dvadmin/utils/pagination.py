@@ -7,11 +7,16 @@
 
 @Created on: 2020/4/16 23:35
 """
+import base64
+import json
 from collections import OrderedDict
 
 from django.core import paginator
 from django.core.paginator import Paginator as DjangoPaginator, InvalidPage
-from rest_framework.pagination import PageNumberPagination
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
 
 
@@ -81,3 +86,86 @@ class CustomPagination(PageNumberPagination):
             ('is_previous', is_previous),
             ('data', data)
         ]))
+
+
+
+class KeysetPagination(BasePagination):
+    """
+    游标(keyset)分页: 按 ordering 字段组合定位下一页, 不使用 OFFSET,
+    翻到多深每页都是一次索引范围扫描;默认不统计总数(with_total=1 时才 COUNT)
+    视图可通过 keyset_ordering 指定排序字段, 最后一个字段必须唯一(如 id)
+    """
+    page_size = 50
+    page_size_query_param = "limit"
+    max_page_size = 999
+    cursor_query_param = "cursor"
+    total_query_param = "with_total"
+    ordering = ('-id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(getattr(view, 'keyset_ordering', None) or self.ordering)
+        self.limit = self.get_page_size(request)
+        self.total = queryset.count() if request.query_params.get(self.total_query_param) in ('1', 'true') else None
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self._build_filter(queryset.model, self._decode_cursor(cursor)))
+
+        results = list(queryset.order_by(*self.ordering)[:self.limit + 1])
+        self.is_next = len(results) > self.limit
+        results = results[:self.limit]
+        self.next_cursor = self._encode_cursor(results[-1]) if self.is_next else None
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            size = self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def _field_names(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def _encode_cursor(self, instance):
+        values = [getattr(instance, name) for name in self._field_names()]
+        raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value for value in values])
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def _decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (ValueError, TypeError):
+            raise ValidationError({self.cursor_query_param: "无效的游标"})
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise ValidationError({self.cursor_query_param: "无效的游标"})
+        return values
+
+    def _build_filter(self, model, values):
+        """
+        (a, b) 降序时: a < va OR (a = va AND b < vb), 升序同理用 gt
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            try:
+                value = model._meta.get_field(name).to_python(value)
+            except (DjangoValidationError, TypeError, ValueError):
+                raise ValidationError({self.cursor_query_param: "无效的游标"})
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('code', 2000),
+            ('msg', 'success' if data else "暂无数据"),
+            ('limit', self.limit),
+            ('total', self.total),
+            ('is_next', self.is_next),
+            ('next_cursor', self.next_cursor),
+            ('data', data or [])
+        ]))
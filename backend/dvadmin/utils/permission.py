@@ -6,13 +6,19 @@
 @Created on: 2021/6/6 006 10:30
 @Remark: 自定义权限
 """
+import logging
 import re
+import time
 
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from rest_framework.permissions import BasePermission
 
-from dvadmin.system.models import ApiWhiteList, RoleMenuButtonPermission
+from dvadmin.system.models import ApiWhiteList, RoleMenuButtonPermission, MenuButton, Users, Role, Dept
+
+logger = logging.getLogger(__name__)
 
 
 def ValidationApi(reqApi, validApi):
@@ -88,6 +94,135 @@ def ReUUID(api):
         return None
 
 
+class PermissionIndex:
+    """
+    接口权限索引
+
+    按角色集合把白名单和角色拥有的接口按请求方法分组，每个方法编译成一个合并正则，
+    鉴权只需一次 match。索引按 (版本号, 角色ID集合) 缓存在进程内存，
+    编译前的接口列表同时缓存到 Redis 供其他进程复用；
+    菜单按钮、角色按钮权限、白名单变化时递增版本号使所有缓存失效；
+    数据权限范围缓存（filters.DataLevelPermissionsFilter）共用该版本号，角色、部门变化同样失效。
+    """
+    VERSION_KEY = 'permission_index_version'
+    INDEX_KEY = 'permission_index_{version}_{roles}'
+    USER_ROLES_KEY = 'permission_user_roles_{version}_{user_id}'
+    # 进程内读取版本号的间隔（秒），本进程内的修改立即生效
+    version_ttl = 5
+    methods = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH']
+
+    def __init__(self):
+        self._version = None
+        self._version_checked = 0
+        self._matchers = {}
+
+    def version(self) -> int:
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked > self.version_ttl:
+            version = cache.get(self.VERSION_KEY)
+            if version is None:
+                cache.add(self.VERSION_KEY, 1, timeout=None)
+                version = cache.get(self.VERSION_KEY) or 1
+            if version != self._version:
+                self._matchers = {}
+                self._version = version
+            self._version_checked = now
+        return self._version
+
+    def invalidate(self):
+        """递增版本号，所有进程的索引在 version_ttl 内失效"""
+        try:
+            cache.incr(self.VERSION_KEY)
+        except ValueError:
+            cache.set(self.VERSION_KEY, 2, timeout=None)
+        self._version = None
+        self._matchers = {}
+
+    def user_role_ids(self, user) -> tuple:
+        """用户的角色ID（按版本缓存，角色分配变化时单独失效）"""
+        key = self.USER_ROLES_KEY.format(version=self.version(), user_id=user.pk)
+        role_ids = cache.get(key)
+        if role_ids is None:
+            role_ids = tuple(sorted(user.role.values_list('id', flat=True)))
+            cache.set(key, role_ids, timeout=3600)
+        return tuple(role_ids)
+
+    def invalidate_user(self, user_id):
+        cache.delete(self.USER_ROLES_KEY.format(version=self.version(), user_id=user_id))
+
+    def _load_patterns(self, role_ids: tuple) -> dict:
+        """{方法序号: [接口正则]}，先查 Redis，未命中再查库"""
+        key = self.INDEX_KEY.format(version=self.version(), roles='-'.join(map(str, role_ids)) or 'none')
+        patterns = cache.get(key)
+        if patterns is not None:
+            return patterns
+        # ***接口白名单***
+        rows = list(ApiWhiteList.objects.values(permission__api=F('url'), permission__method=F('method')))
+        if role_ids:
+            # 获取当前用户的角色拥有的所有接口
+            rows += list(RoleMenuButtonPermission.objects.filter(role__in=role_ids).values(
+                permission__api=F('menu_button__api'), permission__method=F('menu_button__method')))
+        patterns = {}
+        for item in rows:
+            api, method = item.get('permission__api'), item.get('permission__method')
+            if api and method is not None:
+                patterns.setdefault(method, set()).add(api.replace('{id}', '(?:[a-zA-Z0-9-]+)'))
+        patterns = {method: sorted(apis) for method, apis in patterns.items()}
+        cache.set(key, patterns, timeout=3600)
+        return patterns
+
+    @staticmethod
+    def _compile(apis):
+        valid = []
+        for api in apis:
+            try:
+                re.compile(api)
+                valid.append(f'(?:{api})$')
+            except re.error:
+                logger.warning(f"接口权限正则无效，已忽略: {api}")
+        return re.compile('|'.join(valid), re.I) if valid else None
+
+    def get_matcher(self, role_ids: tuple) -> dict:
+        version = self.version()
+        matcher = self._matchers.get(role_ids)
+        if matcher is None:
+            matcher = {method: self._compile(apis) for method, apis in self._load_patterns(role_ids).items()}
+            if version == self._version:
+                self._matchers[role_ids] = matcher
+        return matcher
+
+    def has_permission(self, user, path: str, method: str) -> bool:
+        if method not in self.methods:
+            return False
+        pattern = self.get_matcher(self.user_role_ids(user)).get(self.methods.index(method))
+        return bool(pattern and pattern.match(path))
+
+
+permission_index = PermissionIndex()
+
+
+def _invalidate_permission_index(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        permission_index.invalidate()
+
+
+def _invalidate_user_roles(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if isinstance(instance, Users):
+            permission_index.invalidate_user(instance.pk)
+        else:
+            # 从角色一侧修改成员时无法逐个定位，整体失效
+            permission_index.invalidate()
+
+
+for _model in (MenuButton, RoleMenuButtonPermission, ApiWhiteList, Role, Dept):
+    post_save.connect(_invalidate_permission_index, sender=_model, dispatch_uid=f'permission_index_{_model.__name__}_save')
+    post_delete.connect(_invalidate_permission_index, sender=_model, dispatch_uid=f'permission_index_{_model.__name__}_delete')
+m2m_changed.connect(_invalidate_user_roles, sender=Users.role.through, dispatch_uid='permission_index_user_roles')
+m2m_changed.connect(_invalidate_permission_index, sender=RoleMenuButtonPermission.dept.through,
+                    dispatch_uid='permission_index_role_dept')
+
+
 class CustomPermission(BasePermission):
     """自定义权限"""
 
@@ -97,32 +232,7 @@ class CustomPermission(BasePermission):
         # 判断是否是超级管理员
         if request.user.is_superuser:
             return True
-        else:
-            api = request.path  # 当前请求接口
-            method = request.method  # 当前请求方法
-            methodList = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH']
-            method = methodList.index(method)
-            # ***接口白名单***
-            api_white_list = ApiWhiteList.objects.values(permission__api=F('url'), permission__method=F('method'))
-            api_white_list = [
-                str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
-                    item.get('permission__method')) + '$' for item in api_white_list if item.get('permission__api')]
-            # ********#
-            if not hasattr(request.user, "role"):
-                return False
-            role_id_list = request.user.role.values_list('id', flat=True)
-            userApiList = RoleMenuButtonPermission.objects.filter(role__in=role_id_list).values(
-                permission__api=F('menu_button__api'), permission__method=F('menu_button__method'))  # 获取当前用户的角色拥有的所有接口
-            ApiList = [
-                str(item.get('permission__api').replace('{id}', '([a-zA-Z0-9-]+)')) + ":" + str(
-                    item.get('permission__method')) + '$' for item in userApiList if item.get('permission__api')]
-            new_api_ist = api_white_list + ApiList
-            new_api = api + ":" + str(method)
-            for item in new_api_ist:
-                matchObj = re.match(item, new_api, re.M | re.I)
-                if matchObj is None:
-                    continue
-                else:
-                    return True
-            else:
-                return False
+        if not hasattr(request.user, "role"):
+            return False
+        # 白名单与角色接口已预编译，按方法一次匹配
+        return permission_index.has_permission(request.user, request.path, request.method)
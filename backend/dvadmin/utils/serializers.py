@@ -6,6 +6,7 @@
 @Created on: 2021/6/1 001 22:47
 @Remark: 自定义序列化器
 """
+from django.db.models import F, Func, QuerySet, Subquery
 from rest_framework import serializers
 from rest_framework.fields import empty
 from rest_framework.request import Request
@@ -17,27 +18,77 @@ from dvadmin.system.models import Users
 from django_restql.mixins import DynamicFieldsMixin
 
 
+def count_subquery(queryset):
+    """
+    关联子查询计数表达式，用于 annotate_fields，如 count_subquery(Menu.objects.filter(parent_id=OuterRef('pk')))
+    统一用子查询而不是 Count('反向关联')：JOIN + GROUP BY 在同时统计多个反向关联时会互相放大行数，
+    且分组会带上全部列；子查询每行独立计数，可任意组合
+    """
+    return Subquery(queryset.order_by().annotate(c=Func(F('id'), function='COUNT')).values('c'))
+
+
 class CustomModelSerializer(DynamicFieldsMixin, ModelSerializer):
     """
     增强DRF的ModelSerializer,可自动更新模型的审计字段记录
     (1)self.request能获取到rest_framework.request.Request对象
     """
 
+    # 列表查询优化声明，由 CustomModelViewSet 在列表查询时统一应用:
+    # select_related_fields / prefetch_related_fields 为对应 QuerySet 方法的参数,
+    # annotate_fields 为 {属性名: 计数表达式}(用 count_subquery 生成), SerializerMethodField 优先读取同名属性
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    annotate_fields = {}
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """按声明为整页数据预加载关联、附加聚合，避免逐行查询"""
+        if not isinstance(queryset, QuerySet) or queryset._fields is not None:
+            # values 查询集不需要也不支持关联预加载
+            return queryset
+        select_related = list(cls.select_related_fields)
+        if "creator_name" in cls._declared_fields and hasattr(queryset.model, "creator_id"):
+            select_related.append("creator")
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        if cls.annotate_fields:
+            queryset = queryset.annotate(**cls.annotate_fields)
+        return queryset
+
     # 修改人的审计字段名称, 默认modifier, 继承使用时可自定义覆盖
     modifier_field_id = "modifier"
     modifier_name = serializers.SerializerMethodField(read_only=True)
 
     def get_modifier_name(self, instance):
-        if not hasattr(instance, "modifier"):
+        if not getattr(instance, "modifier", None):
             return None
-        queryset = (
-            Users.objects.filter(id=instance.modifier)
-            .values_list("name", flat=True)
-            .first()
-        )
-        if queryset:
-            return queryset
-        return None
+        return self.get_modifier_name_map(instance).get(str(instance.modifier))
+
+    def get_modifier_name_map(self, instance):
+        """
+        修改人 id -> 姓名
+        作为顶层列表（视图传入的整页数据）的子序列化器时只查询一次，结果挂在列表序列化器上复用；
+        嵌套列表字段的 instance 为空，每个父对象的数据不同，只能按当前对象查询
+        """
+        owner = self.parent if isinstance(self.parent, serializers.ListSerializer) else None
+        if owner is None or owner.parent is not None or not isinstance(owner.instance, (list, tuple, QuerySet)):
+            return self._load_modifier_names([instance])
+        name_map = getattr(owner, "_modifier_name_map", None)
+        if name_map is None:
+            name_map = owner._modifier_name_map = self._load_modifier_names(owner.instance)
+        return name_map
+
+    @staticmethod
+    def _load_modifier_names(rows) -> dict:
+        user_ids = {str(row.modifier) for row in rows if str(getattr(row, "modifier", None) or "").isdigit()}
+        if not user_ids:
+            return {}
+        return {
+            str(user_id): name
+            for user_id, name in Users.objects.filter(id__in=user_ids).values_list("id", "name")
+        }
 
     # 创建人的审计字段名称, 默认creator, 继承使用时可自定义覆盖
     creator_field_id = "creator"
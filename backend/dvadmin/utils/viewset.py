@@ -32,6 +32,7 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
     (3)filter_fields = '__all__' 默认支持全部model中的字段查询(除json字段外)
     (4)import_field_dict={} 导入时的字段字典 {model值: model的label}
     (5)export_field_label = [] 导出时的字段
+    (6)列表查询按序列化器声明的 select_related/prefetch_related/annotate 预加载, 见 setup_eager_loading
     """
     values_queryset = None
     ordering_fields = '__all__'
@@ -54,6 +55,12 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
             return self.values_queryset
         return super().get_queryset()
 
+    def setup_eager_loading(self, queryset, serializer_class=None):
+        """应用序列化器声明的关联预加载和聚合（CustomModelSerializer.setup_eager_loading）"""
+        serializer_class = serializer_class or self.get_serializer_class()
+        setup = getattr(serializer_class, 'setup_eager_loading', None)
+        return setup(queryset) if setup else queryset
+
     def get_serializer_class(self):
         action_serializer_name = f"{self.action}_serializer_class"
         action_serializer_class = getattr(self, action_serializer_name, None)
@@ -100,7 +107,7 @@ class CustomModelViewSet(ModelViewSet, ImportSerializerMixin, ExportSerializerMi
         return DetailResponse(data=serializer.data, msg="新增成功")
 
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
+        queryset = self.setup_eager_loading(self.filter_queryset(self.get_queryset()))
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True, request=request)
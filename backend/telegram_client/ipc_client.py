@@ -0,0 +1,202 @@
+# telegram_client/ipc_client.py
+import asyncio
+import itertools
+import logging
+import threading
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+from .ipc_protocol import get_socket_path, pack_frame, read_frame, available_codecs, DEFAULT_CODEC
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncIPCClient:
+    """
+    监听进程 IPC 异步客户端（长连接、多路复用）
+
+    同一连接上可并发发起多个请求，按请求 id 匹配响应；
+    连接断开时所有等待中的请求抛出 ConnectionError，下次请求自动重连。
+    codecs 为希望使用的编码（按优先级），建立连接时与服务端协商，
+    默认优先 msgpack；传入 ['json'] 则不协商直接使用 JSON（兼容旧版服务端）。
+    """
+
+    def __init__(self, path: str, timeout: float = 30, codecs=None):
+        self.path = path
+        self.timeout = timeout
+        self.codecs = available_codecs() if codecs is None else list(codecs)
+        self.codec = DEFAULT_CODEC
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._streams: Dict[int, asyncio.Queue] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    @classmethod
+    def for_phone(cls, phone: str, **kwargs) -> 'AsyncIPCClient':
+        return cls(get_socket_path(phone), **kwargs)
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self.connected:
+                return
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+            self.codec = DEFAULT_CODEC
+            if self.codecs and self.codecs != [DEFAULT_CODEC]:
+                await self._negotiate()
+            self._read_task = asyncio.create_task(self._read_loop())
+
+    async def _negotiate(self):
+        """编码协商，服务端不认识 hello 时保持 JSON"""
+        self._writer.write(pack_frame({'id': 0, 'command': 'hello', 'codecs': self.codecs}))
+        await self._writer.drain()
+        reply = await asyncio.wait_for(read_frame(self._reader), timeout=self.timeout)
+        if reply.get('status') == 'success' and reply.get('codec') in self.codecs:
+            self.codec = reply['codec']
+
+    async def _read_loop(self):
+        error = ConnectionError("IPC 连接已关闭")
+        try:
+            while True:
+                frame = await read_frame(self._reader, self.codec)
+                request_id = frame.get('id')
+                if request_id in self._streams:
+                    self._streams[request_id].put_nowait(frame)
+                    continue
+                future = self._pending.pop(request_id, None)
+                if future and not future.done():
+                    future.set_result(frame)
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as e:
+            logger.warning(f"IPC 响应读取失败: {str(e)}")
+            error = ConnectionError(str(e))
+        finally:
+            self._fail_pending(error)
+            if self._writer:
+                self._writer.close()
+
+    def _fail_pending(self, error: Exception):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+        for queue in self._streams.values():
+            queue.put_nowait(error)
+
+    async def _send(self, request_id: int, command: str, payload: dict):
+        await self.connect()
+        async with self._write_lock:
+            self._writer.write(pack_frame({'id': request_id, 'command': command, **payload}, self.codec))
+            await self._writer.drain()
+
+    async def request(self, command: str, timeout: float = None, **payload) -> dict:
+        """发送请求并等待响应"""
+        future = asyncio.get_running_loop().create_future()
+        request_id = next(self._ids)
+        # 先登记再发送，避免响应先于登记到达
+        self._pending[request_id] = future
+        try:
+            await self._send(request_id, command, payload)
+            return await asyncio.wait_for(future, timeout=timeout or self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def stream(self, command: str, **payload) -> AsyncIterator[dict]:
+        """发送流式请求，逐个返回 data，结束帧带 done"""
+        queue: asyncio.Queue = asyncio.Queue()
+        request_id = next(self._ids)
+        self._streams[request_id] = queue
+        try:
+            await self._send(request_id, command, payload)
+            while True:
+                frame = await asyncio.wait_for(queue.get(), timeout=self.timeout)
+                if isinstance(frame, Exception):
+                    raise frame
+                if frame.get('stream'):
+                    yield frame['data']
+                    continue
+                if frame.get('status') != 'success':
+                    raise RuntimeError(f"IPC 流式请求失败: {frame}")
+                return
+        finally:
+            self._streams.pop(request_id, None)
+
+    async def close(self):
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        if self._read_task:
+            await asyncio.gather(self._read_task, return_exceptions=True)
+        self._writer = None
+        self._reader = None
+
+
+class IPCClient:
+    """
+    IPC 同步客户端（供 Django 视图、Celery 任务使用）
+
+    所有连接运行在一个后台线程的事件循环中，调用方线程阻塞等待结果，
+    连接在多次调用之间保持打开。
+    """
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _loop_lock = threading.Lock()
+
+    def __init__(self, path: str, timeout: float = 30, codecs=None):
+        self.timeout = timeout
+        self._client = AsyncIPCClient(path, timeout=timeout, codecs=codecs)
+
+    @classmethod
+    def for_phone(cls, phone: str, **kwargs) -> 'IPCClient':
+        return cls(get_socket_path(phone), **kwargs)
+
+    @classmethod
+    def _get_loop(cls) -> asyncio.AbstractEventLoop:
+        with cls._loop_lock:
+            if cls._loop is None or cls._loop.is_closed():
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(target=cls._loop.run_forever, name='ipc-client-loop', daemon=True).start()
+            return cls._loop
+
+    def _run(self, coro, timeout: float = None):
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+        return future.result(timeout=(timeout or self.timeout) + 1)
+
+    def request(self, command: str, timeout: float = None, **payload) -> dict:
+        return self._run(self._client.request(command, timeout=timeout, **payload), timeout)
+
+    def stream(self, command: str, **payload) -> Iterator[dict]:
+        iterator = self._client.stream(command, **payload)
+        try:
+            while True:
+                try:
+                    yield self._run(iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self._run(iterator.aclose())
+
+    def close(self):
+        self._run(self._client.close())
+
+
+_clients: Dict[str, IPCClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_ipc_client(phone: str) -> IPCClient:
+    """按手机号复用同步客户端（进程内共享长连接）"""
+    with _clients_lock:
+        client = _clients.get(phone)
+        if client is None:
+            client = _clients[phone] = IPCClient.for_phone(phone)
+        return client
@@ -0,0 +1,86 @@
+# telegram_client/ipc_protocol.py
+"""
+监听进程 IPC 协议（Unix socket）
+
+帧格式: 4 字节大端长度头 + 编码后的数据（默认 JSON）
+- 请求不带 id：旧协议，一问一答后服务端关闭连接
+- 请求带 id：长连接模式，同一连接可连续发送多个请求（流水线），
+  服务端并发处理，响应带回相同 id，顺序不保证
+- 流式响应：先返回若干 {"id": .., "stream": true, "data": {...}}，
+  最后返回 {"id": .., "status": .., "done": true}
+- 编码协商：连接建立后客户端可先发送 {"id": 0, "command": "hello", "codecs": ["msgpack", "json"]}（JSON），
+  服务端回复 {"id": 0, "status": "success", "codec": "msgpack"} 后双方改用选定编码；
+  不协商则始终使用 JSON。msgpack 为可选依赖，未安装时只会选中 JSON
+"""
+import asyncio
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+HEADER = struct.Struct('!I')
+# 单帧上限，防止异常长度头导致一次性分配大内存
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def get_socket_path(phone: str) -> str:
+    """根据手机号生成 socket 路径，示例: /tmp/tg_79991234567.sock"""
+    phone_clean = phone.replace('+', '').strip()
+    return f"/tmp/tg_{phone_clean}.sock"
+
+
+DEFAULT_CODEC = 'json'
+
+CODECS = {
+    'json': (
+        lambda message: json.dumps(message).encode(),
+        lambda data: json.loads(data.decode()),
+    ),
+}
+if msgpack is not None:
+    CODECS['msgpack'] = (
+        lambda message: msgpack.packb(message, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False),
+    )
+
+
+def available_codecs() -> list:
+    """本端支持的编码，按优先级排列（二进制编码优先）"""
+    return [name for name in ('msgpack', 'json') if name in CODECS]
+
+
+def choose_codec(offered) -> str:
+    """从对端提供的编码列表中选出第一个本端支持的编码"""
+    for name in offered or []:
+        if name in CODECS:
+            return name
+    return DEFAULT_CODEC
+
+
+def encode(message: dict, codec: str = DEFAULT_CODEC) -> bytes:
+    return CODECS[codec][0](message)
+
+
+def decode(data: bytes, codec: str = DEFAULT_CODEC) -> dict:
+    return CODECS[codec][1](data)
+
+
+def pack_frame(message: dict, codec: str = DEFAULT_CODEC) -> bytes:
+    data = encode(message, codec)
+    return HEADER.pack(len(data)) + data
+
+
+async def read_raw_frame(reader: asyncio.StreamReader) -> bytes:
+    """读取一帧原始数据，对端关闭时抛出 IncompleteReadError"""
+    header = await reader.readexactly(HEADER.size)
+    msg_len = HEADER.unpack(header)[0]
+    if msg_len > MAX_FRAME_SIZE:
+        raise ValueError(f"帧长度超出限制: {msg_len}")
+    return await reader.readexactly(msg_len)
+
+
+async def read_frame(reader: asyncio.StreamReader, codec: str = DEFAULT_CODEC) -> dict:
+    return decode(await read_raw_frame(reader), codec)
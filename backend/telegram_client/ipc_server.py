@@ -6,18 +6,27 @@ import struct
 from pathlib import Path
 import logging
 from asgiref.sync import sync_to_async
-from django.db import close_old_connections
 from django.utils import timezone
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 from .models import Telegram
+from .utils import listener_state
+from .utils.heartbeat import last_active_writer
+from .ipc_protocol import get_socket_path, pack_frame, read_raw_frame, decode, choose_codec, DEFAULT_CODEC
 
 logger = logging.getLogger(__name__)
 
 
 class EnhancedIPCServer:
-    def __init__(self, client: TelegramClient, tg_account: Telegram):
+    # 单个长连接上同时处理的请求数上限
+    max_inflight = 64
+
+    def __init__(self, client: TelegramClient, tg_account: Telegram, message_writer=None, media_fetcher=None):
         self.client = client
         self.tg_account = tg_account
+        self.message_writer = message_writer
+        self.media_fetcher = media_fetcher
+        self.heartbeat = None
         self.pid = os.getpid()
         self.sock_path = self._get_socket_path()
         self.server = None
@@ -25,8 +34,7 @@ class EnhancedIPCServer:
 
     def _get_socket_path(self) -> str:
         """生成符合模型要求的 IPC 地址"""
-        phone_clean = self.tg_account.phone_number.replace('+', '').strip()
-        return f"/tmp/tg_{phone_clean}.sock"  # 示例: /tmp/tg_79991234567.sock
+        return get_socket_path(self.tg_account.phone_number)  # 示例: /tmp/tg_79991234567.sock
 
     async def _cleanup_socket(self):
         """清理残留的 socket 文件"""
@@ -39,24 +47,11 @@ class EnhancedIPCServer:
             logger.error(f"Socket 清理失败: {str(e)}")
             raise
 
-    async def _update_account_status(self, status: str):
-        """原子化更新账户状态"""
-        try:
-            @sync_to_async
-            def _update():
-                Telegram.objects.filter(pk=self.tg_account.pk).update(
-                    status=status,
-                    last_active=timezone.now()
-                )
-
-            await _update()
-        except Exception as e:
-            logger.error(f"状态更新失败: {str(e)}")
-        finally:
-            close_old_connections()
-
     async def start(self):
-        """启动 IPC 服务器并更新进程信息"""
+        """
+        启动 IPC 服务器并登记进程信息（状态迁移到 online）
+        服务器在后台接受连接，start 立即返回，由调用方负责保持进程运行
+        """
         try:
             await self._cleanup_socket()
 
@@ -66,71 +61,173 @@ class EnhancedIPCServer:
                 path=self.sock_path
             )
 
-            # 更新进程信息到 Telegram 模型
-            @sync_to_async
-            def update_process_info():
-                Telegram.objects.filter(pk=self.tg_account.pk).update(
-                    process_id=self.pid,
-                    process_url=f"unix:{self.sock_path}",
-                    process_result=1,  # 1=正常
-                    status=Telegram.Status.ONLINE
-                )
-
-            await update_process_info()
+            await listener_state.atransition(
+                self.tg_account, listener_state.ONLINE,
+                process_id=self.pid, process_url=f"unix:{self.sock_path}"
+            )
 
             logger.info(f"IPC 服务器已启动: {self.sock_path} (PID: {self.pid})")
 
-            # 保持服务器运行
-            async with self.server:
-                await self.server.serve_forever()
-
         except Exception as e:
             logger.critical(f"服务器启动失败: {str(e)}", exc_info=True)
-            await self._update_account_status(Telegram.Status.ERROR)
+            await listener_state.atransition(self.tg_account, listener_state.ERROR)
             raise
 
     async def _handle_connection(self, reader, writer):
-        """处理客户端连接"""
+        """处理客户端连接（旧协议一问一答；带 id 的请求走长连接多路复用）"""
         self._connections.add(writer)
+        # 每个连接独立的编码与写锁，[codec] 便于在协商后原地切换
+        codec = [DEFAULT_CODEC]
+        write_lock = asyncio.Lock()
+        inflight = set()
+        limiter = asyncio.Semaphore(self.max_inflight)
         try:
-            # 读取协议头
-            header = await reader.readexactly(4)
-            msg_len = struct.unpack('!I', header)[0]
-
-            # 读取完整消息
-            data = await reader.readexactly(msg_len)
-            request = json.loads(data.decode())
-
-            # 命令路由
-            handler = {
-                'send_message': self._handle_send_message,
-                'get_status': self._handle_get_status,
-                'update_session': self._handle_update_session
-            }.get(request.get('command'))
-
-            if not handler:
-                response = {'status': 'error', 'code': 'invalid_command'}
-            else:
-                response = await handler(request)
-
-            # 发送响应
-            response_data = json.dumps(response).encode()
-            writer.write(struct.pack('!I', len(response_data)) + response_data)
-            await writer.drain()
-
-        except (asyncio.IncompleteReadError, struct.error) as e:
+            while True:
+                try:
+                    data = await read_raw_frame(reader)
+                except asyncio.IncompleteReadError:
+                    # 对端关闭连接
+                    break
+                try:
+                    request = decode(data, codec[0])
+                except Exception:
+                    logger.warning(f"无效的 {codec[0]} 数据")
+                    error_code = 'invalid_json' if codec[0] == 'json' else 'invalid_payload'
+                    await self._send(writer, write_lock, {'status': 'error', 'code': error_code}, codec)
+                    continue
+
+                if isinstance(request, dict) and request.get('command') == 'hello':
+                    # 编码协商：用当前编码回复，之后的帧改用选定编码
+                    chosen = choose_codec(request.get('codecs'))
+                    await self._send(writer, write_lock, {'id': request.get('id'), 'status': 'success', 'codec': chosen}, codec)
+                    codec[0] = chosen
+                    continue
+
+                if not isinstance(request, dict) or 'id' not in request:
+                    # 旧协议：处理完即关闭
+                    response = await self._dispatch(request if isinstance(request, dict) else {})
+                    await self._send(writer, write_lock, response, codec)
+                    break
+
+                # 长连接：并发处理，超出上限时暂停读取（背压）
+                await limiter.acquire()
+                task = asyncio.create_task(self._serve_request(request, writer, write_lock, codec))
+                inflight.add(task)
+
+                def _done(t):
+                    inflight.discard(t)
+                    limiter.release()
+
+                task.add_done_callback(_done)
+
+        except (struct.error, ValueError) as e:
             logger.warning(f"协议解析错误: {str(e)}")
-            response = {'status': 'error', 'code': 'protocol_error'}
-        except json.JSONDecodeError:
-            logger.warning("无效的 JSON 格式")
-            response = {'status': 'error', 'code': 'invalid_json'}
+            await self._send(writer, write_lock, {'status': 'error', 'code': 'protocol_error'}, codec)
         except Exception as e:
             logger.error("请求处理异常", exc_info=True)
-            response = {'status': 'error', 'code': 'server_error'}
+            await self._send(writer, write_lock, {'status': 'error', 'code': 'server_error'}, codec)
         finally:
+            if inflight:
+                await asyncio.gather(*inflight, return_exceptions=True)
             writer.close()
             self._connections.discard(writer)
 
+    def _get_handler(self, command):
+        """命令路由"""
+        return {
+            'send_message': self._handle_send_message,
+            'get_status': self._handle_get_status,
+            'update_session': self._handle_update_session,
+            'ping': self._handle_ping,
+            'download_media': self._handle_download_media,
+        }.get(command)
+
+    def _get_stream_handler(self, command):
+        """流式命令路由（处理函数为异步生成器）"""
+        return {
+            'send_batch': self._handle_send_batch,
+            'backfill': self._handle_backfill,
+        }.get(command)
+
+    async def _dispatch(self, request):
+        handler = self._get_handler(request.get('command'))
+        if not handler:
+            return {'status': 'error', 'code': 'invalid_command'}
+        try:
+            return await handler(request)
+        except Exception:
+            logger.error("请求处理异常", exc_info=True)
+            return {'status': 'error', 'code': 'server_error'}
+
+    async def _serve_request(self, request, writer, write_lock, codec):
+        """处理长连接上的单个请求，响应带回请求 id"""
+        request_id = request['id']
+        stream_handler = self._get_stream_handler(request.get('command'))
+        try:
+            if stream_handler:
+                async for chunk in stream_handler(request):
+                    await self._send(writer, write_lock, {'id': request_id, 'stream': True, 'data': chunk}, codec)
+                response = {'status': 'success', 'done': True}
+            else:
+                response = await self._dispatch(request)
+        except Exception:
+            logger.error("请求处理异常", exc_info=True)
+            response = {'status': 'error', 'code': 'server_error', 'done': True}
+        response['id'] = request_id
+        await self._send(writer, write_lock, response, codec)
+
+    @staticmethod
+    async def _send(writer, write_lock, response, codec):
+        """写出一帧（同一连接上的并发响应串行写）"""
+        if writer.is_closing():
+            return
+        try:
+            async with write_lock:
+                writer.write(pack_frame(response, codec[0]))
+                await writer.drain()
+        except (ConnectionError, RuntimeError) as e:
+            logger.warning(f"响应发送失败: {str(e)}")
+
+    async def _handle_ping(self, request):
+        return {'status': 'success', 'timestamp': timezone.now().isoformat()}
+
+    async def _handle_send_batch(self, request):
+        """批量发送，逐个目标流式返回结果"""
+        message = request['message']
+        for target in request.get('targets', []):
+            result = await self._handle_send_message({'target': target, 'message': message})
+            yield {'target': target, **result}
+
+    async def _handle_backfill(self, request):
+        """使用监听器自身的会话回填历史消息，流式返回进度，最后一帧 event=done 为汇总"""
+        from .utils.history_backfill import HistoryBackfiller
+
+        progress: asyncio.Queue = asyncio.Queue()
+        backfiller = HistoryBackfiller(
+            self.client, self.tg_account,
+            page_size=int(request.get('page_size') or 100),
+            rate=int(request.get('rate') or 120),
+            concurrency=int(request.get('concurrency') or 4),
+            dialogs=request.get('dialogs'),
+            progress=progress.put_nowait,
+        )
+        task = asyncio.create_task(backfiller.run())
+        try:
+            while True:
+                getter = asyncio.ensure_future(progress.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    # 任务已结束：取完剩余进度后退出，异常在此抛出
+                    while not progress.empty():
+                        yield progress.get_nowait()
+                    task.result()
+                    return
+                yield getter.result()
+        finally:
+            if not task.done():
+                task.cancel()
+
     async def _handle_send_message(self, request):
         """处理消息发送请求"""
         try:
@@ -145,22 +242,46 @@ class EnhancedIPCServer:
                 message=message
             )
 
-            await self._update_account_status(Telegram.Status.ONLINE)
+            last_active_writer.touch(self.tg_account.id)
 
             return {
                 'status': 'success',
                 'message_id': result.id,
                 'timestamp': timezone.now().isoformat()
             }
+        except FloodWaitError as e:
+            logger.warning(f"消息发送触发 FloodWait: {e.seconds} 秒")
+            return {
+                'status': 'error',
+                'code': 'flood_wait',
+                'seconds': e.seconds,
+                'detail': str(e)
+            }
         except Exception as e:
             logger.error(f"消息发送失败: {str(e)}")
-            await self._update_account_status(Telegram.Status.ERROR)
             return {
                 'status': 'error',
                 'code': 'send_failed',
                 'detail': str(e)
             }
 
+    async def _handle_download_media(self, request):
+        """按需下载消息媒体：{"peer": 会话ID, "msg_id": 消息ID, "wait": 是否等待下载完成}"""
+        if self.media_fetcher is None:
+            return {'status': 'error', 'code': 'media_disabled'}
+        try:
+            peer = request['peer']
+            msg_id = int(request['msg_id'])
+            if not request.get('wait', True):
+                message = await self.client.get_messages(peer, ids=msg_id)
+                self.media_fetcher.check_downloadable(message, msg_id)
+                queued = self.media_fetcher.enqueue(message) is not None
+                return {'status': 'success' if queued else 'error', 'queued': queued}
+            return {'status': 'success', 'data': await self.media_fetcher.fetch(peer, msg_id)}
+        except Exception as e:
+            logger.error(f"媒体下载失败: {str(e)}")
+            return {'status': 'error', 'code': 'download_failed', 'detail': str(e)}
+
     async def _handle_get_status(self, request):
         """获取账户状态信息"""
 
@@ -182,7 +303,10 @@ class EnhancedIPCServer:
                 'last_active': account.last_active.isoformat() if account.last_active else None,
                 'is_verified': account.is_verified,
                 'device_model': account.device_model,
-                'app_version': account.app_version
+                'app_version': account.app_version,
+                'ingestion': self.message_writer.stats() if self.message_writer else None,
+                'media': self.media_fetcher.stats() if self.media_fetcher else None,
+                'heartbeat': self.heartbeat.stats() if self.heartbeat else None
             }
         }
 
@@ -210,28 +334,19 @@ class EnhancedIPCServer:
         logger.info("正在关闭 IPC 服务器...")
 
         # 关闭所有连接
-        for writer in self._connections:
+        for writer in list(self._connections):
             writer.close()
-            await writer.wait_closed()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
 
         # 停止服务器
         if self.server:
             self.server.close()
             await self.server.wait_closed()
 
-        # 清理 socket 文件
+        # 清理 socket 文件（进程状态由监听进程退出时统一迁移）
         await self._cleanup_socket()
 
-        # 更新进程状态
-        @sync_to_async
-        def _clean_process():
-            Telegram.objects.filter(pk=self.tg_account.pk).update(
-                process_result=3,  # 2=丢失
-                process_id=None,
-                process_url='',
-                status=Telegram.Status.OFFLINE
-            )
-
-        await _clean_process()
-
         logger.info("IPC 服务器已关闭")
\ No newline at end of file
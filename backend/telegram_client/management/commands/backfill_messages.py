@@ -0,0 +1,106 @@
+# telegram_client/management/commands/backfill_messages.py
+import asyncio
+import logging
+
+from django.core.management.base import BaseCommand
+
+from telegram_client.ipc_client import AsyncIPCClient
+from telegram_client.models import Telegram
+from telegram_client.utils.client_pool import client_pool
+from telegram_client.utils.history_backfill import HistoryBackfiller
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "回填指定账号的历史消息（按会话分页拉取，从回填水位断点续传，补齐监听停机造成的空缺）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--phone',
+            type=str,
+            required=True,
+            help='要回填的 Telegram 账户电话号码'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='同时回填的会话数'
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=100,
+            help='每次请求拉取的消息条数（Telegram 单次上限 100）'
+        )
+        parser.add_argument(
+            '--rate',
+            type=int,
+            default=120,
+            help='整个账号每分钟最多请求的页数'
+        )
+        parser.add_argument(
+            '--dialogs',
+            type=int,
+            default=None,
+            help='只回填最近的 N 个会话，默认全部'
+        )
+
+    def handle(self, *args, **options):
+        asyncio.run(self.async_handle(options))
+
+    async def async_handle(self, options):
+        phone = options['phone']
+        try:
+            account = await Telegram.objects.aget(phone_number=phone)
+        except Telegram.DoesNotExist:
+            self.stdout.write(self.style.ERROR(f"账号 {phone} 未注册"))
+            return
+
+        params = {
+            'page_size': options['page_size'],
+            'rate': options['rate'],
+            'concurrency': options['concurrency'],
+            'dialogs': options['dialogs'],
+        }
+        try:
+            if account.status == Telegram.Status.ONLINE:
+                # 监听进程已持有该会话，交给监听进程回填，避免同一会话建立第二条连接
+                summary = await self._backfill_via_listener(phone, params)
+            else:
+                async with client_pool.borrow(phone) as client:
+                    summary = await HistoryBackfiller(client, account, progress=self._report, **params).run()
+        except Exception as e:
+            logger.error(f"回填失败: {str(e)}", exc_info=True)
+            self.stdout.write(self.style.ERROR(f"错误: {str(e)}"))
+            return
+        finally:
+            await client_pool.close_all()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"回填完成！写入 {summary['saved']} 条，失败会话 {summary['failed']} 个，"
+            f"耗时 {summary['elapsed']} 秒（{summary['saved'] / max(summary['elapsed'], 1e-6):.1f} 条/秒）"
+        ))
+
+    async def _backfill_via_listener(self, phone: str, params: dict) -> dict:
+        # FloodWait 期间监听进程可能长时间没有进度帧，放宽单帧超时
+        client = AsyncIPCClient.for_phone(phone, timeout=3600)
+        summary = None
+        try:
+            async for progress in client.stream('backfill', **params):
+                self._report(progress)
+                if progress.get('event') == 'done':
+                    summary = progress
+        finally:
+            await client.close()
+        if summary is None:
+            raise RuntimeError("监听进程未返回回填结果")
+        return summary
+
+    def _report(self, progress: dict):
+        event = progress.get('event')
+        if event == 'start':
+            self.stdout.write(f"共 {progress['dialogs']} 个会话，已有回填水位的会话 {progress['resumable']} 个")
+        elif event == 'flood_wait':
+            self.stdout.write(f"会话 {progress['dialog']} 触发 FloodWait，等待 {progress['seconds']} 秒")
@@ -0,0 +1,95 @@
+# telegram_client/management/commands/ipc_benchmark.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from telegram_client.ipc_protocol import CODECS, encode, decode
+
+
+def sample_payloads() -> dict:
+    """具有代表性的 IPC 请求/响应"""
+    now = '2024-01-01T12:00:00.000000+00:00'
+    return {
+        'send_message': {
+            'id': 1024,
+            'command': 'send_message',
+            'target': 7827632988,
+            'message': '您好，这是一条测试消息，包含一些中文内容和 emoji 😀' * 3,
+        },
+        'send_message_reply': {
+            'id': 1024,
+            'status': 'success',
+            'message_id': 123456,
+            'timestamp': now,
+        },
+        'get_status_reply': {
+            'id': 2048,
+            'status': 'success',
+            'data': {
+                'phone': '+8613812345678',
+                'status': 'online',
+                'process': {'id': 12345, 'url': 'unix:/tmp/tg_8613812345678.sock', 'result': 1},
+                'last_active': now,
+                'is_verified': True,
+                'device_model': 'AsyncListenerDaemon/v3.0',
+                'app_version': '1.36.0',
+                'ingestion': {'queue_depth': 12, 'flush_count': 3400, 'flushed_messages': 120000,
+                              'failed_messages': 0, 'last_flush_latency': 0.0123, 'avg_flush_latency': 0.0101},
+            },
+        },
+        'send_batch': {
+            'id': 4096,
+            'command': 'send_batch',
+            'message': '活动通知：本周末全场八折',
+            'targets': list(range(7000000000, 7000000500)),
+        },
+        'message_list': {
+            'id': 8192,
+            'status': 'success',
+            'data': [
+                {
+                    'telegram_msg_id': 100000 + i,
+                    'sender_id': 7827632988,
+                    'receiver_id': 5512345678,
+                    'content': f'第 {i} 条消息内容',
+                    'timestamp': now,
+                    'media_info': {'type': 'document', 'file_id': 5123456789012345678, 'size': 1048576},
+                }
+                for i in range(100)
+            ],
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = "IPC 编码性能对比（JSON / msgpack）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=10000,
+            help='每种负载的编解码次数'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        if 'msgpack' not in CODECS:
+            self.stdout.write(self.style.WARNING("未安装 msgpack，仅测试 JSON"))
+
+        self.stdout.write(f"{'负载':<20}{'编码':<10}{'字节数':>8}{'编码 µs':>12}{'解码 µs':>12}")
+        for name, payload in sample_payloads().items():
+            for codec in CODECS:
+                data = encode(payload, codec)
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    encode(payload, codec)
+                encode_us = (time.perf_counter() - start) / iterations * 1e6
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    decode(data, codec)
+                decode_us = (time.perf_counter() - start) / iterations * 1e6
+
+                self.stdout.write(f"{name:<20}{codec:<10}{len(data):>8}{encode_us:>12.2f}{decode_us:>12.2f}")
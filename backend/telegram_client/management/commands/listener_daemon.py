@@ -16,10 +16,19 @@ from telegram_client.ipc_server import EnhancedIPCServer
 from asgiref.sync import sync_to_async
 from django.core.cache import cache
 from telegram_client.utils.verification import CodeManager
+from telegram_client.utils.message_buffer import MessageBatchWriter
+from telegram_client.utils.entity_cache import EntityCache
+from telegram_client.utils.presence import PresenceTracker
+from telegram_client.utils.media_fetcher import MediaFetcher
+from telegram_client.utils import listener_state
+from telegram_client.utils.heartbeat import Heartbeat, last_active_writer
+from telegram_client.utils.avatar import download_avatar, account_avatar_path, sync_contact_avatars
+from telegram_client.utils.message_parser import build_message_data
+from telegram_client.utils.contact_sync import fetch_contacts, save_contacts_hash, upsert_contacts, \
+    get_existing_contacts, sync_account_contacts
 from telethon.tl.types import PeerUser, PeerChat, PeerChannel, MessageMediaPoll, UserStatusRecently, UserStatusOffline, \
     UserStatusLastWeek, UserStatusOnline, UserStatusLastMonth
 from telegram_client.models import Message, MessageType
-from telethon.tl.functions.contacts import GetContactsRequest
 from telethon.tl.types import InputUser
 
 logger = logging.getLogger(__name__)
@@ -28,6 +37,12 @@ logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = "启动 Telegram 异步消息监听守护进程（支持会话重连）"
+    message_writer: Optional[MessageBatchWriter] = None
+    entity_cache: Optional[EntityCache] = None
+    presence: Optional[PresenceTracker] = None
+    media_fetcher: Optional[MediaFetcher] = None
+    avatar_task: Optional[asyncio.Task] = None
+    heartbeat: Optional[Heartbeat] = None
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -46,89 +61,32 @@ class Command(BaseCommand):
     async def _message_handler(self, event: events.NewMessage.Event):
         """异步消息处理（存储到数据库）"""
         try:
-            logger.info(event)
             # 获取消息基本信息
             # 消息id
             # 消息内容
             # 消息发出or接收
             # 是否at
-            direction = "in"
-            sender = await event.get_sender()
-            chat = await event.get_chat()
-            # 判断发送还是接收
-            if event.message.out:
-                direction = "send"
-            # 判断消息类型 个人 群组 频道。。
-            peer = event.message.peer_id
-            message_type = MessageType.PRIVATE  # 默认为私聊
-
-            if isinstance(peer, PeerUser):
-                message_type = MessageType.PRIVATE
-                logger.info(message_type.value)
-                logger.info("这是一个个人消息（私聊）")
-                logger.info(event)
-            elif isinstance(peer, PeerChat):
-                message_type = MessageType.GROUP
-                logger.info(message_type.value)
-                logger.info("这是一个群组消息")
-            elif isinstance(peer, PeerChannel):
-                message_type = MessageType.CHANNEL
-                logger.info(message_type.value)
-                logger.info("这是一个频道消息")
-            else:
-                logger.info("未知类型的消息")
-            # 解析媒体信息
-            media_info = None
-            if event.media:
-                if isinstance(event.media, MessageMediaPoll):
-                    # 处理投票
-                    media_info = {
-                        "type": "poll",
-                        "poll_id": event.media.poll.id,
-                        "question": event.media.poll.question.text,
-                        "options": [answer.text.text for answer in event.media.poll.answers],
-                        "closed": event.media.poll.closed
-                    }
-                else:
-                    # 处理其他媒体
-                    media_type = "unknown"
-                    file_id = None
-                    size = None
-
-                    if event.photo:
-                        media_type = "photo"
-                    elif event.video:
-                        media_type = "video"
-                    elif event.document:
-                        media_type = "document"
-                        file_id = event.media.document.id
-                        size = event.media.document.size
-
-                    media_info = {
-                        "type": media_type,
-                        "file_id": file_id,
-                        "size": size
-                    }
-
-            # 构建消息记录
-            message_data = {
-                "account": self.account,  # 当前监听账号
-                "direction": direction,  # 接收的消息
-                "content": event.raw_text,  # 原始消息内容
-                "media_info": media_info,  # 媒体信息
-                "timestamp": event.date,  # 消息时间
-                "sender_id": sender.id,  # 发送方ID
-                "receiver_id": chat.id,  # 接收方ID（当前账号）
-                "telegram_msg_id": event.id,  # Telegram消息ID
-                "is_service_msg": event.action is not None,  # 是否为系统消息
-                "message_type":message_type.value,  # 保存枚举的值
-
-
-            }
-
-            # 异步保存到数据库
+            message_data = build_message_data(self.account, event.message)
+            # 更新带过来的实体顺手放入缓存
+            if event.sender is not None:
+                self.entity_cache.set_entity(event.sender)
+            if event.chat is not None:
+                self.entity_cache.set_entity(event.chat)
+            # 发送方/会话名称直接读缓存，不 await get_sender()/get_chat()
+            sender_id, receiver_id = message_data['sender_id'], message_data['receiver_id']
+            logger.info(
+                f"收到消息 {message_data['telegram_msg_id']} | 类型: {message_data['message_type']} | "
+                f"会话: {self.entity_cache.display_name(receiver_id) or receiver_id} | "
+                f"发送方: {self.entity_cache.display_name(sender_id) or sender_id}"
+            )
+
+            # 放入批量写入队列
             await self._save_message(message_data)
 
+            # 媒体只在开启自动下载时入队，下载在后台进行不阻塞入库
+            if event.message.media and self.media_fetcher and self.media_fetcher.should_auto_download(event.message):
+                self.media_fetcher.enqueue(event.message)
+
             # 日志记录
             # logger.info(
             #     "收到新消息",
@@ -148,11 +106,16 @@ class Command(BaseCommand):
             )
             logger.info(str(e))
 
-    @sync_to_async
-    def _save_message(self, message_data):
-        """异步保存消息到数据库"""
+    async def _user_update_handler(self, event: events.UserUpdate.Event):
+        """在线状态变化只记入内存，由 PresenceTracker 定时合并写库"""
+        if event.status is None or self.presence is None:
+            return
+        self.presence.update(event.user_id, event.status)
+
+    async def _save_message(self, message_data):
+        """消息进入批量写入队列（队列满时等待）"""
         try:
-            Message.objects.create(**message_data)
+            await self.message_writer.put(message_data)
         except Exception as e:
             logger.error(f"消息保存失败: {str(e)}")
             raise
@@ -176,29 +139,13 @@ class Command(BaseCommand):
                 await self._update_session(account, client.session.save())
 
             me = await client.get_me()
-            # 获取头像
-            avatar_bytes = await client.download_profile_photo(entity="me",file=bytes,download_big=False)
-            logger.info("打印头像信息")
-            # logger.info(avatar_bytes)
-            save_dir = os.path.join(settings.MEDIA_ROOT, 'telegram_avatars')
-            os.makedirs(save_dir, exist_ok=True)
-            file_name = f"avatar_{me.id}.jpg"
-            filepath = os.path.join(save_dir, file_name)
-            avatar_path = None
-            if avatar_bytes:
-                with open(filepath, 'wb') as f:
-                    f.write(avatar_bytes)
-                    avatar_path = os.path.join('telegram_avatars', file_name)
-                    logger.info(avatar_path)
-                    #保存到数据库
-
-
-
-
-
-
+            # 获取头像（photo_id 未变化时跳过下载）
+            avatar_photo_id, avatar_path = await download_avatar(
+                client, me, account.avatar_photo_id, account_avatar_path(me.id)
+            )
+            logger.info(f"头像: photo_id={avatar_photo_id}, 已更新={bool(avatar_path)}")
 
-            await self._update_telegram_id(account, me.id, avatar_path)
+            await self._update_telegram_id(account, me.id, avatar_path, avatar_photo_id)
             logger.info(me.id)
             logger.info(
                 "客户端连接成功",
@@ -221,114 +168,50 @@ class Command(BaseCommand):
     # 新增联系人同步方法
     async def _sync_contacts(self, client: TelegramClient, account: Telegram):
         """同步联系人信息到数据库"""
-        from telegram_client.models import TelegramContact
-
-        # 获取所有联系人
-        contacts = await client(GetContactsRequest(hash=0))
+        # 带上次的哈希拉取联系人，未变化时服务端不返回列表
+        contacts = await fetch_contacts(client, account)
 
         # 获取数据库现有记录（批量查询优化）
         existing_contacts = await self._get_existing_contacts(account)
 
-        updates = []
-        new_contacts = []
-
-        for contact in contacts.users:
-            # 生成状态文本
-            status_content = self._get_status_text(contact.status)
-            logger.info(contact)
-            # 构建当前数据
-            current_data = {
-                "phone_number": contact.phone,
-                "username": contact.username,
-                "first_name": contact.first_name,
-                "last_name": contact.last_name,
-                "user_status": status_content,
-                "premium": contact.premium
-            }
-            logger.info(current_data)
-            # 检查是否已存在记录
-            if contact.id in existing_contacts:
-                db_contact = existing_contacts[contact.id]
-
-                # 检查字段变化
-                if self._is_contact_changed(db_contact, current_data):
-                    # 更新变化字段
-                    db_contact.phone_number = current_data['phone_number']
-                    db_contact.username = current_data['username']
-                    db_contact.first_name = current_data['first_name']
-                    db_contact.last_name = current_data['last_name']
-                    db_contact.user_status = current_data['user_status']
-                    db_contact.premium = current_data['premium']
-                    updates.append(db_contact)
-            else:
-                # 创建新记录
-                new_contacts.append(
-                    TelegramContact(
-                        account=account,
-                        contact_id=contact.id,
-                        **current_data
-                    )
-                )
-
-        # 批量操作
-        await self._bulk_db_operations(new_contacts, updates)
+        # 预热实体缓存：先放数据库记录，再用服务端最新数据覆盖
+        if self.entity_cache is not None:
+            for db_contact in existing_contacts.values():
+                self.entity_cache.set_contact(db_contact)
+            for user in (contacts.users if contacts else []):
+                self.entity_cache.set_entity(user)
+
+        if contacts is not None:
+            await sync_to_async(upsert_contacts)(account, contacts.users, existing=existing_contacts)
+
+        # 联系人头像在后台同步，只下载 photo_id 变化的；哈希在头像同步完成后才保存
+        self.avatar_task = asyncio.create_task(self._sync_contact_avatars(client, account, contacts))
+
+    async def _sync_contact_avatars(self, client: TelegramClient, account: Telegram, contacts):
+        """
+        联系人头像同步
+        头像 photo_id 不参与联系人哈希，头像变化不会让服务端返回新列表，
+        因此按 TG_CONTACT_AVATAR_REFRESH_INTERVAL 定期拉取完整列表比对；
+        哈希在本轮头像同步完成后才保存，中途取消或失败时下次启动仍会拉取完整列表重试
+        """
+        interval = getattr(settings, 'TG_CONTACT_AVATAR_REFRESH_INTERVAL', 6 * 3600)
+        while True:
+            try:
+                if contacts is not None:
+                    await sync_contact_avatars(client, account, contacts.users)
+                    await save_contacts_hash(account, contacts)
+                else:
+                    await sync_account_contacts(client, account, avatars=True)
+            except Exception as e:
+                logger.error(f"联系人头像同步失败: {str(e)}")
+            contacts = None
+            await asyncio.sleep(interval)
 
     @sync_to_async
     def _get_existing_contacts(self, account):
         """获取当前账号的现有联系人"""
-        return {
-            c.contact_id: c
-            for c in TelegramContact.objects.filter(account=account)
-        }
-
-    def _get_status_text(self, status):
-        """获取状态文本（复用你的现有逻辑）"""
-        if isinstance(status, UserStatusOnline):
-            return "在线"
-        elif isinstance(status, UserStatusOffline):
-            time_str = status.was_online.strftime("%Y-%m-%d %H:%M:%S")
-            return f"离线 (最后在线: {time_str})"
-        elif isinstance(status, UserStatusRecently):
-            return "最近在线 (24小时内)"
-        elif isinstance(status, UserStatusLastWeek):
-            return "过去一周内活跃"
-        elif isinstance(status, UserStatusLastMonth):
-            return "过去一月内活跃"
-        else:
-            return "未知状态"
-
-    def _is_contact_changed(self, db_contact, current_data):
-        """检查联系人信息是否变化"""
-        fields_to_check = [
-            'phone_number', 'username',
-            'first_name', 'last_name',
-            'user_status', 'premium'
-        ]
-        return any(
-            getattr(db_contact, field) != current_data[field]
-            for field in fields_to_check
-        )
+        return get_existing_contacts(account)
 
-    @sync_to_async
-    def _bulk_db_operations(self, new_contacts, updates):
-        """执行批量数据库操作"""
-        from django.db import transaction
-
-        with transaction.atomic():
-            if new_contacts:
-                TelegramContact.objects.bulk_create(new_contacts, batch_size=100)
-
-            if updates:
-                fields = [
-                    'phone_number', 'username',
-                    'first_name', 'last_name',
-                    'user_status', 'premium'
-                ]
-                TelegramContact.objects.bulk_update(updates, fields, batch_size=100)
-
-        logger.info(
-            f"联系人同步完成: 新增 {len(new_contacts)} 条, 更新 {len(updates)} 条"
-        )
     async def _validate_session(self, client: TelegramClient) -> bool:
         """深度验证会话有效性"""
         try:
@@ -340,26 +223,16 @@ class Command(BaseCommand):
     async def _relogin(self, client: TelegramClient, account: Telegram):
         """优化后的重新登录方法"""
         logger.warning("检测到会话失效，开始重新登录...")
+        await listener_state.atransition(account, listener_state.LOGIN)
         max_retries = 3
         retry_count = 0
 
         async def code_callback():
             logger.info(f"等待验证码输入 | 手机号: {account.phone_number}")
-            start_time = time.time()
-
-            while time.time() - start_time < 300:
-                # 获取最新有效验证码（事务内操作）
-                valid_code = await CodeManager.get_valid_code(account.phone_number)
-                logger.info("获取到验证码：")
-
-                if valid_code and valid_code.code:
-                    logger.info(f"获取到验证码: {valid_code.code}")
-                    await CodeManager.mark_used(valid_code.id)
-                    return valid_code.code
-
-                await asyncio.sleep(1)
-
-            raise asyncio.TimeoutError("验证码等待超时")
+            # 订阅验证码到达通知，收到后立即返回，不再每秒查库
+            code = await CodeManager.wait_for_code(account.phone_number, timeout=300)
+            logger.info(f"获取到验证码: {code}")
+            return code
 
 
         while retry_count < max_retries:
@@ -438,15 +311,16 @@ class Command(BaseCommand):
             logger.info("会话信息已更新")
 
     @sync_to_async
-    def _update_telegram_id(self, account: Telegram, telegram_id: int,avatar_path:str=None):
-        """异步更新数据库会话"""
-        with transaction.atomic():
-            logger.info(avatar_path)
-            account.telegram_id = telegram_id
-            account.avatar = avatar_path
-            account.save(update_fields=['avatar'])
-            account.save(update_fields=['telegram_id'])
-            logger.info("Telegram_id已更新")
+    def _update_telegram_id(self, account: Telegram, telegram_id: int, avatar_path: str = None, avatar_photo_id: int = 0):
+        """异步更新数据库会话（头像只在重新下载或已删除时更新）"""
+        account.telegram_id = telegram_id
+        update_fields = ['telegram_id']
+        if avatar_path or avatar_photo_id != account.avatar_photo_id:
+            account.avatar = avatar_path or (account.avatar if avatar_photo_id else None)
+            account.avatar_photo_id = avatar_photo_id
+            update_fields += ['avatar', 'avatar_photo_id']
+        account.save(update_fields=update_fields)
+        logger.info("Telegram_id已更新")
     async def _run_listener(self, phone: str, max_retries: int):
         """增强版监听主逻辑"""
         retry_count = 0
@@ -473,49 +347,50 @@ class Command(BaseCommand):
                                 phone_number=phone,
                                 status__in=[Telegram.Status.ONLINE, Telegram.Status.CONNECTING,Telegram.Status.OFFLINE]
                             )
-                            if acc.status != Telegram.Status.CONNECTING:
-                                acc.status = Telegram.Status.CONNECTING
-                                acc.save(update_fields=['status'])
+                            listener_state.transition(acc, listener_state.CONNECTING, process_id=os.getpid())
                             return acc
                     logger.info("查询数据")
                     account = await atomic_get_account()
                     logger.info(f"成功获取账户: {account.phone_number}")
 
-                    # 初始化客户端
+                    # 初始化客户端（联系人同步时会预热实体缓存）
+                    self.entity_cache = EntityCache()
                     client = await self._init_client(account)
                     logger.info('正在注册消息处理器...')
 
+                    # 启动消息批量写入器
+                    self.message_writer = MessageBatchWriter()
+                    self.message_writer.start()
+                    # 启动媒体下载器（按需/自动下载）
+                    self.media_fetcher = MediaFetcher(client, account)
+                    self.media_fetcher.start()
+
                     # 注册新消息处理器
                     client.add_event_handler(
                         self._message_handler,
                         events.NewMessage()
                     )
+                    # 联系人在线状态实时跟踪
+                    self.presence = PresenceTracker(account)
+                    self.presence.start()
+                    client.add_event_handler(
+                        self._user_update_handler,
+                        events.UserUpdate()
+                    )
                     self.account = account
                     # 启动IPC服务器并更新进程信息
-                    ipc_server = EnhancedIPCServer(client, account)
+                    ipc_server = EnhancedIPCServer(
+                        client, account, message_writer=self.message_writer, media_fetcher=self.media_fetcher
+                    )
+                    # 启动后登记进程信息并迁移到 online
                     await ipc_server.start()
-
-                    @sync_to_async
-                    def update_process_info():
-                        account.process_id = ipc_server.process_id
-                        account.process_url = ipc_server.process_url
-                        account.process_result = 1  # 正常
-                        account.save(update_fields=['process_id', 'process_url', 'process_result'])
-
-                    await update_process_info()
-                    # 更新状态为在线
-                    @sync_to_async
-                    def set_online():
-                        account.status = Telegram.Status.ONLINE
-                        account.save(update_fields=['status'])
-                    await set_online()
                     retry_count = 0  # 重置重试计数器
-                    # 保持连接（带心跳检测）
-                    while True:
-                        if not await self._validate_session(client):
-                            logger.warning("检测到会话失效，触发重新连接")
-                            break
-                        await asyncio.sleep(60)
+                    # 保持连接：以更新流为心跳，长时间静默才确认授权状态
+                    self.heartbeat = Heartbeat(client, account)
+                    self.heartbeat.start()
+                    ipc_server.heartbeat = self.heartbeat
+                    await self.heartbeat.wait_unhealthy()
+                    logger.warning("检测到会话失效，触发重新连接")
 
                 except (SessionExpiredError, SessionRevokedError) as e:
                     logger.warning(f"会话过期/撤销 (重试 {retry_count + 1}/{max_retries})")
@@ -532,11 +407,7 @@ class Command(BaseCommand):
             if retry_count >= max_retries:
                 logger.critical("达到最大重试次数，永久终止监听")
 
-                @sync_to_async
-                def set_error_status():
-                    account.status = Telegram.Status.ERROR
-                    account.save(update_fields=['status'])
-                await set_error_status()
+                await listener_state.atransition(account, listener_state.ERROR)
 
         except Exception as e:
             logger.critical("监听进程启动失败", exc_info=True)
@@ -546,22 +417,38 @@ class Command(BaseCommand):
         """异步资源清理"""
         cleanup_tasks = []
         try:
+            # 先断开客户端不再接收新消息，再把缓冲区剩余消息落库
+            if self.heartbeat:
+                self.heartbeat.stop()
+                self.heartbeat = None
+                await last_active_writer.flush()
+            if self.avatar_task:
+                self.avatar_task.cancel()
+                await asyncio.gather(self.avatar_task, return_exceptions=True)
+                self.avatar_task = None
+            if self.media_fetcher:
+                await self.media_fetcher.stop()
+                self.media_fetcher = None
             if client and client.is_connected():
-                cleanup_tasks.append(client.disconnect())
+                await client.disconnect()
+            if self.message_writer:
+                await self.message_writer.stop()
+                self.message_writer = None
+            if self.presence:
+                await self.presence.stop()
+                self.presence = None
+            if self.entity_cache is not None:
+                logger.info(f"实体缓存统计: {self.entity_cache.stats()}")
             if ipc_server:
                 cleanup_tasks.append(ipc_server.stop())
             if account:
                 @sync_to_async
                 def update_resources():
-                    account.refresh_from_db()
-                    # 更新状态为离线
-                    if account.status != Telegram.Status.ERROR:
-                        account.status = Telegram.Status.OFFLINE
-                    # 清理进程信息
-                    account.process_result = 3  # 未启用
-                    account.process_id = None
-                    account.process_url = ''
-                    account.save(update_fields=['status', 'process_result', 'process_id', 'process_url'])
+                    # 更新状态为离线（已是错误状态则保持），同时清理进程信息
+                    current = listener_state.get_state(account.phone_number)
+                    state = listener_state.ERROR if current and current['state'] == listener_state.ERROR \
+                        else listener_state.OFFLINE
+                    listener_state.transition(account, state)
 
                 cleanup_tasks.append(update_resources())
 
@@ -0,0 +1,228 @@
+# telegram_client/management/commands/listener_supervisor.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import time
+from typing import Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from telegram_client.models import Telegram
+from telegram_client.management.commands.listener_daemon import Command as ListenerCommand
+from telegram_client.utils.listener_state import SUPERVISED_KEY, STOP_KEY
+
+logger = logging.getLogger(__name__)
+
+# 分片资源统计
+SHARD_KEY = 'listener_shard_{index}'
+# 监听连续运行超过该秒数视为恢复正常，重连退避从头计算
+HEALTHY_RUN_SECONDS = 300
+
+
+class Command(BaseCommand):
+    help = "在单个事件循环中托管多个 Telegram 账号监听（支持多进程分片）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--phones',
+            nargs='*',
+            default=None,
+            help='要托管的手机号列表，不传则托管所有已有会话的账号'
+        )
+        parser.add_argument(
+            '--shards',
+            type=int,
+            default=1,
+            help='工作进程（分片）数量，账号按 id 取模分配'
+        )
+        parser.add_argument(
+            '--shard-index',
+            type=int,
+            default=None,
+            help='只运行指定分片（内部使用或由外部进程管理器逐个启动）'
+        )
+        parser.add_argument(
+            '--max-retries',
+            type=int,
+            default=3,
+            help='单个账号会话失效时的最大重试次数'
+        )
+        parser.add_argument(
+            '--reconcile-interval',
+            type=int,
+            default=30,
+            help='账号列表对账及资源统计间隔（秒）'
+        )
+
+    def handle(self, *args, **options):
+        shards = max(1, options['shards'])
+        if options['shard_index'] is not None or shards == 1:
+            self._run_shard_process(options['shard_index'] or 0, shards, options)
+            return
+
+        # 多分片：fork 前关闭数据库连接，避免子进程共享连接
+        connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        processes = [
+            ctx.Process(
+                target=self._run_shard_process,
+                args=(index, shards, options),
+                name=f"tg-listener-shard-{index}",
+            )
+            for index in range(shards)
+        ]
+        for process in processes:
+            process.start()
+            logger.info(f"分片 {process.name} 已启动 (PID: {process.pid})")
+
+        def _terminate(signum, frame):
+            for p in processes:
+                if p.is_alive():
+                    p.terminate()
+
+        signal.signal(signal.SIGTERM, _terminate)
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            _terminate(None, None)
+            for process in processes:
+                process.join()
+
+    def _run_shard_process(self, shard_index: int, shards: int, options: dict):
+        """分片进程入口：独立事件循环"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._run_shard(shard_index, shards, options))
+        except KeyboardInterrupt:
+            logger.info("用户主动终止进程")
+        finally:
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+    async def _run_shard(self, shard_index: int, shards: int, options: dict):
+        """对账循环：按需启动/停止/重连本分片内的账号"""
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, stop_event.set)
+
+        tasks: Dict[str, asyncio.Task] = {}
+        listeners: Dict[str, ListenerCommand] = {}
+        restarts: Dict[str, int] = {}
+        restart_at: Dict[str, float] = {}
+        started_at: Dict[str, float] = {}
+        logger.info(f"分片 {shard_index}/{shards} 启动 (PID: {os.getpid()})")
+
+        try:
+            while not stop_event.is_set():
+                wanted = await self._get_shard_phones(shard_index, shards, options['phones'])
+                now = time.monotonic()
+
+                # 停止不再需要的账号（停止标记 / ERROR / 不在指定列表），等待退出后注销托管标记，
+                # 否则 start_listener 会一直认为该账号已被托管而拒绝启动
+                released = [phone for phone in dict.fromkeys([*tasks, *restart_at]) if phone not in wanted]
+                cancelled = [tasks.pop(phone) for phone in released if phone in tasks]
+                for task in cancelled:
+                    task.cancel()
+                await asyncio.gather(*cancelled, return_exceptions=True)
+                for phone in released:
+                    for state in (listeners, restarts, restart_at, started_at):
+                        state.pop(phone, None)
+                    logger.info(f"账号 {phone} 已停止托管")
+
+                # 启动新账号 / 重连已退出的账号（指数退避）
+                started = []
+                for phone in wanted:
+                    task = tasks.get(phone)
+                    if task is not None:
+                        if not task.done():
+                            if restarts.get(phone) and now - started_at[phone] >= HEALTHY_RUN_SECONDS:
+                                restarts.pop(phone)
+                            continue
+                        tasks.pop(phone)
+                        restarts[phone] = restarts.get(phone, 0) + 1
+                        restart_at[phone] = now + min(300, 2 ** restarts[phone])
+                        logger.warning(f"账号 {phone} 监听退出，{int(restart_at[phone] - now)} 秒后重连")
+                    if now < restart_at.get(phone, 0):
+                        continue
+                    listener = ListenerCommand()
+                    listeners[phone] = listener
+                    tasks[phone] = asyncio.create_task(
+                        listener._run_listener(phone, options['max_retries']),
+                        name=f"listener-{phone}",
+                    )
+                    started_at[phone] = now
+                    started.append(phone)
+
+                await self._mark_supervised(started, released)
+                await self._report(shard_index, wanted, tasks, listeners, restarts)
+
+                try:
+                    await asyncio.wait_for(stop_event.wait(), timeout=options['reconcile_interval'])
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            await self._mark_supervised([], list(listeners))
+            logger.info(f"分片 {shard_index} 已退出")
+
+    @sync_to_async
+    def _get_shard_phones(self, shard_index: int, shards: int, phones: Optional[List[str]]) -> List[str]:
+        """
+        一次查询获取本分片应托管的账号
+        排除带停止标记的账号和 ERROR 账号（会话失效/被撤销，拉起也会被拒绝，只会反复退避重启）
+        """
+        queryset = Telegram.objects.exclude(session_string='').exclude(status=Telegram.Status.ERROR)
+        if phones:
+            queryset = queryset.filter(phone_number__in=phones)
+        rows = queryset.values_list('id', 'phone_number')
+        shard_phones = [phone for pk, phone in rows if pk % shards == shard_index]
+        stopped = cache.get_many([STOP_KEY.format(phone=phone) for phone in shard_phones])
+        return [phone for phone in shard_phones if STOP_KEY.format(phone=phone) not in stopped]
+
+    @sync_to_async
+    def _mark_supervised(self, started: List[str], released: List[str]):
+        """批量登记/注销托管标记"""
+        if started:
+            cache.set_many({SUPERVISED_KEY.format(phone=phone): os.getpid() for phone in started}, timeout=None)
+        if released:
+            cache.delete_many([SUPERVISED_KEY.format(phone=phone) for phone in released])
+
+    async def _report(self, shard_index, wanted, tasks, listeners, restarts):
+        """分片资源统计：写入缓存并打印日志"""
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        queue_depth = sum(
+            listener.message_writer.stats()['queue_depth']
+            for listener in listeners.values() if listener.message_writer
+        )
+        heartbeat_ages = [
+            listener.heartbeat.age for listener in listeners.values() if listener.heartbeat
+        ]
+        report = {
+            'shard': shard_index,
+            'pid': os.getpid(),
+            'accounts': len(wanted),
+            'running': sum(1 for task in tasks.values() if not task.done()),
+            'restarts': sum(restarts.values()),
+            'asyncio_tasks': len(asyncio.all_tasks()),
+            'queue_depth': queue_depth,
+            'max_heartbeat_age': round(max(heartbeat_ages), 1) if heartbeat_ages else None,
+            'max_rss_kb': usage.ru_maxrss,
+            'cpu_user': round(usage.ru_utime, 2),
+            'cpu_system': round(usage.ru_stime, 2),
+            'updated': time.time(),
+        }
+        await sync_to_async(cache.set)(SHARD_KEY.format(index=shard_index), report, timeout=600)
+        logger.info(f"分片资源统计: {report}")
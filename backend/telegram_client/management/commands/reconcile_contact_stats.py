@@ -0,0 +1,56 @@
+# telegram_client/management/commands/reconcile_contact_stats.py
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max
+
+from telegram_client.models import Telegram, TelegramContact, Message, MessageType
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "根据消息记录重建联系人的消息总数和最后互动时间（一次 GROUP BY 汇总）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--phone',
+            type=str,
+            default=None,
+            help='只校正指定账号，默认全部账号'
+        )
+
+    def handle(self, *args, **options):
+        messages = Message.objects.filter(message_type=MessageType.PRIVATE.value)
+        contacts = TelegramContact.objects.all()
+        if options['phone']:
+            try:
+                account = Telegram.objects.get(phone_number=options['phone'])
+            except Telegram.DoesNotExist:
+                raise CommandError(f"账号 {options['phone']} 未注册")
+            messages = messages.filter(account=account)
+            contacts = contacts.filter(account=account)
+
+        # 私聊会话ID即联系人ID
+        aggregates = {
+            (row['account_id'], row['receiver_id']): (row['total'], row['latest'])
+            for row in messages.values('account_id', 'receiver_id').annotate(
+                total=Count('id'), latest=Max('timestamp')
+            )
+        }
+
+        changed = []
+        for contact in contacts.only('id', 'account_id', 'contact_id', 'message_count', 'last_interaction'):
+            total, latest = aggregates.get((contact.account_id, contact.contact_id), (0, None))
+            if contact.message_count != total or contact.last_interaction != latest:
+                contact.message_count = total
+                contact.last_interaction = latest
+                changed.append(contact)
+
+        with transaction.atomic():
+            TelegramContact.objects.bulk_update(changed, ['message_count', 'last_interaction'], batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"校正完成！汇总 {len(aggregates)} 个会话，更新 {len(changed)} 个联系人"
+        ))
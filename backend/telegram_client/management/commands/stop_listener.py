@@ -2,8 +2,12 @@
 import os
 import signal
 import logging
+from django.core.cache import cache
 from django.core.management.base import BaseCommand
 from telegram_client.models import Telegram
+from telegram_client.utils import listener_state
+from telegram_client.utils.listener_reaper import is_listener_process
+from telegram_client.utils.listener_state import SUPERVISED_KEY, STOP_KEY
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +33,18 @@ class Command(BaseCommand):
             logger.warning(f"账号 {options['phone']} 没有运行中的监听进程")
             return
 
+        if cache.get(SUPERVISED_KEY.format(phone=account.phone_number)):
+            # 由 supervisor 托管：同进程还有其他账号，只写停止标记，由 supervisor 停止该账号
+            cache.set(STOP_KEY.format(phone=account.phone_number), 1, timeout=None)
+            logger.info(f"已通知 supervisor 停止账号 {options['phone']}")
+            return
+
+        # 进程已不存在或 PID 已被其他进程复用时不发信号，只清理状态
+        if not is_listener_process(account.process_id, account.phone_number):
+            logger.warning(f"进程 {account.process_id} 已不是监听进程，仅清理状态")
+            listener_state.transition(account, listener_state.OFFLINE)
+            return
+
         # 发送终止信号
         try:
             os.kill(account.process_id, signal.SIGTERM)
@@ -38,16 +54,7 @@ class Command(BaseCommand):
         except PermissionError:
             logger.error(f"无权限终止进程 {account.process_id}")
 
-        # 清理数据库状态
-        account.process_id = None
-        account.process_url = ''
-        account.process_result = 3  # 3表示已停止
-        account.status = Telegram.Status.OFFLINE
-        account.save(update_fields=[
-            'process_id',
-            'process_url',
-            'process_result',
-            'status'
-        ])
+        # 清理进程状态（数据库与缓存）
+        listener_state.transition(account, listener_state.OFFLINE)
 
         logger.info(f"已停止 {options['phone']} 的监听进程")
\ No newline at end of file
@@ -1,32 +1,45 @@
 # sync_contacts.py
 import asyncio
 import logging
-from django.core.management.base import BaseCommand
-from django.conf import settings
-from telethon.tl.functions.contacts import GetContactsRequest
-from telethon.tl.types import UserStatusOnline, UserStatusOffline
+from django.core.management.base import BaseCommand, CommandError
 
 from telegram_client.models import Telegram
-from telethon import TelegramClient
-from telethon.sessions import StringSession
+from telegram_client.utils.client_pool import client_pool
+from telegram_client.utils.contact_sync import sync_account_contacts
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
-    help = "手动触发指定 Telegram 账户的联系人同步"
+    help = "手动触发指定 Telegram 账户（或全部账户）的联系人同步"
 
     def add_arguments(self, parser):
-        parser.add_argument(
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument(
             '--account-id',
             type=int,
-            required=True,
             help='要同步的 Telegram 账户数据库 ID'
         )
+        group.add_argument(
+            '--all-accounts',
+            action='store_true',
+            help='同步所有已登录的账户'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='--all-accounts 时同时同步的账户数'
+        )
         parser.add_argument(
             '--force',
             action='store_true',
-            help='强制全量同步（忽略最近更新时间）'
+            help='强制全量同步（忽略已保存的联系人哈希）'
+        )
+        parser.add_argument(
+            '--avatars',
+            action='store_true',
+            help='同时同步联系人头像（只下载有变化的）'
         )
 
     def handle(self, *args, **options):
@@ -34,107 +47,49 @@ class Command(BaseCommand):
         asyncio.run(self.async_handle(options))
 
     async def async_handle(self, options):
-        account_id = options['account_id']
         force_update = options['force']
+        avatars = options['avatars']
 
-        try:
-            # 获取账户对象
-            account = await self.get_account(account_id)
+        if options['all_accounts']:
+            accounts = [
+                account async for account in Telegram.objects.exclude(session_string='')
+            ]
+        else:
+            accounts = [await self.get_account(options['account_id'])]
 
-            # 初始化客户端
-            async with TelegramClient(
-                    session=StringSession(account.session_string),
-                    api_id=settings.TG_API_ID,
-                    api_hash=settings.TG_API_HASH
-            ) as client:
-                await client.connect()
+        semaphore = asyncio.Semaphore(max(options['concurrency'], 1))
 
-                # 执行同步逻辑
-                result = await self.sync_contacts(client, account, force_update)
+        async def _run(account):
+            async with semaphore:
+                return await self.sync_contacts(account, force_update, avatars)
 
-                # 输出结果
+        try:
+            results = await asyncio.gather(*[_run(account) for account in accounts], return_exceptions=True)
+        finally:
+            await client_pool.close_all()
+
+        for account, result in zip(accounts, results):
+            if isinstance(result, Exception):
+                logger.error(f"账号 {account.phone_number} 同步失败: {str(result)}")
+                self.stdout.write(self.style.ERROR(f"{account.phone_number} 错误: {str(result)}"))
+            elif result.get('not_modified'):
+                self.stdout.write(f"{account.phone_number} 联系人未变化")
+            else:
                 self.stdout.write(self.style.SUCCESS(
-                    f"同步成功！新增 {result['created']} 条，更新 {result['updated']} 条"
+                    f"{account.phone_number} 同步成功！新增 {result['created']} 条，更新 {result['updated']} 条"
+                    + (f"，头像更新 {result['avatars']} 个" if 'avatars' in result else '')
                 ))
 
-        except Exception as e:
-            logger.error(f"同步失败: {str(e)}")
-            self.stdout.write(self.style.ERROR(f"错误: {str(e)}"))
-
     @staticmethod
     async def get_account(account_id: int) -> Telegram:
         """异步获取账户实例"""
         try:
             return await Telegram.objects.aget(id=account_id)
         except Telegram.DoesNotExist:
-            raise ValueError(f"ID 为 {account_id} 的账户不存在")
-
-    async def sync_contacts(self, client: TelegramClient, account: Telegram, force: bool) -> dict:
-        """执行联系人同步的核心逻辑"""
-        from telegram_client.models import TelegramContact
-
-        # 获取所有联系人
-        contacts = await client(GetContactsRequest(hash=0))
-
-        # 获取现有记录
-        existing_contacts = {
-            c.contact_id: c
-            async for c in TelegramContact.objects.filter(account=account)
-        }
-
-        created = 0
-        updated = 0
-
-        # 遍历处理每个联系人
-        for contact in contacts.users:
-            status_text = self.parse_user_status(contact.status)
-
-            contact_data = {
-                'phone_number': contact.phone,
-                'username': contact.username,
-                'first_name': contact.first_name,
-                'last_name': contact.last_name,
-                'user_status': status_text,
-                'premium': contact.premium
-            }
-
-            if contact.id in existing_contacts:
-                # 更新逻辑
-                db_contact = existing_contacts[contact.id]
-                if force or self.is_contact_changed(db_contact, contact_data):
-                    await self.update_contact(db_contact, contact_data)
-                    updated += 1
-            else:
-                # 新建逻辑
-                await TelegramContact.objects.acreate(
-                    account=account,
-                    contact_id=contact.id,
-                    **contact_data
-                )
-                created += 1
-
-        return {'created': created, 'updated': updated}
-
-    def parse_user_status(self, status):
-        """解析用户在线状态（复用现有逻辑）"""
-        if isinstance(status, UserStatusOnline):
-            return "在线"
-        elif isinstance(status, UserStatusOffline):
-            return f"离线 (最后在线: {status.was_online.strftime('%Y-%m-%d %H:%M:%S')}"
-        # ...其他状态处理...
-        else:
-            return "未知状态"
-
-    def is_contact_changed(self, db_contact, new_data) -> bool:
-        """检查联系人是否变化"""
-        return any(
-            getattr(db_contact, field) != new_data[field]
-            for field in ['phone_number', 'username', 'first_name', 'last_name', 'user_status', 'premium']
-        )
+            raise CommandError(f"ID 为 {account_id} 的账户不存在")
 
     @staticmethod
-    async def update_contact(db_contact, new_data):
-        """异步更新联系人"""
-        for field, value in new_data.items():
-            setattr(db_contact, field, value)
-        await db_contact.asave(update_fields=new_data.keys())
\ No newline at end of file
+    async def sync_contacts(account: Telegram, force: bool, avatars: bool = False) -> dict:
+        """执行单个账号的联系人同步（拉取、比对、批量 upsert）"""
+        async with client_pool.borrow(account.phone_number) as client:
+            return await sync_account_contacts(client, account, force=force, avatars=avatars)
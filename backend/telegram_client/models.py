@@ -136,6 +136,18 @@ class Telegram(CoreModel):
         help_text="格式示例: unix:/tmp/tg_123.sock 或 tcp://127.0.0.1:5000"
     )
     avatar = models.ImageField(upload_to='telegram_avatars/',null=True, blank=True)
+    # 当前头像的 photo_id，未变化时启动不再重复下载
+    avatar_photo_id = models.BigIntegerField(
+        default=0,
+        verbose_name="头像ID",
+        help_text="已下载头像对应的 Telegram photo_id，0 表示无头像"
+    )
+    # 联系人列表哈希，下次同步时带上，服务端返回 ContactsNotModified 即可跳过全量下载
+    contacts_hash = models.BigIntegerField(
+        default=0,
+        verbose_name="联系人哈希",
+        help_text="上次联系人同步计算出的 contacts.getContacts hash，0 表示强制全量"
+    )
 
 
     # 存储前调用，如果不符合直接报错
@@ -256,9 +268,13 @@ class Message(models.Model):
         class Meta:
             verbose_name = '消息记录'
             verbose_name_plural = '消息记录'
+            # 同一账号同一会话内消息ID唯一，重连重放、历史回填可安全重复写入
+            unique_together = ('account', 'receiver_id', 'telegram_msg_id')
             indexes = [
                 models.Index(fields=['timestamp']),
-                models.Index(fields=['sender_id', 'receiver_id'])
+                models.Index(fields=['sender_id', 'receiver_id']),
+                # 按会话读取历史消息（时间范围扫描 / 会话时间线游标分页）
+                models.Index(fields=['account', 'receiver_id', 'timestamp', 'id']),
             ]
 
 
@@ -371,6 +387,12 @@ class TelegramContact(models.Model):
         verbose_name='ai会话标识',
         help_text='当用于ai回复时候对话所带的标识'
     )
+    avatar = models.ImageField(upload_to='telegram_avatars/contacts/', null=True, blank=True)
+    avatar_photo_id = models.BigIntegerField(
+        default=0,
+        verbose_name="头像ID",
+        help_text="已下载头像对应的 Telegram photo_id，0 表示无头像"
+    )
 
     # 已读状态变更
 
@@ -397,4 +419,143 @@ class TelegramContact(models.Model):
         indexes = [
             models.Index(fields=['account']),
             models.Index(fields=['user_status']),
-        ]
\ No newline at end of file
+            # 联系人按活跃度排序
+            models.Index(fields=['account', '-last_interaction']),
+        ]
+
+class BroadcastJob(CoreModel):
+    """
+    群发任务模型
+
+    状态说明：
+    - pending: 等待执行
+    - running: 执行中
+    - paused: 已暂停（可继续，从未发送的目标断点续发）
+    - completed: 已完成
+    - failed: 执行失败
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', '等待执行'
+        RUNNING = 'running', '执行中'
+        PAUSED = 'paused', '已暂停'
+        COMPLETED = 'completed', '已完成'
+        FAILED = 'failed', '执行失败'
+
+    name = models.CharField(
+        max_length=100,
+        verbose_name='任务名称'
+    )
+    message = models.TextField(
+        verbose_name='消息内容',
+        help_text='群发的文本内容'
+    )
+    targets = models.JSONField(
+        default=list,
+        verbose_name='发送目标',
+        help_text='目标列表（用户ID、用户名或手机号），首次执行时展开为发送明细'
+    )
+    accounts = models.ManyToManyField(
+        Telegram,
+        blank=True,
+        related_name='broadcast_jobs',
+        verbose_name='发送账号',
+        help_text='参与群发的账号，为空时使用所有在线账号'
+    )
+    rate_per_minute = models.PositiveIntegerField(
+        default=20,
+        verbose_name='单账号速率',
+        help_text='每个账号每分钟最多发送条数（令牌桶）'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name='任务状态'
+    )
+    total_count = models.PositiveIntegerField(default=0, verbose_name='目标总数')
+    sent_count = models.PositiveIntegerField(default=0, verbose_name='成功数')
+    failed_count = models.PositiveIntegerField(default=0, verbose_name='失败数')
+    stats = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='吞吐统计',
+        help_text='{"messages_per_sec":1.2,"accounts":{"+86...":{"sent":10,"failed":0,"flood_wait":0}}}'
+    )
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='开始时间')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='结束时间')
+
+    class Meta:
+        db_table = "telegram_broadcast_job"
+        verbose_name = '群发任务'
+        verbose_name_plural = verbose_name
+        ordering = ('-create_datetime',)
+
+
+class BroadcastTarget(models.Model):
+    """
+    群发明细（每个目标一行，作为断点续发的检查点）
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', '待发送'
+        SENT = 'sent', '已发送'
+        FAILED = 'failed', '发送失败'
+
+    job = models.ForeignKey(
+        BroadcastJob,
+        on_delete=models.CASCADE,
+        related_name='target_items',
+        verbose_name='群发任务'
+    )
+    target = models.CharField(
+        max_length=100,
+        verbose_name='发送目标'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name='发送状态'
+    )
+    account = models.ForeignKey(
+        Telegram,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        verbose_name='发送账号'
+    )
+    telegram_msg_id = models.BigIntegerField(null=True, blank=True, verbose_name='消息ID')
+    error = models.CharField(max_length=255, blank=True, default='', verbose_name='错误信息')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='发送时间')
+
+    class Meta:
+        db_table = "telegram_broadcast_target"
+        verbose_name = '群发明细'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['job', 'status']),
+        ]
+
+
+class BackfillWatermark(models.Model):
+    """
+    历史回填水位（每个账号每个会话一行）
+    watermark 及之前的消息已全部确认入库；与实时监听写入的最大消息ID无关，
+    监听停机造成的空缺在下次回填时从水位之后补齐
+    """
+    account = models.ForeignKey(
+        Telegram,
+        on_delete=models.CASCADE,
+        related_name='backfill_watermarks',
+        verbose_name='关联账号'
+    )
+    peer_id = models.BigIntegerField(verbose_name='会话ID')
+    watermark = models.BigIntegerField(default=0, verbose_name='已回填到的消息ID')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = "telegram_backfill_watermark"
+        verbose_name = '历史回填水位'
+        verbose_name_plural = verbose_name
+        unique_together = ('account', 'peer_id')
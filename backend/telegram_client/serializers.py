@@ -2,6 +2,8 @@
 
 from telegram_client.models import Telegram
 from telegram_client.models import TelegramContact
+from telegram_client.models import BroadcastJob
+from telegram_client.models import Message
 from dvadmin.utils.serializers import CustomModelSerializer
 
 
@@ -42,4 +44,36 @@ class TelegramContactModelCreateUpdateSerializer(CustomModelSerializer):
 
     class Meta:
         model = TelegramContact
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+class BroadcastJobModelSerializer(CustomModelSerializer):
+    """
+    群发任务序列化器
+    """
+
+    class Meta:
+        model = BroadcastJob
+        fields = "__all__"
+        read_only_fields = ['status', 'total_count', 'sent_count', 'failed_count', 'stats', 'started_at', 'finished_at']
+
+
+class BroadcastJobModelCreateUpdateSerializer(CustomModelSerializer):
+    """
+    群发任务创建/更新时的列化器
+    """
+
+    class Meta:
+        model = BroadcastJob
+        fields = '__all__'
+        read_only_fields = ['status', 'total_count', 'sent_count', 'failed_count', 'stats', 'started_at', 'finished_at']
+
+
+class MessageModelSerializer(CustomModelSerializer):
+    """
+    消息记录序列化器
+    """
+
+    class Meta:
+        model = Message
+        fields = "__all__"
@@ -7,6 +7,7 @@ import logging
 from celery.utils.log import get_task_logger
 from telegram_client.utils.verification import CodeManager
 from django.core.management import call_command
+from telegram_client.utils.listener_state import SUPERVISED_KEY, STOP_KEY
 logger = logging.getLogger(__name__)
 
 # 增强启动任务start_listener.delay(data.phone_number)
@@ -32,10 +33,13 @@ def start_listener(self,phone: str, max_retries: int = 3):
     """增强版监听器启动任务"""
     try:
         # 清理可能存在的残留状态
-        cache.delete_many([
-            f'code_verified_{phone}',
-            f'listener_status_{phone}'
-        ])
+        cache.delete(f'code_verified_{phone}')
+
+        # 由 supervisor 托管的账号只清除停止标记，由 supervisor 下一轮对账拉起
+        if cache.get(SUPERVISED_KEY.format(phone=phone)):
+            cache.delete(STOP_KEY.format(phone=phone))
+            logger.info(f"已通知 supervisor 启动 {phone} 的监听")
+            return {"status": "supervised", "phone": phone}
 
         # 调用管理命令（带重试参数）
         call_command(
@@ -53,8 +57,12 @@ def start_listener(self,phone: str, max_retries: int = 3):
             exc_info=True,
             extra={"phone": phone}
         )
-        # 更新缓存状态
-        cache.set(f'listener_status_{phone}', 'error', timeout=600)
+        # 更新状态（数据库与缓存）
+        from telegram_client.models import Telegram
+        from telegram_client.utils import listener_state
+        account = Telegram.objects.filter(phone_number=phone).first()
+        if account:
+            listener_state.transition(account, listener_state.ERROR)
         raise self.retry(exc=e, countdown=60)
 
 
@@ -86,17 +94,9 @@ def stop_listener(phone: str):
 
 @shared_task
 def input_code(phone_number, code):
-    """包装异步操作为同步任务"""
+    """保存验证码并通知等待中的监听进程"""
     try:
-        # 创建新的事件循环
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-        # 执行异步方法
-        result = loop.run_until_complete(
-            CodeManager.create_code(phone_number, code)
-        )
-        loop.close()
+        result = CodeManager.submit_code(phone_number, code)
 
         # 返回可序列化的简单类型
         return {
@@ -107,4 +107,46 @@ def input_code(phone_number, code):
         return {
             "success": False,
             "error": str(e)
-        }
\ No newline at end of file
+        }
+
+@shared_task
+def run_broadcast(job_id: int):
+    """执行（或断点续发）群发任务"""
+    from django.utils import timezone
+    from telegram_client.models import BroadcastJob
+    from telegram_client.utils.broadcast import BroadcastExecutor
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(BroadcastExecutor(job_id).run())
+        return {"status": "finished", "job_id": job_id}
+    except Exception as e:
+        logger.critical(f"群发任务执行失败 | 任务: {job_id}", exc_info=True)
+        # 仍为执行中说明执行器没能收尾，标记失败以便重新启动续发
+        BroadcastJob.objects.filter(pk=job_id, status=BroadcastJob.Status.RUNNING).update(
+            status=BroadcastJob.Status.FAILED, finished_at=timezone.now(), description=str(e)[:255]
+        )
+        return {"status": "error", "job_id": job_id, "error": str(e)}
+    finally:
+        loop.close()
+
+
+@shared_task
+def send_via_ipc_task(phone: str, target, message: str):
+    """通过监听进程的 IPC 长连接发送消息（复用进程内连接）"""
+    from telegram_client.ipc_client import get_ipc_client
+    try:
+        return get_ipc_client(phone).request('send_message', target=target, message=message)
+    except Exception as e:
+        logger.error(f"IPC 发送失败 | 手机号: {phone}", exc_info=True)
+        return {"status": "error", "code": "ipc_failed", "detail": str(e)}
+
+
+@shared_task
+def reap_listeners(restart: bool = None):
+    """定时巡检：标记进程已丢失的监听、清理残留 socket，可选自动重启"""
+    from django.conf import settings
+    from telegram_client.utils.listener_reaper import reap_listeners as _reap
+    if restart is None:
+        restart = getattr(settings, 'TG_REAPER_RESTART', False)
+    return _reap(restart=restart)
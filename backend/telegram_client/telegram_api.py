@@ -5,6 +5,7 @@ from telethon.errors import SessionExpiredError, AuthKeyError, RPCError
 from django.conf import settings
 from asgiref.sync import sync_to_async
 from telegram_client.models import Telegram
+from telegram_client.utils.client_pool import client_pool, ClientLoginError
 import logging
 
 logger = logging.getLogger(__name__)
@@ -55,26 +56,31 @@ asyncio.run(test_send())
 
 async def send_message(phone: str, to, text: str,file="") -> Dict:
     """
-    异步发送消息，包含完整错误处理
+    异步发送消息，包含完整错误处理（从连接池借用已登录的客户端）
     :return: 结构化的结果字典
     """
-    client = await login_with_session(phone)
-
-    # 处理登录错误
-    if isinstance(client, str):
+    try:
+        async with client_pool.borrow(phone) as client:
+            # 发送消息
+            result = await client.send_message(entity=to,message=text,file=file)
+            return {
+                "status": True,
+                "message_id": result.id,
+                "date": result.date.isoformat()
+            }
+    except ClientLoginError as e:
+        # 处理登录错误
         return {
             "status": False,
-            "error": client,
+            "error": str(e),
             "action": "请检查 session 有效性或重新登录"
         }
-
-    try:
-        # 发送消息
-        result = await client.send_message(entity=to,message=text,file=file)
+    except (SessionExpiredError, AuthKeyError) as e:
+        await client_pool.discard(phone)
         return {
-            "status": True,
-            "message_id": result.id,
-            "date": result.date.isoformat()
+            "status": False,
+            "error": f"认证失败: {type(e).__name__}",
+            "action": "请检查 session 有效性或重新登录"
         }
     except RPCError as e:
         return {
@@ -83,25 +89,23 @@ async def send_message(phone: str, to, text: str,file="") -> Dict:
             "code": e.code,
             "details": str(e)
         }
-    finally:
-        # 确保断开连接
-        if not client.is_connected():
-            await client.disconnect()
 
 # 获取好友列表
 async def get_account_list(phone):
-    client = await login_with_session(phone)
-    await client.get_peer_id('me')
+    async with client_pool.borrow(phone) as client:
+        return await client.get_peer_id('me')
 
 
 # 查询用户id
 async def query_account_user_id(phone,qure_phone):
 
     try:
-        client = await login_with_session(phone)
-        result = await client.get_peer_id(qure_phone)
-        return result
+        async with client_pool.borrow(phone) as client:
+            return await client.get_peer_id(qure_phone)
+    except ClientLoginError as e:
+        return e
     except (SessionExpiredError, AuthKeyError) as e:
+        await client_pool.discard(phone)
         return e
     except Exception as e:
         logger.info(e)
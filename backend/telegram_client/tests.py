@@ -1,4 +1,642 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import socket
+import tempfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
 # Create your tests here.
-from telegram_client.tasks import start_listener
\ No newline at end of file
+from telegram_client.tasks import start_listener, run_broadcast
+from dvadmin.utils.pagination import KeysetPagination
+from telegram_client.models import BroadcastJob, BroadcastTarget, Message, Telegram, VerificationCode
+from telegram_client.utils.broadcast import BroadcastExecutor
+from telegram_client.ipc_client import AsyncIPCClient
+from telegram_client.ipc_protocol import available_codecs, pack_frame, read_frame
+from telegram_client.ipc_server import EnhancedIPCServer
+from telegram_client.utils import heartbeat, media_fetcher
+from telegram_client.utils.heartbeat import Heartbeat, LastActiveWriter
+from telegram_client.utils.media_fetcher import MediaFetcher
+from telegram_client.utils.presence import PresenceTracker
+from telegram_client.utils.verification import CODE_CHANNEL, CodeManager
+from telethon.errors import AuthKeyUnregisteredError
+from telethon.tl.types import PeerUser, UserStatusOnline, UserStatusRecently
+from telegram_client.utils import listener_reaper, listener_state
+from telegram_client.utils.contact_sync import contacts_hash, telegram_hash
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class ContactsHashTests(SimpleTestCase):
+    """联系人哈希：按 Telegram 文档算法计算的参考值（saved_count 在前，联系人ID升序在后）"""
+
+    def test_reference_vectors(self):
+        self.assertEqual(telegram_hash([]), 0)
+        self.assertEqual(telegram_hash([0, 1, 2]), 36507222019)
+        self.assertEqual(contacts_hash([1, 2, 3]), 565224272838726)
+        self.assertEqual(contacts_hash([1, 2, 3], saved_count=2), -8569714145092255544)
+        self.assertEqual(contacts_hash([10, 20, 30, 40]), -8252450408955541530)
+        self.assertEqual(contacts_hash([1, 1000, 100000, 10000000], saved_count=2), 5582071898222047033)
+
+    def test_ids_are_sorted_and_saved_count_comes_first(self):
+        self.assertEqual(contacts_hash([40, 10, 30, 20]), contacts_hash([10, 20, 30, 40]))
+        self.assertEqual(contacts_hash([5, 9], saved_count=3), telegram_hash([3, 5, 9]))
+        self.assertNotEqual(contacts_hash([5, 9], saved_count=3), contacts_hash([5, 9]))
+
+
+class _TimelineView:
+    keyset_ordering = ('-timestamp', '-id')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.account = Telegram.objects.create(phone_number='+10000000001', login_mode=1)
+        base = timezone.now()
+        # 两两相同的时间戳，验证 (timestamp, id) 复合游标不丢不重
+        self.messages = [
+            Message.objects.create(
+                account=self.account, direction='in', content=str(i), timestamp=base + timedelta(seconds=i // 2),
+                sender_id=1, receiver_id=1, telegram_msg_id=i,
+            )
+            for i in range(7)
+        ]
+
+    def _page(self, **params):
+        request = Request(APIRequestFactory().get('/timeline/', params))
+        paginator = KeysetPagination()
+        return paginator, paginator.paginate_queryset(Message.objects.all(), request, view=_TimelineView())
+
+    def test_walks_every_row_once_in_order(self):
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 3, **({'cursor': cursor} if cursor else {})}
+            paginator, page = self._page(**params)
+            seen.extend(message.pk for message in page)
+            if not paginator.is_next:
+                self.assertIsNone(paginator.next_cursor)
+                break
+            cursor = paginator.next_cursor
+        expected = [m.pk for m in sorted(self.messages, key=lambda m: (m.timestamp, m.pk), reverse=True)]
+        self.assertEqual(seen, expected)
+
+    def test_total_only_when_requested(self):
+        paginator, _ = self._page(limit=3)
+        self.assertIsNone(paginator.total)
+        paginator, _ = self._page(limit=3, with_total=1)
+        self.assertEqual(paginator.total, 7)
+
+    def test_malformed_cursor_is_a_validation_error(self):
+        for cursor in ('not-base64!', 'WzFd', 'WyJub3QtYS1kYXRlIiwgMV0='):
+            with self.assertRaises(ValidationError):
+                self._page(cursor=cursor)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ListenerStateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.account = Telegram.objects.create(phone_number='+10000000002', login_mode=1)
+
+    def test_transition_writes_db_and_cache(self):
+        listener_state.transition(self.account, listener_state.CONNECTING)
+        listener_state.transition(self.account, listener_state.ONLINE, process_id=4321, process_url='/tmp/x.sock')
+        row = Telegram.objects.get(pk=self.account.pk)
+        self.assertEqual(row.status, Telegram.Status.ONLINE)
+        self.assertEqual(row.process_id, 4321)
+        snapshot = listener_state.get_state(self.account.phone_number)
+        self.assertEqual(snapshot['state'], listener_state.ONLINE)
+        self.assertEqual(snapshot['process_id'], 4321)
+
+    def test_terminal_state_clears_process(self):
+        listener_state.transition(self.account, listener_state.CONNECTING)
+        listener_state.transition(self.account, listener_state.ONLINE, process_id=4321)
+        listener_state.transition(self.account, listener_state.OFFLINE)
+        row = Telegram.objects.get(pk=self.account.pk)
+        self.assertEqual(row.status, Telegram.Status.OFFLINE)
+        self.assertIsNone(row.process_id)
+
+    def test_lost_is_stored_as_offline(self):
+        listener_state.transition(self.account, listener_state.LOST)
+        self.assertEqual(Telegram.objects.get(pk=self.account.pk).status, Telegram.Status.OFFLINE)
+        self.assertEqual(listener_state.get_state(self.account.phone_number)['state'], listener_state.LOST)
+
+    def test_strict_rejects_invalid_transition(self):
+        with self.assertRaises(listener_state.InvalidTransition):
+            listener_state.transition(self.account, listener_state.ONLINE, strict=True)
+        # 非严格模式只记录警告，照常写入
+        listener_state.transition(self.account, listener_state.ONLINE)
+        self.assertEqual(Telegram.objects.get(pk=self.account.pk).status, Telegram.Status.ONLINE)
+
+
+class _FakeIPCClient:
+    """按顺序返回预设结果的 IPC 客户端，结果为异常时抛出"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    async def request(self, command, **kwargs):
+        self.calls.append((command, kwargs))
+        reply = self.replies.pop(0)
+        if isinstance(reply, BaseException):
+            raise reply
+        return reply
+
+    async def close(self):
+        pass
+
+
+class BroadcastSendTests(SimpleTestCase):
+    """群发单个目标的发送、失败与放回队列路径（不触发检查点写库）"""
+
+    def setUp(self):
+        self.account = Telegram(pk=1, phone_number='+10000000003')
+        self.item = BroadcastTarget(pk=1, job_id=1, target='12345')
+
+    def send(self, client, stop=False):
+        async def _run():
+            executor = BroadcastExecutor(job_id=1, checkpoint_size=1000, checkpoint_interval=3600)
+            executor._account_stats = {self.account.phone_number: {'sent': 0, 'failed': 0, 'flood_wait': 0}}
+            if stop:
+                executor._stop.set()
+            ok = await executor._send(client, self.account, self.item)
+            return executor, ok
+        return asyncio.run(_run())
+
+    def test_success_marks_sent(self):
+        client = _FakeIPCClient({'status': 'success', 'message_id': 77})
+        executor, ok = self.send(client)
+        self.assertTrue(ok)
+        self.assertEqual(client.calls, [('send_message', {'target': 12345, 'message': ''})])
+        self.assertEqual(self.item.status, BroadcastTarget.Status.SENT)
+        self.assertEqual(self.item.telegram_msg_id, 77)
+        self.assertEqual(executor._results, [self.item])
+        self.assertTrue(executor.queue.empty())
+
+    def test_timeout_is_failed_not_requeued(self):
+        executor, ok = self.send(_FakeIPCClient(asyncio.TimeoutError()))
+        self.assertTrue(ok)
+        self.assertEqual(self.item.status, BroadcastTarget.Status.FAILED)
+        self.assertIn('超时', self.item.error)
+        self.assertTrue(executor.queue.empty())
+
+    def test_builtin_timeout_is_failed_not_requeued(self):
+        executor, ok = self.send(_FakeIPCClient(TimeoutError()))
+        self.assertTrue(ok)
+        self.assertEqual(self.item.status, BroadcastTarget.Status.FAILED)
+        self.assertTrue(executor.queue.empty())
+
+    def test_connection_error_requeues_and_stops_worker(self):
+        for error in (ConnectionRefusedError(), FileNotFoundError()):
+            with self.subTest(error=type(error).__name__):
+                executor, ok = self.send(_FakeIPCClient(error))
+                self.assertFalse(ok)
+                self.assertIs(executor.queue.get_nowait(), self.item)
+                self.assertEqual(executor._results, [])
+
+    def test_flood_wait_requeues_and_keeps_worker(self):
+        executor, ok = self.send(_FakeIPCClient({'code': 'flood_wait', 'seconds': 600}), stop=True)
+        self.assertTrue(ok)
+        self.assertIs(executor.queue.get_nowait(), self.item)
+        self.assertEqual(executor._results, [])
+        self.assertEqual(executor._account_stats[self.account.phone_number]['flood_wait'], 1)
+
+    def test_error_reply_marks_failed(self):
+        executor, ok = self.send(_FakeIPCClient({'status': 'error', 'detail': 'USER_PRIVACY_RESTRICTED'}))
+        self.assertTrue(ok)
+        self.assertEqual(self.item.status, BroadcastTarget.Status.FAILED)
+        self.assertEqual(self.item.error, 'USER_PRIVACY_RESTRICTED')
+
+
+class BroadcastTaskTests(TestCase):
+    def test_crashed_run_does_not_leave_job_running(self):
+        job = BroadcastJob.objects.create(name='t', message='hi', status=BroadcastJob.Status.RUNNING)
+        with mock.patch.object(BroadcastExecutor, 'run', side_effect=RuntimeError('boom')):
+            result = run_broadcast(job.id)
+        self.assertEqual(result['status'], 'error')
+        job.refresh_from_db()
+        self.assertEqual(job.status, BroadcastJob.Status.FAILED)
+
+
+class IsListenerProcessTests(SimpleTestCase):
+    """PID 复用保护：只认监听自身的命令行，或持有该账号 IPC socket 的进程"""
+    phone = '+10000000004'
+
+    def check(self, args, phone=phone):
+        with mock.patch.object(listener_reaper, '_read_cmdline', return_value=args):
+            return listener_reaper.is_listener_process(os.getpid(), phone)
+
+    def test_missing_process(self):
+        self.assertFalse(listener_reaper.is_listener_process(None, self.phone))
+        self.assertFalse(listener_reaper.is_listener_process(2 ** 22 + 1, self.phone))
+
+    def test_daemon_must_match_phone(self):
+        args = ['python', 'manage.py', 'listener_daemon', '--phone', self.phone, '--max-retries', '3']
+        self.assertTrue(self.check(args))
+        self.assertFalse(self.check(args, phone='+10000000005'))
+
+    def test_supervisor_matches_its_phones(self):
+        self.assertTrue(self.check(['python', 'manage.py', 'listener_supervisor', '--shards', '2']))
+        self.assertTrue(self.check(['python', 'manage.py', 'listener_supervisor', '--phones', '+1', self.phone]))
+        self.assertFalse(self.check(['python', 'manage.py', 'listener_supervisor', '--phones', '+1', '+2']))
+
+    def test_unrelated_workers_are_rejected(self):
+        for args in (
+                ['celery', '-A', 'application', 'worker'],
+                ['python', 'manage.py', 'runserver'],
+                ['python', 'manage.py', 'backfill_messages', '--phone', self.phone],
+        ):
+            with self.subTest(args=args):
+                self.assertFalse(self.check(args))
+
+    def test_celery_hosted_listener_is_matched_by_socket(self):
+        sock_path = os.path.join(tempfile.mkdtemp(), 'tg.sock')
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(sock_path)
+        self.addCleanup(server.close)
+        with mock.patch.object(listener_reaper, 'get_socket_path', return_value=sock_path):
+            self.assertTrue(self.check(['celery', '-A', 'application', 'worker']))
+        self.assertFalse(self.check(['celery', '-A', 'application', 'worker']))
+
+
+class _TestIPCServer(EnhancedIPCServer):
+    """只带测试命令的 IPC 服务端，不连接 Telegram、不写监听状态"""
+
+    def _get_handler(self, command):
+        return {'echo': self._handle_echo}.get(command)
+
+    def _get_stream_handler(self, command):
+        return {'count': self._handle_count}.get(command)
+
+    async def _handle_echo(self, request):
+        await asyncio.sleep(request.get('delay', 0))
+        return {'status': 'success', 'value': request.get('value')}
+
+    async def _handle_count(self, request):
+        for n in range(request['n']):
+            await asyncio.sleep(0)
+            yield {'n': n}
+        if request.get('fail'):
+            raise RuntimeError('stream failed')
+
+
+class IPCProtocolTests(SimpleTestCase):
+    """长连接多路复用：请求 id 匹配响应，流式响应的分帧与结束帧"""
+
+    async def _serve(self):
+        path = os.path.join(tempfile.mkdtemp(), 'ipc.sock')
+        ipc = _TestIPCServer(None, Telegram(phone_number='+10000000006'))
+        ipc.server = await asyncio.start_unix_server(ipc._handle_connection, path=path)
+        return ipc, path
+
+    async def _close(self, ipc, *clients):
+        for client in clients:
+            await client.close()
+        ipc.server.close()
+        await ipc.server.wait_closed()
+
+    async def test_pipelined_responses_match_request_ids(self):
+        ipc, path = await self._serve()
+        client = AsyncIPCClient(path, timeout=5)
+        try:
+            # 先发的请求最慢，响应乱序返回仍按 id 交给各自的调用方
+            replies = await asyncio.gather(*[
+                client.request('echo', value=i, delay=(5 - i) * 0.02) for i in range(5)
+            ])
+            self.assertEqual([reply['value'] for reply in replies], list(range(5)))
+            self.assertEqual(len(ipc._connections), 1)
+            self.assertEqual((await client.request('missing'))['code'], 'invalid_command')
+        finally:
+            await self._close(ipc, client)
+
+    async def test_stream_frames_then_done(self):
+        ipc, path = await self._serve()
+        reader, writer = await asyncio.open_unix_connection(path)
+        try:
+            writer.write(pack_frame({'id': 7, 'command': 'count', 'n': 3}))
+            writer.write(pack_frame({'id': 8, 'command': 'echo', 'value': 'x'}))
+            await writer.drain()
+            frames = [await asyncio.wait_for(read_frame(reader), 5) for _ in range(5)]
+            stream = [frame for frame in frames if frame['id'] == 7]
+            self.assertEqual(stream[:3], [{'id': 7, 'stream': True, 'data': {'n': n}} for n in range(3)])
+            self.assertEqual(stream[3], {'id': 7, 'status': 'success', 'done': True})
+            self.assertEqual([frame for frame in frames if frame['id'] == 8],
+                             [{'id': 8, 'status': 'success', 'value': 'x'}])
+        finally:
+            writer.close()
+            await self._close(ipc)
+
+    async def test_client_stream_and_errors(self):
+        ipc, path = await self._serve()
+        client = AsyncIPCClient(path, timeout=5)
+        try:
+            self.assertEqual([chunk async for chunk in client.stream('count', n=4)], [{'n': n} for n in range(4)])
+            received = []
+            with self.assertRaises(RuntimeError):
+                async for chunk in client.stream('count', n=2, fail=True):
+                    received.append(chunk)
+            self.assertEqual(received, [{'n': 0}, {'n': 1}])
+            # 流结束后同一连接继续可用
+            self.assertEqual((await client.request('echo', value=1))['value'], 1)
+            self.assertEqual(client.codec, available_codecs()[0])
+        finally:
+            await self._close(ipc, client)
+
+    async def test_legacy_request_without_id_closes_connection(self):
+        ipc, path = await self._serve()
+        reader, writer = await asyncio.open_unix_connection(path)
+        try:
+            writer.write(pack_frame({'command': 'echo', 'value': 'old'}))
+            await writer.drain()
+            self.assertEqual(await asyncio.wait_for(read_frame(reader), 5), {'status': 'success', 'value': 'old'})
+            self.assertEqual(await asyncio.wait_for(reader.read(), 5), b'')
+        finally:
+            writer.close()
+            await self._close(ipc)
+
+    async def test_pending_requests_fail_when_server_goes_away(self):
+        ipc, path = await self._serve()
+        client = AsyncIPCClient(path, timeout=5)
+        try:
+            pending = asyncio.create_task(client.request('echo', value=1, delay=0.3))
+            await asyncio.sleep(0.05)
+            for writer in list(ipc._connections):
+                writer.close()
+            with self.assertRaises(ConnectionError):
+                await pending
+            # 等服务端连接处理完剩余请求再关闭
+            await asyncio.sleep(0.3)
+        finally:
+            await self._close(ipc, client)
+
+
+class PresenceTrackerTests(SimpleTestCase):
+    """在线状态合并写入：同一用户只写最后一次，写入失败放回且较新的状态优先"""
+
+    def setUp(self):
+        self.tracker = PresenceTracker(Telegram(pk=1, phone_number='+10000000007'), flush_interval=3600)
+        self.saved = []
+
+    async def _save(self, pending):
+        self.saved.append(dict(pending))
+        return len(pending)
+
+    async def test_updates_are_coalesced_per_user(self):
+        self.tracker.update(1, UserStatusRecently())
+        self.tracker.update(2, UserStatusRecently())
+        self.tracker.update(1, UserStatusOnline(expires=timezone.now()))
+        with mock.patch.object(self.tracker, '_bulk_save', self._save):
+            await self.tracker.flush()
+            await self.tracker.flush()
+        self.assertEqual(self.saved, [{1: '在线', 2: '最近在线 (24小时内)'}])
+        self.assertEqual(self.tracker.stats(), {'pending': 0, 'received_updates': 3, 'flushed_updates': 2})
+
+    async def test_failed_flush_keeps_newer_status(self):
+        self.tracker.update(1, UserStatusRecently())
+
+        async def _fail(pending):
+            # 写入期间到达的新状态不能被失败重放覆盖
+            self.tracker.update(1, UserStatusOnline(expires=timezone.now()))
+            raise RuntimeError('db down')
+
+        with mock.patch.object(self.tracker, '_bulk_save', _fail):
+            await self.tracker.flush()
+        self.assertEqual(self.tracker._pending, {1: '在线'})
+        with mock.patch.object(self.tracker, '_bulk_save', self._save):
+            await self.tracker.stop()
+        self.assertEqual(self.saved, [{1: '在线'}])
+
+
+class _FakeMediaClient:
+    """按消息内容分片写入文件对象，模拟 Telethon 的分片下载"""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.downloads = 0
+
+    async def download_media(self, message, file):
+        self.downloads += 1
+        data = self.contents[message.id]
+        for start in range(0, len(data), 4):
+            file.write(data[start:start + 4])
+        return file
+
+
+class MediaFetcherTests(SimpleTestCase):
+    """媒体下载：流式计算 md5，按 md5 存储去重，同一消息的并发请求只下载一次"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        override = self.settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(media_fetcher.tl_utils, 'get_extension', return_value='.JPG')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def message(msg_id, file=True):
+        return SimpleNamespace(id=msg_id, peer_id=PeerUser(42), media=object(),
+                               file=SimpleNamespace(size=10) if file else None)
+
+    def fetcher(self, contents):
+        fetcher = MediaFetcher(_FakeMediaClient(contents), Telegram(pk=1, phone_number='+10000000008'),
+                               max_concurrency=2, max_queue_size=10)
+        fetcher._save_records = mock.AsyncMock()
+        return fetcher
+
+    async def test_same_content_is_stored_once(self):
+        data = b'telegram-media-bytes'
+        fetcher = self.fetcher({1: data, 2: data, 3: b'other'})
+        first = await fetcher._download(self.message(1))
+        second = await fetcher._download(self.message(2))
+        third = await fetcher._download(self.message(3))
+        md5sum = hashlib.md5(data).hexdigest()
+        self.assertEqual(first, second)
+        self.assertEqual(first, {'md5sum': md5sum, 'size': len(data),
+                                 'file_url': f'media/files/{md5sum[0]}/{md5sum[1]}/{md5sum}.jpg'})
+        with open(os.path.join(self.media_root, 'files', md5sum[0], md5sum[1], f'{md5sum}.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertNotEqual(third['md5sum'], md5sum)
+        self.assertEqual((fetcher.downloaded, fetcher.deduplicated), (3, 1))
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'files', 'tmp')), [])
+
+    async def test_concurrent_requests_share_one_download(self):
+        fetcher = self.fetcher({1: b'abc'})
+        fetcher.start()
+        try:
+            first = fetcher.enqueue(self.message(1))
+            second = fetcher.enqueue(self.message(1))
+            self.assertIs(first, second)
+            self.assertEqual((await first)['size'], 3)
+            self.assertEqual(fetcher.client.downloads, 1)
+        finally:
+            await fetcher.stop()
+
+    async def test_media_without_file_is_rejected(self):
+        fetcher = self.fetcher({})
+        with self.assertRaises(ValueError):
+            await fetcher._download(self.message(1, file=False))
+        with self.assertRaises(ValueError):
+            MediaFetcher.check_downloadable(None, 1)
+        self.assertEqual(fetcher.client.downloads, 0)
+
+
+class _FakePubSub:
+    def __init__(self, on_message=None, fail=False):
+        self.on_message = on_message
+        self.fail = fail
+        self.channels = []
+
+    async def subscribe(self, channel):
+        if self.fail:
+            raise ConnectionError('redis down')
+        self.channels.append(channel)
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=None):
+        if self.on_message:
+            await self.on_message()
+            return {'type': 'message', 'data': b'1'}
+        await asyncio.sleep(timeout)
+
+    async def unsubscribe(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class _FakeRedis:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    def pubsub(self):
+        return self._pubsub
+
+    async def close(self):
+        pass
+
+
+class VerificationCodeTests(TestCase):
+    """验证码：提交后发布通知，等待方收到通知立即取码，订阅失败时退化为定时检查"""
+    phone = '+10000000009'
+
+    def test_submit_notifies_after_commit(self):
+        with mock.patch.object(CodeManager, 'notify') as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                record = CodeManager.submit_code(self.phone, '12345')
+                notify.assert_not_called()
+        notify.assert_called_once_with(self.phone, record.id)
+
+    async def test_notification_wakes_waiter(self):
+        async def _arrive():
+            await sync_to_async(VerificationCode.objects.create)(
+                phone=self.phone, code='24680', expires_at=timezone.now() + timedelta(minutes=5))
+
+        pubsub = _FakePubSub(on_message=_arrive)
+        with mock.patch('redis.asyncio.Redis.from_url', return_value=_FakeRedis(pubsub)):
+            # 兜底检查间隔远大于超时，只有通知能让等待方取到验证码
+            code = await CodeManager.wait_for_code(self.phone, timeout=5, fallback_interval=3600)
+        self.assertEqual(code, '24680')
+        self.assertEqual(pubsub.channels, [CODE_CHANNEL.format(phone=self.phone)])
+        self.assertTrue(await VerificationCode.objects.filter(phone=self.phone, is_used=True).aexists())
+
+    async def test_falls_back_to_polling_without_redis(self):
+        await sync_to_async(VerificationCode.objects.create)(
+            phone=self.phone, code='13579', expires_at=timezone.now() + timedelta(minutes=5))
+        with mock.patch('redis.asyncio.Redis.from_url', return_value=_FakeRedis(_FakePubSub(fail=True))):
+            self.assertEqual(await CodeManager.wait_for_code(self.phone, timeout=1, fallback_interval=0.01), '13579')
+            with self.assertRaises(asyncio.TimeoutError):
+                await CodeManager.wait_for_code(self.phone, timeout=0.05, fallback_interval=0.01)
+
+
+class _FakeHeartbeatClient:
+    def __init__(self, connected=True, errors=()):
+        self.connected = connected
+        self.errors = list(errors)
+        self.requests = []
+        self.handlers = []
+
+    def is_connected(self):
+        return self.connected
+
+    async def __call__(self, request):
+        self.requests.append(request)
+        if self.errors:
+            raise self.errors.pop(0)
+
+    def add_event_handler(self, callback, event):
+        self.handlers.append(callback)
+
+    def remove_event_handler(self, callback, event):
+        self.handlers.remove(callback)
+
+
+class HeartbeatTests(SimpleTestCase):
+    """以更新流为心跳：有更新时不发请求，长时间静默才确认授权"""
+
+    def setUp(self):
+        patcher = mock.patch.object(heartbeat.last_active_writer, 'touch')
+        self.touch = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.account = Telegram(pk=1, phone_number='+10000000010')
+
+    def beat(self, client, silence_timeout=3600):
+        return Heartbeat(client, self.account, check_interval=0.01, silence_timeout=silence_timeout)
+
+    async def test_updates_keep_connection_alive_without_requests(self):
+        client = _FakeHeartbeatClient()
+        beat = self.beat(client)
+        beat.start()
+        await client.handlers[0](object())
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(beat.wait_unhealthy(), timeout=0.1)
+        self.assertEqual(client.requests, [])
+        self.touch.assert_called_with(self.account.id)
+        beat.stop()
+        self.assertEqual(client.handlers, [])
+
+    async def test_disconnected_client_is_unhealthy(self):
+        client = _FakeHeartbeatClient(connected=False)
+        await asyncio.wait_for(self.beat(client).wait_unhealthy(), timeout=1)
+        self.assertEqual(client.requests, [])
+
+    async def test_silence_escalates_until_authorization_fails(self):
+        # 第一次确认遇到网络错误继续等待，第二次确认授权失效
+        auth_error = AuthKeyUnregisteredError.__new__(AuthKeyUnregisteredError)
+        client = _FakeHeartbeatClient(errors=[ConnectionError('reset'), auth_error])
+        beat = self.beat(client, silence_timeout=0.001)
+        await asyncio.wait_for(beat.wait_unhealthy(), timeout=1)
+        self.assertEqual(beat.escalations, 2)
+        self.assertEqual(len(client.requests), 2)
+
+
+class LastActiveWriterTests(SimpleTestCase):
+    async def test_touches_are_batched_and_requeued_on_failure(self):
+        writer = LastActiveWriter(write_interval=3600)
+        first, later = timezone.now(), timezone.now() + timedelta(seconds=5)
+        with mock.patch.object(Telegram.objects, 'bulk_update') as bulk_update:
+            writer.touch(1, first)
+            writer.touch(2, first)
+            writer.touch(1, later)
+            await writer.flush()
+            rows, fields = bulk_update.call_args[0]
+            self.assertEqual({row.id: row.last_active for row in rows}, {1: later, 2: first})
+            self.assertEqual(fields, ['last_active'])
+
+            bulk_update.side_effect = RuntimeError('db down')
+            writer.touch(3, first)
+            await writer.flush()
+            self.assertEqual(writer._pending, {3: first})
+        writer._worker.cancel()
+        await asyncio.gather(writer._worker, return_exceptions=True)
+
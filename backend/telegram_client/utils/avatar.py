@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import os
+from typing import Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from telegram_client.models import Telegram, TelegramContact
+
+logger = logging.getLogger(__name__)
+
+AVATAR_DIR = 'telegram_avatars'
+
+
+def photo_id_of(entity) -> int:
+    """实体当前头像的 photo_id，没有头像时为 0"""
+    return getattr(getattr(entity, 'photo', None), 'photo_id', None) or 0
+
+
+async def download_avatar(client, entity, cached_photo_id: int, relative_path: str) -> Tuple[int, Optional[str]]:
+    """
+    头像 photo_id 与已缓存的一致且文件仍在时跳过下载
+    下载直接写入临时文件再替换，不经过内存 bytes
+    返回 (photo_id, 相对 MEDIA_ROOT 的路径)，路径为 None 表示无需更新
+    """
+    photo_id = photo_id_of(entity)
+    if not photo_id:
+        return 0, None
+    file_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+    if photo_id == cached_photo_id and os.path.exists(file_path):
+        return photo_id, None
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.part"
+    try:
+        result = await client.download_profile_photo(entity, file=tmp_path, download_big=False)
+        if not result:
+            return 0, None
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return photo_id, relative_path
+
+
+def account_avatar_path(telegram_id: int) -> str:
+    return os.path.join(AVATAR_DIR, f"avatar_{telegram_id}.jpg")
+
+
+def contact_avatar_path(account: Telegram, contact_id: int) -> str:
+    return os.path.join(AVATAR_DIR, 'contacts', str(account.id), f"avatar_{contact_id}.jpg")
+
+
+async def sync_contact_avatars(client, account: Telegram, users, max_concurrency: int = None) -> int:
+    """
+    联系人头像同步：只下载 photo_id 变化的联系人，结果一次 bulk_update 写回
+    返回实际下载的头像数
+    """
+    max_concurrency = max_concurrency or getattr(settings, 'TG_AVATAR_DOWNLOAD_CONCURRENCY', 4)
+    cached = await sync_to_async(lambda: {
+        c.contact_id: c
+        for c in TelegramContact.objects.filter(account=account).only('id', 'contact_id', 'avatar_photo_id')
+    })()
+    candidates = [
+        user for user in users
+        if user.id in cached and photo_id_of(user) != cached[user.id].avatar_photo_id
+    ]
+    if not candidates:
+        return 0
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    changed = []
+
+    async def _download(user):
+        contact = cached[user.id]
+        async with semaphore:
+            try:
+                photo_id, path = await download_avatar(
+                    client, user, contact.avatar_photo_id, contact_avatar_path(account, user.id)
+                )
+            except Exception as e:
+                logger.warning(f"联系人 {user.id} 头像下载失败: {str(e)}")
+                return
+        contact.avatar_photo_id = photo_id
+        if path or not photo_id:
+            contact.avatar = path
+        changed.append(contact)
+
+    await asyncio.gather(*[_download(user) for user in candidates])
+    if changed:
+        await sync_to_async(TelegramContact.objects.bulk_update)(changed, ['avatar', 'avatar_photo_id'], batch_size=500)
+    logger.info(f"账号 {account.phone_number} 联系人头像同步完成: 更新 {len(changed)} 个")
+    return len(changed)
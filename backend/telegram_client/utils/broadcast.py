@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List
+
+from asgiref.sync import sync_to_async
+from django.db.models import F
+from django.utils import timezone
+
+from telegram_client.ipc_client import AsyncIPCClient
+from telegram_client.models import BroadcastJob, BroadcastTarget, Telegram
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶限速：rate_per_minute 条/分钟，允许 burst 条突发"""
+
+    def __init__(self, rate_per_minute: int, burst: int = 1):
+        self.rate = max(rate_per_minute, 1) / 60.0
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastExecutor:
+    """
+    群发执行器
+
+    - 每个参与账号一个 worker，共享同一个待发送队列，快的账号自然多发
+    - 消息经该账号监听进程的 IPC 发送，复用监听器已持有的会话，不再建立第二条 MTProto 连接
+    - 每个账号独立令牌桶限速；遇到 FloodWait 时该目标放回队列，
+      仅该账号休眠指定秒数（暂停时立即醒来），其他账号继续发送
+    - worker 持续取队列直到全部目标处理完、任务被暂停或所有账号都不可用
+    - 发送结果定期批量写回 BroadcastTarget（检查点），任务暂停或进程中断后
+      重新执行只会处理仍为 pending 的目标；检查点同时刷新 update_datetime 作为心跳
+    """
+
+    def __init__(self, job_id: int, checkpoint_size: int = 50, checkpoint_interval: float = 5.0):
+        self.job_id = job_id
+        self.checkpoint_size = checkpoint_size
+        self.checkpoint_interval = checkpoint_interval
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._results: List[BroadcastTarget] = []
+        self._last_checkpoint = time.monotonic()
+        self._stop = asyncio.Event()
+        self._account_stats: Dict[str, dict] = {}
+        self._started = time.monotonic()
+        self._message = ''
+
+    async def run(self):
+        job, accounts, pending = await self._prepare()
+        self._message = job.message
+        if not accounts:
+            await self._finish(job, BroadcastJob.Status.FAILED, '没有可用的在线账号')
+            return
+        for item in pending:
+            self.queue.put_nowait(item)
+        logger.info(f"群发任务 {job.id} 开始: {len(pending)} 个目标, {len(accounts)} 个账号")
+
+        workers = [
+            asyncio.create_task(self._worker(account, TokenBucket(job.rate_per_minute)))
+            for account in accounts
+        ]
+        drained = asyncio.create_task(self.queue.join())
+        stopped = asyncio.create_task(self._stop.wait())
+        all_exited = asyncio.create_task(asyncio.wait(workers))
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            await asyncio.wait({drained, stopped, all_exited}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # 通知 worker 退出：正在发送的目标处理完再退出，未取到的目标保持 pending
+            self._stop.set()
+            for _ in workers:
+                self.queue.put_nowait(None)
+            await asyncio.gather(*workers, return_exceptions=True)
+            for task in (drained, stopped, all_exited, monitor):
+                task.cancel()
+        await self._checkpoint(force=True)
+
+        job = await BroadcastJob.objects.aget(pk=self.job_id)
+        if job.status == BroadcastJob.Status.RUNNING:
+            remaining = await BroadcastTarget.objects.filter(
+                job_id=self.job_id, status=BroadcastTarget.Status.PENDING
+            ).acount()
+            status = BroadcastJob.Status.COMPLETED if remaining == 0 else BroadcastJob.Status.PAUSED
+            await self._finish(job, status)
+
+    @sync_to_async
+    def _prepare(self):
+        job = BroadcastJob.objects.get(pk=self.job_id)
+        # 首次执行：把 targets 展开为明细行
+        if not BroadcastTarget.objects.filter(job=job).exists():
+            BroadcastTarget.objects.bulk_create(
+                [BroadcastTarget(job=job, target=str(target)) for target in job.targets],
+                batch_size=500
+            )
+            job.total_count = len(job.targets)
+        accounts = list(job.accounts.filter(status=Telegram.Status.ONLINE))
+        if not job.accounts.exists():
+            accounts = list(Telegram.objects.filter(status=Telegram.Status.ONLINE))
+        pending = list(BroadcastTarget.objects.filter(job=job, status=BroadcastTarget.Status.PENDING))
+        job.status = BroadcastJob.Status.RUNNING
+        job.started_at = job.started_at or timezone.now()
+        job.finished_at = None
+        job.save(update_fields=['status', 'started_at', 'finished_at', 'total_count'])
+        self._account_stats = {
+            account.phone_number: {'sent': 0, 'failed': 0, 'flood_wait': 0} for account in accounts
+        }
+        return job, accounts, pending
+
+    async def _worker(self, account: Telegram, bucket: TokenBucket):
+        phone = account.phone_number
+        client = AsyncIPCClient.for_phone(phone)
+        try:
+            while True:
+                item = await self.queue.get()
+                try:
+                    if item is None or self._stop.is_set():
+                        return
+                    await bucket.acquire()
+                    if self._stop.is_set():
+                        return
+                    if not await self._send(client, account, item):
+                        return
+                except Exception:
+                    # 单个目标处理异常不影响 worker，目标保持 pending，续发时重试
+                    logger.error(f"账号 {phone} 群发目标 {item.target} 处理异常", exc_info=True)
+                finally:
+                    self.queue.task_done()
+        finally:
+            await client.close()
+
+    async def _send(self, client: AsyncIPCClient, account: Telegram, item: BroadcastTarget) -> bool:
+        """发送一个目标，返回 False 表示该账号不可用、worker 应退出"""
+        phone = account.phone_number
+        stats = self._account_stats[phone]
+        try:
+            reply = await client.request('send_message', target=self._parse_target(item.target), message=self._message)
+        except asyncio.TimeoutError:
+            # 结果未知，按失败记录，避免续发时重复发送
+            # （须在 OSError 之前捕获：3.11 起 asyncio.TimeoutError 即内置 TimeoutError，是 OSError 的子类）
+            reply = {'status': 'error', 'detail': 'IPC 请求超时，发送结果未知'}
+        except (ConnectionError, OSError) as e:
+            # 监听进程不可用：目标放回队列交给其他账号，该账号退出
+            self.queue.put_nowait(item)
+            logger.error(f"账号 {phone} 监听进程不可用，退出群发: {str(e)}")
+            return False
+        except Exception as e:
+            logger.error(f"账号 {phone} 发送异常: {str(e)}", exc_info=True)
+            reply = {'status': 'error', 'detail': f"{type(e).__name__}: {str(e)}"}
+
+        if reply.get('code') == 'flood_wait':
+            # 目标放回队列交给其他账号，本账号单独等待，暂停时立即醒来
+            seconds = reply.get('seconds') or 0
+            stats['flood_wait'] += 1
+            self.queue.put_nowait(item)
+            logger.warning(f"账号 {phone} 触发 FloodWait，等待 {seconds} 秒")
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+            except asyncio.TimeoutError:
+                pass
+            return True
+
+        if reply.get('status') == 'success':
+            item.status = BroadcastTarget.Status.SENT
+            item.telegram_msg_id = reply.get('message_id')
+            item.error = ''
+            stats['sent'] += 1
+        else:
+            item.status = BroadcastTarget.Status.FAILED
+            item.error = str(reply.get('detail') or reply.get('code') or '发送失败')[:255]
+            stats['failed'] += 1
+        item.account_id = account.pk
+        item.sent_at = timezone.now()
+        self._results.append(item)
+        await self._checkpoint()
+        return True
+
+    async def _monitor(self):
+        """所有账号都在等待 FloodWait 时也要定期写检查点，及时发现暂停"""
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            await self._checkpoint()
+
+    @staticmethod
+    def _parse_target(target: str):
+        """数字ID转为int，其余（用户名、手机号）原样交给 Telethon 解析"""
+        return int(target) if target.lstrip('-').isdigit() else target
+
+    async def _checkpoint(self, force: bool = False):
+        """批量写回发送结果和吞吐统计，并检查任务是否被暂停"""
+        due = time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+        if not force and len(self._results) < self.checkpoint_size and not due:
+            return
+        results, self._results = self._results, []
+        self._last_checkpoint = time.monotonic()
+        status = await self._save_checkpoint(results, self._throughput())
+        if status != BroadcastJob.Status.RUNNING:
+            self._stop.set()
+
+    @sync_to_async
+    def _save_checkpoint(self, results: List[BroadcastTarget], stats: dict) -> str:
+        sent = sum(1 for item in results if item.status == BroadcastTarget.Status.SENT)
+        failed = len(results) - sent
+        if results:
+            BroadcastTarget.objects.bulk_update(
+                results, ['status', 'account', 'telegram_msg_id', 'error', 'sent_at'], batch_size=500
+            )
+        BroadcastJob.objects.filter(pk=self.job_id).update(
+            sent_count=F('sent_count') + sent,
+            failed_count=F('failed_count') + failed,
+            stats=stats,
+            # update() 不会触发 auto_now，手动刷新作为执行心跳，启动接口据此回收中断的任务
+            update_datetime=timezone.now()
+        )
+        return BroadcastJob.objects.filter(pk=self.job_id).values_list('status', flat=True).first()
+
+    def _throughput(self) -> dict:
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        accounts = {
+            phone: {**stats, 'messages_per_sec': round(stats['sent'] / elapsed, 3)}
+            for phone, stats in self._account_stats.items()
+        }
+        total_sent = sum(stats['sent'] for stats in self._account_stats.values())
+        return {
+            'elapsed': round(elapsed, 1),
+            'messages_per_sec': round(total_sent / elapsed, 3),
+            'accounts': accounts,
+        }
+
+    async def _finish(self, job: BroadcastJob, status: str, reason: str = ''):
+        job.status = status
+        job.finished_at = timezone.now()
+        if reason:
+            job.description = reason
+        await job.asave(update_fields=['status', 'finished_at', 'description'])
+        logger.info(f"群发任务 {job.id} 结束: {status} {self._throughput()}")
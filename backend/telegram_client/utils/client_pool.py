@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from django.conf import settings
+from telethon import TelegramClient
+
+logger = logging.getLogger(__name__)
+
+
+class ClientLoginError(Exception):
+    """账号无法登录（未注册、会话失效等），消息内容即原有的错误描述"""
+
+
+class PooledClient:
+    def __init__(self, client: TelegramClient, max_concurrency: int):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.last_checked = time.monotonic()
+
+
+class TelegramClientPool:
+    """
+    进程级 TelegramClient 连接池（按手机号复用）
+
+    - 首次借用时登录并缓存已连接的客户端，后续发送只需一次 RPC
+    - 借用前按 health_interval 检查连接，断开则重连并校验授权
+    - 空闲超过 idle_timeout 的客户端在下次借用时被断开回收
+    - 每个客户端同时最多 max_concurrency 个请求
+    客户端绑定创建时的事件循环，换了事件循环会重新登录，旧客户端会被断开
+    （原事件循环已关闭时直接关闭底层 socket）。
+    同步代码（Celery 任务等）应通过 run() 在连接池自己的常驻事件循环中执行，
+    每次调用各自新建事件循环将无法复用连接。
+    """
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _loop_lock = threading.Lock()
+
+    def __init__(self, max_concurrency: int = None, idle_timeout: int = None, health_interval: int = None):
+        self.max_concurrency = max_concurrency or getattr(settings, 'TG_CLIENT_POOL_MAX_CONCURRENCY', 4)
+        self.idle_timeout = idle_timeout or getattr(settings, 'TG_CLIENT_POOL_IDLE_TIMEOUT', 600)
+        self.health_interval = health_interval or getattr(settings, 'TG_CLIENT_POOL_HEALTH_INTERVAL', 60)
+        self._entries: Dict[str, PooledClient] = {}
+        # 事件循环 -> {手机号: 锁}，事件循环关闭后整组清除
+        self._locks: Dict[asyncio.AbstractEventLoop, Dict[str, asyncio.Lock]] = {}
+
+    @classmethod
+    def _get_loop(cls) -> asyncio.AbstractEventLoop:
+        with cls._loop_lock:
+            if cls._loop is None or cls._loop.is_closed():
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(target=cls._loop.run_forever, name='tg-client-pool-loop', daemon=True).start()
+            return cls._loop
+
+    def run(self, coro, timeout: float = None):
+        """在连接池常驻事件循环中执行协程并同步等待结果（供同步代码复用连接）"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result(timeout=timeout)
+
+    @asynccontextmanager
+    async def borrow(self, phone: str):
+        """借用指定账号的已连接客户端"""
+        await self._evict_idle()
+        entry = await self._get_entry(phone)
+        async with entry.semaphore:
+            entry.in_use += 1
+            try:
+                yield entry.client
+            finally:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    async def _get_entry(self, phone: str) -> PooledClient:
+        loop = asyncio.get_running_loop()
+        lock = self._locks.setdefault(loop, {}).setdefault(phone, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(phone)
+            if entry is not None and entry.client.loop is not loop:
+                # 其他事件循环创建的客户端无法在当前循环使用，断开后重新登录
+                self._entries.pop(phone, None)
+                await self._release(entry)
+                entry = None
+            if entry is not None and not await self._is_healthy(entry):
+                self._entries.pop(phone, None)
+                await self._disconnect(entry)
+                entry = None
+            if entry is None:
+                from telegram_client.telegram_api import login_with_session
+                client = await login_with_session(phone)
+                if isinstance(client, str):
+                    raise ClientLoginError(client)
+                entry = self._entries[phone] = PooledClient(client, self.max_concurrency)
+                logger.info(f"连接池新增客户端: {phone}")
+            return entry
+
+    async def _is_healthy(self, entry: PooledClient) -> bool:
+        """连接检查：仅在间隔到期或已断开时才发起授权校验"""
+        now = time.monotonic()
+        if entry.client.is_connected() and now - entry.last_checked < self.health_interval:
+            return True
+        try:
+            if not entry.client.is_connected():
+                await entry.client.connect()
+            healthy = await entry.client.is_user_authorized()
+        except Exception as e:
+            logger.warning(f"连接池客户端检查失败: {str(e)}")
+            healthy = False
+        entry.last_checked = now
+        return healthy
+
+    async def _evict_idle(self):
+        """回收空闲或所属事件循环已关闭的客户端，并清理已关闭事件循环的锁"""
+        now = time.monotonic()
+        for loop in [loop for loop in self._locks if loop.is_closed()]:
+            self._locks.pop(loop, None)
+        for phone, entry in list(self._entries.items()):
+            closed = entry.client.loop.is_closed()
+            if not closed and (entry.in_use or now - entry.last_used < self.idle_timeout):
+                continue
+            self._entries.pop(phone, None)
+            await self._release(entry)
+            logger.info(f"连接池回收{'已失效' if closed else '空闲'}客户端: {phone}")
+
+    async def _release(self, entry: PooledClient):
+        """在客户端所属的事件循环上断开；该循环已不再运行时直接关闭底层连接"""
+        loop = entry.client.loop
+        if loop is asyncio.get_running_loop():
+            await self._disconnect(entry)
+        elif loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self._disconnect(entry), loop)
+            try:
+                await asyncio.wait_for(asyncio.wrap_future(future), timeout=10)
+            except Exception as e:
+                logger.warning(f"客户端断开失败: {str(e)}")
+        else:
+            self._shutdown_socket(entry)
+
+    @staticmethod
+    def _shutdown_socket(entry: PooledClient):
+        connection = getattr(getattr(entry.client, '_sender', None), '_connection', None)
+        writer = getattr(connection, '_writer', None)
+        sock = writer.get_extra_info('socket') if writer is not None else None
+        if sock is None:
+            return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    @staticmethod
+    async def _disconnect(entry: PooledClient):
+        try:
+            await entry.client.disconnect()
+        except Exception as e:
+            logger.warning(f"客户端断开失败: {str(e)}")
+
+    async def discard(self, phone: str):
+        """主动移除客户端（例如会话被撤销）"""
+        entry = self._entries.pop(phone, None)
+        if entry is not None:
+            await self._release(entry)
+
+    async def close_all(self):
+        for phone in list(self._entries):
+            await self.discard(phone)
+
+    def stats(self) -> dict:
+        return {
+            phone: {'in_use': entry.in_use, 'idle': round(time.monotonic() - entry.last_used, 1)}
+            for phone, entry in self._entries.items()
+        }
+
+
+client_pool = TelegramClientPool()
@@ -0,0 +1,157 @@
+import logging
+from typing import Iterable, Optional
+
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from telethon.tl.functions.contacts import GetContactsRequest
+from telethon.tl.types import UserStatusOnline, UserStatusOffline, UserStatusRecently, UserStatusLastWeek, \
+    UserStatusLastMonth
+from telethon.tl.types.contacts import ContactsNotModified
+
+from telegram_client.models import Telegram, TelegramContact
+
+logger = logging.getLogger(__name__)
+
+
+def telegram_hash(values: Iterable[int]) -> int:
+    """
+    Telegram 通用哈希算法，按顺序累加，结果为有符号 64 位整数
+    https://core.telegram.org/api/offsets#hash-generation
+    """
+    value = 0
+    for item in values:
+        value ^= value >> 21
+        value ^= (value << 35) & 0xFFFFFFFFFFFFFFFF
+        value ^= value >> 4
+        value = (value + item) & 0xFFFFFFFFFFFFFFFF
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def contacts_hash(user_ids: Iterable[int], saved_count: int = 0) -> int:
+    """
+    contacts.getContacts 的哈希：先累加上次返回的 saved_count，再按升序累加联系人ID
+    https://core.telegram.org/method/contacts.getContacts
+    """
+    return telegram_hash([saved_count, *sorted(user_ids)])
+
+
+async def fetch_contacts(client, account: Telegram, force: bool = False):
+    """
+    带哈希拉取联系人列表
+    联系人未变化时返回 None，调用方直接跳过比对；force 时忽略已存哈希做全量拉取
+    """
+    request_hash = 0 if force else (account.contacts_hash or 0)
+    result = await client(GetContactsRequest(hash=request_hash))
+    if isinstance(result, ContactsNotModified):
+        logger.info(f"账号 {account.phone_number} 联系人未变化，跳过同步")
+        return None
+    return result
+
+
+async def save_contacts_hash(account: Telegram, contacts) -> int:
+    """联系人落库成功后再保存哈希，避免写库失败时下次被误判为未变化"""
+    value = contacts_hash((contact.user_id for contact in contacts.contacts), contacts.saved_count)
+    if value != account.contacts_hash:
+        account.contacts_hash = value
+        await Telegram.objects.filter(pk=account.pk).aupdate(contacts_hash=value)
+    return value
+
+
+# 同步时需要比对/写入的联系人字段
+CONTACT_FIELDS = ['phone_number', 'username', 'first_name', 'last_name', 'user_status', 'premium']
+
+
+def user_status_text(status) -> str:
+    """Telegram 在线状态转为展示文本"""
+    if isinstance(status, UserStatusOnline):
+        return "在线"
+    elif isinstance(status, UserStatusOffline):
+        time_str = status.was_online.strftime("%Y-%m-%d %H:%M:%S")
+        return f"离线 (最后在线: {time_str})"
+    elif isinstance(status, UserStatusRecently):
+        return "最近在线 (24小时内)"
+    elif isinstance(status, UserStatusLastWeek):
+        return "过去一周内活跃"
+    elif isinstance(status, UserStatusLastMonth):
+        return "过去一月内活跃"
+    else:
+        return "未知状态"
+
+
+def build_contact_data(user) -> dict:
+    """Telethon User 转为 TelegramContact 字段"""
+    return {
+        "phone_number": user.phone,
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "user_status": user_status_text(user.status),
+        "premium": user.premium,
+    }
+
+
+def is_contact_changed(db_contact, data: dict) -> bool:
+    """检查联系人信息是否变化"""
+    return any(getattr(db_contact, field) != data[field] for field in CONTACT_FIELDS)
+
+
+def get_existing_contacts(account: Telegram) -> dict:
+    """当前账号的现有联系人，按 contact_id 索引"""
+    return {c.contact_id: c for c in TelegramContact.objects.filter(account=account)}
+
+
+def upsert_contacts(account: Telegram, users, existing: Optional[dict] = None, force: bool = False) -> dict:
+    """
+    联系人批量写入
+    在内存中比对出新增和变化的联系人，一个事务内用一条 upsert 语句（按批）写入，
+    未变化的联系人不产生任何写操作
+    """
+    if existing is None:
+        existing = get_existing_contacts(account)
+
+    rows = []
+    created = updated = 0
+    for user in users:
+        data = build_contact_data(user)
+        db_contact = existing.get(user.id)
+        if db_contact is None:
+            created += 1
+        elif force or is_contact_changed(db_contact, data):
+            updated += 1
+        else:
+            continue
+        rows.append(TelegramContact(account=account, contact_id=user.id, **data))
+
+    if rows:
+        # MySQL 的 ON DUPLICATE KEY UPDATE 不能指定冲突列（传 unique_fields 会抛 NotSupportedError），
+        # 此时依赖 (account, contact_id) 唯一索引判定冲突
+        conflict_kwargs = {}
+        if connection.features.supports_update_conflicts_with_target:
+            conflict_kwargs['unique_fields'] = ['account', 'contact_id']
+        with transaction.atomic():
+            TelegramContact.objects.bulk_create(
+                rows,
+                batch_size=500,
+                update_conflicts=True,
+                update_fields=CONTACT_FIELDS,
+                **conflict_kwargs
+            )
+    logger.info(f"账号 {account.phone_number} 联系人同步完成: 新增 {created} 条, 更新 {updated} 条")
+    return {'created': created, 'updated': updated}
+
+
+async def sync_account_contacts(client, account: Telegram, force: bool = False, avatars: bool = False) -> dict:
+    """
+    拉取（带哈希）并写入一个账号的联系人，未变化时不访问联系人表
+    avatars 时需要完整联系人列表来比对头像 photo_id，会忽略哈希，头像同步完成后才保存哈希
+    """
+    from telegram_client.utils.avatar import sync_contact_avatars
+
+    contacts = await fetch_contacts(client, account, force=force or avatars)
+    if contacts is None:
+        return {'created': 0, 'updated': 0, 'not_modified': True}
+    result = await sync_to_async(upsert_contacts)(account, contacts.users, force=force)
+    if avatars:
+        result['avatars'] = await sync_contact_avatars(client, account, contacts.users)
+    await save_contacts_hash(account, contacts)
+    return result
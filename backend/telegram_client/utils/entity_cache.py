@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+
+
+class EntityCache:
+    """
+    实体缓存（单账号，LRU + TTL）
+
+    以 Telegram 原始 peer id 为键，缓存发送方/会话的基础信息，
+    使消息处理器无需 await get_sender()/get_chat() 即可拿到实体信息。
+    - 超过 max_size 时淘汰最久未使用的条目
+    - 超过 ttl 秒的条目在读取时视为失效
+    """
+
+    def __init__(self, max_size: int = None, ttl: int = None):
+        self.max_size = max_size or getattr(settings, 'TG_ENTITY_CACHE_SIZE', 10000)
+        self.ttl = ttl or getattr(settings, 'TG_ENTITY_CACHE_TTL', 3600)
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, peer_id: int) -> Optional[dict]:
+        item = self._data.get(peer_id)
+        if item is None:
+            self.misses += 1
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[peer_id]
+            self.misses += 1
+            return None
+        self._data.move_to_end(peer_id)
+        self.hits += 1
+        return value
+
+    def set(self, peer_id: int, value: dict):
+        self._data[peer_id] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(peer_id)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def set_entity(self, entity):
+        """缓存 Telethon 的 User/Chat/Channel 实体"""
+        if entity is None or getattr(entity, 'id', None) is None:
+            return
+        self.set(entity.id, {
+            'id': entity.id,
+            'username': getattr(entity, 'username', None),
+            'first_name': getattr(entity, 'first_name', None),
+            'last_name': getattr(entity, 'last_name', None),
+            'title': getattr(entity, 'title', None),
+            'phone': getattr(entity, 'phone', None),
+        })
+
+    def set_contact(self, contact):
+        """缓存数据库中的 TelegramContact 记录"""
+        self.set(contact.contact_id, {
+            'id': contact.contact_id,
+            'username': contact.username,
+            'first_name': contact.first_name,
+            'last_name': contact.last_name,
+            'title': None,
+            'phone': contact.phone_number,
+        })
+
+    def display_name(self, peer_id: int) -> Optional[str]:
+        """缓存中的展示名（群组/频道标题、用户名或姓名），未命中返回 None"""
+        value = self.get(peer_id)
+        if value is None:
+            return None
+        if value['title']:
+            return value['title']
+        if value['username']:
+            return f"@{value['username']}"
+        name = ' '.join(part for part in (value['first_name'], value['last_name']) if part)
+        return name or value['phone']
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
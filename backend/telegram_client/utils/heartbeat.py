@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from telethon import events
+from telethon.errors import SessionExpiredError, SessionRevokedError, AuthKeyUnregisteredError, UnauthorizedError
+from telethon.tl.functions.updates import GetStateRequest
+
+from telegram_client.models import Telegram
+
+logger = logging.getLogger(__name__)
+
+
+class LastActiveWriter:
+    """
+    Telegram.last_active 批量写入
+
+    进程内所有账号的心跳只记录在内存，每 write_interval 秒合并为一次 bulk_update，
+    托管分片中上千个账号也只产生一条批量语句。
+    """
+
+    def __init__(self, write_interval: float = None):
+        self.write_interval = write_interval or getattr(settings, 'TG_LAST_ACTIVE_WRITE_INTERVAL', 60)
+        self._pending: Dict[int, object] = {}
+        self._worker: Optional[asyncio.Task] = None
+
+    def touch(self, account_id: int, when=None):
+        self._pending[account_id] = when or timezone.now()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.write_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await sync_to_async(Telegram.objects.bulk_update)(
+                [Telegram(id=account_id, last_active=when) for account_id, when in pending.items()],
+                ['last_active'],
+                batch_size=500
+            )
+        except Exception as e:
+            self._pending = {**pending, **self._pending}
+            logger.error(f"最后活跃时间写入失败({len(pending)} 个账号): {str(e)}")
+
+
+last_active_writer = LastActiveWriter()
+
+
+class Heartbeat:
+    """
+    监听连接心跳
+
+    任意更新到达即视为连接存活（不发请求），本地每 check_interval 秒检查一次：
+    - 客户端已断开（Telethon 自动重连失败）直接判定失效
+    - 超过 silence_timeout 秒没有任何更新时才发一次 GetState 确认授权状态，
+      成功即刷新心跳，授权失效时判定失效
+    """
+
+    def __init__(self, client, account: Telegram, check_interval: float = None, silence_timeout: float = None):
+        self.client = client
+        self.account = account
+        self.check_interval = check_interval or getattr(settings, 'TG_HEARTBEAT_INTERVAL', 15)
+        self.silence_timeout = silence_timeout or getattr(settings, 'TG_HEARTBEAT_SILENCE', 300)
+        self.last_seen = time.monotonic()
+        self.escalations = 0
+
+    def start(self):
+        """订阅全部更新作为心跳来源"""
+        self.client.add_event_handler(self._on_update, events.Raw())
+        self.touch()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+        last_active_writer.touch(self.account.id)
+
+    async def _on_update(self, update):
+        self.touch()
+
+    @property
+    def age(self) -> float:
+        """距上次收到更新/确认存活的秒数"""
+        return time.monotonic() - self.last_seen
+
+    async def wait_unhealthy(self):
+        """阻塞直到连接失效后返回"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if not self.client.is_connected():
+                logger.warning(f"账号 {self.account.phone_number} 连接已断开")
+                return
+            if self.age < self.silence_timeout:
+                continue
+            self.escalations += 1
+            try:
+                await self.client(GetStateRequest())
+            except (SessionExpiredError, SessionRevokedError, AuthKeyUnregisteredError, UnauthorizedError):
+                logger.warning(f"账号 {self.account.phone_number} 授权已失效")
+                return
+            except Exception as e:
+                # 网络抖动交给 Telethon 重连，下个周期再确认
+                logger.warning(f"账号 {self.account.phone_number} 心跳确认失败: {str(e)}")
+                continue
+            self.touch()
+
+    def stop(self):
+        self.client.remove_event_handler(self._on_update, events.Raw())
+
+    def stats(self) -> dict:
+        return {
+            'age': round(self.age, 1),
+            'silence_timeout': self.silence_timeout,
+            'escalations': self.escalations,
+        }
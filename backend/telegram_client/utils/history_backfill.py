@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from telethon.errors import FloodWaitError
+
+from telegram_client.models import BackfillWatermark, Message, Telegram
+from telegram_client.utils.broadcast import TokenBucket
+from telegram_client.utils.message_parser import build_message_data
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryBackfiller:
+    """
+    历史消息回填
+
+    按会话从回填水位之后由旧到新逐页拉取，整页 bulk_create（已存在的跳过），
+    与页一起在同一事务内推进水位，中断后从水位断点续传。
+    水位独立于已存储的最大消息ID，实时监听已写入更新的消息时，
+    停机期间的空缺仍会被补齐。
+    client 由调用方提供：监听在线时在监听进程内使用其会话（IPC backfill 命令），
+    否则由命令行从连接池借用。
+    """
+
+    def __init__(self, client, account: Telegram, page_size: int = 100, rate: int = 120,
+                 concurrency: int = 4, dialogs: Optional[int] = None,
+                 progress: Optional[Callable[[dict], None]] = None):
+        self.client = client
+        self.account = account
+        self.page_size = min(max(page_size, 1), 100)
+        self.concurrency = max(concurrency, 1)
+        self.dialogs = dialogs
+        self.bucket = TokenBucket(rate, burst=self.concurrency)
+        self.progress = progress
+        self.saved = 0
+        self.failed = 0
+
+    async def run(self) -> dict:
+        started = time.monotonic()
+        watermarks = await self._get_watermarks()
+        dialogs = [dialog async for dialog in self.client.iter_dialogs(limit=self.dialogs)]
+        self._report({'event': 'start', 'dialogs': len(dialogs), 'resumable': len(watermarks)})
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _run(dialog):
+            async with semaphore:
+                await self._backfill_dialog(dialog, watermarks.get(dialog.entity.id, 0))
+
+        results = await asyncio.gather(*[_run(dialog) for dialog in dialogs], return_exceptions=True)
+        for dialog, result in zip(dialogs, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                logger.error(f"会话 {dialog.name} 回填失败: {str(result)}")
+        elapsed = time.monotonic() - started
+        summary = {
+            'event': 'done',
+            'dialogs': len(dialogs),
+            'saved': self.saved,
+            'failed': self.failed,
+            'elapsed': round(elapsed, 1),
+        }
+        self._report(summary)
+        return summary
+
+    def _report(self, data: dict):
+        if self.progress:
+            self.progress(data)
+
+    @sync_to_async
+    def _get_watermarks(self) -> dict:
+        return dict(
+            BackfillWatermark.objects.filter(account=self.account).values_list('peer_id', 'watermark')
+        )
+
+    async def _backfill_dialog(self, dialog, min_id: int):
+        """从水位之后由旧到新逐页拉取并写入"""
+        saved = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                page = [
+                    message async for message in self.client.iter_messages(
+                        dialog.entity, limit=self.page_size, min_id=min_id, reverse=True
+                    )
+                ]
+            except FloodWaitError as e:
+                logger.warning(f"会话 {dialog.name} 触发 FloodWait，等待 {e.seconds} 秒")
+                self._report({'event': 'flood_wait', 'dialog': dialog.name, 'seconds': e.seconds})
+                await asyncio.sleep(e.seconds)
+                continue
+            if not page:
+                break
+            await self._save_page(dialog.entity.id, page)
+            saved += len(page)
+            self.saved += len(page)
+            min_id = page[-1].id
+            self._report({'event': 'page', 'dialog': dialog.name, 'saved': self.saved})
+            if len(page) < self.page_size:
+                break
+        if saved:
+            logger.info(f"会话 {dialog.name} 回填 {saved} 条，总计 {self.saved} 条")
+
+    @sync_to_async
+    def _save_page(self, peer_id: int, page):
+        with transaction.atomic():
+            Message.objects.bulk_create(
+                [Message(**build_message_data(self.account, message)) for message in page],
+                batch_size=self.page_size,
+                ignore_conflicts=True
+            )
+            BackfillWatermark.objects.update_or_create(
+                account=self.account, peer_id=peer_id, defaults={'watermark': page[-1].id}
+            )
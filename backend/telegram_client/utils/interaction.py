@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Case, When, Value
+
+from telegram_client.models import TelegramContact, MessageType
+
+logger = logging.getLogger(__name__)
+
+
+class InteractionCounter:
+    """
+    联系人互动计数（message_count / last_interaction）增量维护
+
+    消息落库后按 (账号, 联系人) 在内存中累计条数和最新消息时间，
+    每 flush_interval 秒在一个事务内用 F() 表达式批量累加，
+    同一联系人在间隔内的多条消息只产生一条 UPDATE。
+    只统计私聊消息，调用方只传入实际新增的消息，重放/重试不会重复计数；
+    其他途径写入（如历史回填）造成的偏差由 reconcile_contact_stats 命令校正。
+    """
+
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = flush_interval or getattr(settings, 'TG_INTERACTION_FLUSH_INTERVAL', 10.0)
+        # (account_id, contact_id) -> [新增条数, 最新消息时间]
+        self._deltas: Dict[Tuple[int, int], list] = {}
+        self._worker: Optional[asyncio.Task] = None
+        self.flushed_contacts = 0
+
+    def start(self):
+        """启动后台写入任务"""
+        if self._worker and not self._worker.done():
+            return
+        self._worker = asyncio.create_task(self._run())
+
+    def record(self, batch: Iterable[dict]):
+        """累计一批已落库消息的增量"""
+        for data in batch:
+            if data['message_type'] != MessageType.PRIVATE.value:
+                continue
+            key = (data['account'].id, data['receiver_id'])
+            delta = self._deltas.get(key)
+            if delta is None:
+                self._deltas[key] = [1, data['timestamp']]
+            else:
+                delta[0] += 1
+                if data['timestamp'] > delta[1]:
+                    delta[1] = data['timestamp']
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._deltas:
+            return
+        deltas, self._deltas = self._deltas, {}
+        try:
+            await self._apply(deltas)
+            self.flushed_contacts += len(deltas)
+        except Exception as e:
+            # 写入失败时合并回待写入增量
+            for key, (count, timestamp) in deltas.items():
+                delta = self._deltas.setdefault(key, [0, timestamp])
+                delta[0] += count
+                delta[1] = max(delta[1], timestamp)
+            logger.error(f"联系人互动计数写入失败({len(deltas)} 个联系人): {str(e)}")
+
+    @sync_to_async
+    def _apply(self, deltas: Dict[Tuple[int, int], list]):
+        with transaction.atomic():
+            for (account_id, contact_id), (count, timestamp) in deltas.items():
+                TelegramContact.objects.filter(account_id=account_id, contact_id=contact_id).update(
+                    message_count=F('message_count') + count,
+                    # 回填的旧消息不会把最后互动时间改早
+                    last_interaction=Case(
+                        When(Q(last_interaction__isnull=True) | Q(last_interaction__lt=timestamp),
+                             then=Value(timestamp)),
+                        default=F('last_interaction'),
+                    ),
+                )
+
+    async def stop(self):
+        """停止后台任务并写出剩余增量"""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'pending_contacts': len(self._deltas),
+            'flushed_contacts': self.flushed_contacts,
+        }
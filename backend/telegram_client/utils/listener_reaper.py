@@ -0,0 +1,153 @@
+import glob
+import logging
+import os
+import time
+
+from django.conf import settings
+
+from telegram_client.ipc_protocol import get_socket_path
+from telegram_client.models import Telegram
+from telegram_client.utils import listener_state
+
+logger = logging.getLogger(__name__)
+
+# 监听进程自身的管理命令名（独立守护进程 / supervisor 分片）
+DAEMON_COMMAND = 'listener_daemon'
+SUPERVISOR_COMMAND = 'listener_supervisor'
+
+
+def _read_cmdline(pid) -> list:
+    """进程命令行参数列表，无 /proc 时返回 None"""
+    with open(f'/proc/{pid}/cmdline', 'rb') as f:
+        return [arg.decode(errors='replace') for arg in f.read().split(b'\0') if arg]
+
+
+def _holds_socket(pid, sock_path: str) -> bool:
+    """进程是否持有指定路径的 unix socket（/proc/net/unix 的 inode 对上进程的 fd）"""
+    try:
+        with open('/proc/net/unix') as f:
+            inodes = {
+                f'socket:[{fields[6]}]' for fields in (line.split() for line in f.readlines()[1:])
+                if len(fields) >= 8 and fields[7] == sock_path
+            }
+        if not inodes:
+            return False
+        fd_dir = f'/proc/{pid}/fd'
+        return any(os.readlink(os.path.join(fd_dir, fd)) in inodes for fd in os.listdir(fd_dir))
+    except OSError:
+        return False
+
+
+def _option_values(args: list, option: str) -> list:
+    """取命令行中某个选项后的参数（到下一个 -- 选项为止）"""
+    if option not in args:
+        return []
+    values = []
+    for arg in args[args.index(option) + 1:]:
+        if arg.startswith('--'):
+            break
+        values.append(arg)
+    return values
+
+
+def is_listener_process(pid, phone: str = None) -> bool:
+    """
+    PID 存在且仍是该账号的监听进程（防止 PID 被系统复用后误判/误杀）
+    - listener_daemon：命令行 --phone 必须是该账号
+    - listener_supervisor：未指定 --phones（托管全部账号）或 --phones 中包含该账号
+    - 其他进程（如执行 start_listener 的 Celery worker）：必须持有该账号的 IPC socket
+    不传 phone 时只接受监听管理命令本身
+    """
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # 进程存在但属于其他用户，不可能是本服务启动的监听
+        return False
+    try:
+        args = _read_cmdline(pid)
+    except OSError:
+        # 无 /proc 的系统只能以进程存在为准
+        return True
+    if DAEMON_COMMAND in args:
+        return phone is None or phone in _option_values(args, '--phone')
+    if SUPERVISOR_COMMAND in args:
+        phones = _option_values(args, '--phones')
+        return phone is None or not phones or phone in phones
+    return phone is not None and _holds_socket(pid, get_socket_path(phone))
+
+
+def reap_listeners(restart: bool = False, grace: float = None) -> dict:
+    """
+    一次批量巡检所有登记为运行中的监听：
+    1. 一条查询取出 process_result=1 的账号，按 (PID, 账号) 检查进程存活且仍是该账号的监听
+    2. 在线状态的账号还要求 IPC socket 存在
+    3. 失效账号一条 UPDATE 标记为丢失（process_result=2），可选重新拉起
+    4. 删除没有存活进程对应的 /tmp/tg_*.sock
+    刚进入连接中（尚未登记 PID）或刚创建的 socket 在 grace 秒内不处理
+    """
+    grace = grace if grace is not None else getattr(settings, 'TG_REAPER_GRACE', 120)
+    now = time.time()
+    accounts = list(
+        Telegram.objects.filter(process_result=1).only('id', 'phone_number', 'process_id', 'process_url', 'status')
+    )
+    states = listener_state.get_states(account.phone_number for account in accounts)
+    pid_alive = {
+        (account.process_id, account.phone_number): is_listener_process(account.process_id, account.phone_number)
+        for account in accounts if account.process_id
+    }
+
+    lost = []
+    live_sockets = set()
+    for account in accounts:
+        state = states.get(account.phone_number) or {}
+        recent = now - state.get('updated', 0) < grace
+        if not account.process_id:
+            # 已请求启动但任务还没跑起来
+            if not recent:
+                lost.append(account)
+            continue
+        if not pid_alive[(account.process_id, account.phone_number)]:
+            lost.append(account)
+            continue
+        sock_path = get_socket_path(account.phone_number)
+        live_sockets.add(sock_path)
+        if state.get('state') == listener_state.ONLINE and not recent and not os.path.exists(sock_path):
+            lost.append(account)
+
+    listener_state.mark_lost(lost)
+
+    removed_sockets = []
+    for sock_path in glob.glob(get_socket_path('*')):
+        if sock_path in live_sockets:
+            continue
+        try:
+            if now - os.path.getmtime(sock_path) < grace:
+                continue
+            os.unlink(sock_path)
+            removed_sockets.append(sock_path)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logger.warning(f"删除 socket 失败 {sock_path}: {str(e)}")
+
+    restarted = []
+    if restart and lost:
+        from telegram_client.tasks import start_listener
+        for account in lost:
+            start_listener.delay(phone=account.phone_number)
+            restarted.append(account.phone_number)
+
+    result = {
+        'checked': len(accounts),
+        'processes': len(pid_alive),
+        'lost': [account.phone_number for account in lost],
+        'removed_sockets': removed_sockets,
+        'restarted': restarted,
+    }
+    if lost or removed_sockets:
+        logger.warning(f"监听巡检: {result}")
+    return result
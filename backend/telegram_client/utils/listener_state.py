@@ -0,0 +1,127 @@
+"""
+监听进程生命周期状态机
+
+Telegram 的 status / process_result / process_id / process_url 只在这里写：
+每次状态迁移一条 UPDATE，同时镜像到 Redis 缓存（listener_status_<phone>），
+后台列表直接从缓存读取实时状态，不依赖数据库中的旧值。
+
+状态迁移：
+    offline/error/lost -> connecting -> (login ->) online -> connecting（重连）
+    任意状态 -> offline / error / lost
+"""
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from telegram_client.models import Telegram
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = 'listener_status_{phone}'
+# 由 supervisor 托管的账号（值为分片进程PID），分片退出前一直保留；
+# stop_listener/start_listener 据此改为读写停止标记，而不是 kill 进程/另起进程
+SUPERVISED_KEY = 'listener_supervised_{phone}'
+# 托管账号的停止标记，存在时 supervisor 会停止并不再拉起该账号
+STOP_KEY = 'listener_stop_{phone}'
+
+CONNECTING = Telegram.Status.CONNECTING
+LOGIN = Telegram.Status.LOGIN
+ONLINE = Telegram.Status.ONLINE
+OFFLINE = Telegram.Status.OFFLINE
+ERROR = Telegram.Status.ERROR
+# 进程丢失：数据库中仍登记着进程，但进程已不存在（状态显示为离线）
+LOST = 'lost'
+
+# 状态 -> process_result（1=正常 2=丢失 3=未启用）
+PROCESS_RESULT = {
+    CONNECTING: 1,
+    LOGIN: 1,
+    ONLINE: 1,
+    OFFLINE: 3,
+    ERROR: 3,
+    LOST: 2,
+}
+
+# 允许的迁移，offline / error / lost 任意状态都可进入
+TRANSITIONS = {
+    None: {CONNECTING},
+    OFFLINE: {CONNECTING},
+    ERROR: {CONNECTING},
+    LOST: {CONNECTING},
+    CONNECTING: {CONNECTING, LOGIN, ONLINE},
+    LOGIN: {CONNECTING, ONLINE},
+    ONLINE: {CONNECTING},
+}
+TERMINAL = {OFFLINE, ERROR, LOST}
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+def get_state(phone: str) -> Optional[dict]:
+    """缓存中的当前状态快照"""
+    return cache.get(STATE_KEY.format(phone=phone))
+
+
+def get_states(phones: Iterable[str]) -> Dict[str, dict]:
+    """批量读取状态快照（一次 MGET），返回 {phone: snapshot}"""
+    keys = {STATE_KEY.format(phone=phone): phone for phone in phones}
+    return {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+
+
+def transition(account: Telegram, state: str, process_id: int = None, process_url: str = None,
+               strict: bool = False) -> dict:
+    """
+    执行一次状态迁移：一条 UPDATE 写数据库，同时刷新缓存并同步到 account 实例
+    不合法的迁移记录警告后照常写入（strict 时抛出 InvalidTransition），
+    避免进程异常退出后状态卡住
+    """
+    current = get_state(account.phone_number)
+    current_state = current['state'] if current else None
+    if state not in TERMINAL and state not in TRANSITIONS.get(current_state, set()):
+        if strict:
+            raise InvalidTransition(f"{account.phone_number}: {current_state} -> {state}")
+        logger.warning(f"账号 {account.phone_number} 状态迁移不合法: {current_state} -> {state}")
+
+    alive = PROCESS_RESULT[state] == 1
+    fields = {
+        'status': OFFLINE if state == LOST else state,
+        'process_result': PROCESS_RESULT[state],
+        # 进程信息只在上线时登记，结束时清空；连接中/待登录保留原值
+        'process_id': process_id if process_id is not None else (account.process_id if alive else None),
+        'process_url': process_url if process_url is not None else (account.process_url if alive else ''),
+    }
+    Telegram.objects.filter(pk=account.pk).update(**fields)
+    for field, value in fields.items():
+        setattr(account, field, value)
+
+    snapshot = {'state': state, 'updated': time.time(), **fields}
+    cache.set(STATE_KEY.format(phone=account.phone_number), snapshot, timeout=None)
+    logger.info(f"账号 {account.phone_number} 状态: {current_state} -> {state}")
+    return snapshot
+
+
+def mark_lost(accounts) -> int:
+    """批量把进程已不存在的账号迁移到 lost：一条 UPDATE + 一次批量写缓存"""
+    accounts = list(accounts)
+    if not accounts:
+        return 0
+    fields = {'status': OFFLINE, 'process_result': PROCESS_RESULT[LOST], 'process_id': None, 'process_url': ''}
+    Telegram.objects.filter(pk__in=[account.pk for account in accounts]).update(**fields)
+    now = time.time()
+    cache.set_many({
+        STATE_KEY.format(phone=account.phone_number): {'state': LOST, 'updated': now, **fields}
+        for account in accounts
+    }, timeout=None)
+    for account in accounts:
+        for field, value in fields.items():
+            setattr(account, field, value)
+    logger.warning(f"标记进程丢失: {[account.phone_number for account in accounts]}")
+    return len(accounts)
+
+
+atransition = sync_to_async(transition)
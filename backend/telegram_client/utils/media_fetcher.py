@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from telethon import utils as tl_utils
+
+from dvadmin.system.models import FileList, media_file_name
+from telegram_client.models import Telegram, Message
+from telegram_client.utils.message_parser import peer_raw_id, parse_media_info
+
+logger = logging.getLogger(__name__)
+
+
+class _HashingWriter:
+    """边写磁盘边计算 md5，Telethon 按分片调用 write，整个文件不会进内存"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+
+class MediaFetcher:
+    """
+    媒体文件异步下载
+
+    监听器只记录媒体元信息，需要文件时（自动下载或 IPC 按需请求）放入有界队列，
+    由固定数量的 worker 下载，单账号并发数受 max_concurrency 限制，不阻塞消息入库。
+    - 分片流式写入临时文件，同时计算 md5
+    - 按 md5 存到与 FileList 相同的 files/<h[0]>/<h[1]>/ 目录，同一文件只保存一份
+    - 下载结果写回 Message.media_info（file_url / md5sum）
+    """
+
+    def __init__(self, client, account: Telegram, max_concurrency: int = None, max_queue_size: int = None):
+        self.client = client
+        self.account = account
+        self.max_concurrency = max_concurrency or getattr(settings, 'TG_MEDIA_DOWNLOAD_CONCURRENCY', 2)
+        self.max_queue_size = max_queue_size or getattr(settings, 'TG_MEDIA_QUEUE_SIZE', 1000)
+        self.auto_download = getattr(settings, 'TG_MEDIA_AUTO_DOWNLOAD', False)
+        self.auto_download_max_size = getattr(settings, 'TG_MEDIA_AUTO_DOWNLOAD_MAX_SIZE', 20 * 1024 * 1024)
+        self.queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        # (会话ID, 消息ID) -> 下载结果，同一消息重复请求共用一次下载
+        self._inflight: Dict[Tuple[int, int], asyncio.Future] = {}
+        # 统计指标
+        self.downloaded = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        """启动下载 worker"""
+        if self._workers:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    def should_auto_download(self, message) -> bool:
+        """是否在收到消息时自动下载（默认关闭，只下载不超过大小上限的文件）"""
+        if not self.auto_download or message.file is None:
+            return False
+        return (message.file.size or 0) <= self.auto_download_max_size
+
+    @staticmethod
+    def check_downloadable(message, msg_id: int):
+        """投票、网页预览、位置等媒体没有可下载的文件，直接拒绝，避免写出空文件并登记到文件表"""
+        if message is None or message.media is None:
+            raise ValueError(f"消息 {msg_id} 不存在或不含媒体")
+        if message.file is None:
+            raise ValueError(f"消息 {msg_id} 的媒体类型 {type(message.media).__name__} 没有可下载的文件")
+
+    def enqueue(self, message) -> Optional[asyncio.Future]:
+        """加入下载队列，不等待；队列满时丢弃并返回 None"""
+        key = (peer_raw_id(message.peer_id), message.id)
+        future = self._inflight.get(key)
+        if future is not None:
+            return future
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((message, future))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"媒体下载队列已满，丢弃消息 {key} 的下载")
+            return None
+        self._inflight[key] = future
+        return future
+
+    async def fetch(self, peer, msg_id: int) -> dict:
+        """按需下载指定消息的媒体并等待结果"""
+        message = await self.client.get_messages(peer, ids=msg_id)
+        self.check_downloadable(message, msg_id)
+        future = self.enqueue(message)
+        if future is None:
+            raise RuntimeError("媒体下载队列已满")
+        return await asyncio.shield(future)
+
+    async def _worker(self):
+        while True:
+            message, future = await self.queue.get()
+            try:
+                result = await self._download(message)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"媒体下载失败(消息 {message.id}): {str(e)}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._inflight.pop((peer_raw_id(message.peer_id), message.id), None)
+                self.queue.task_done()
+
+    async def _download(self, message) -> dict:
+        self.check_downloadable(message, message.id)
+        ext = (tl_utils.get_extension(message.media) or '').lower()
+        tmp_dir = os.path.join(settings.MEDIA_ROOT, 'files', 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer = _HashingWriter(f)
+                await self.client.download_media(message, file=writer)
+            md5sum = writer.md5.hexdigest()
+            relative_path = media_file_name(SimpleNamespace(md5sum=md5sum), f"{md5sum}{ext}")
+            target_path = os.path.join(settings.MEDIA_ROOT, relative_path)
+            if os.path.exists(target_path):
+                self.deduplicated += 1
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                os.replace(tmp_path, target_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        result = {
+            'md5sum': md5sum,
+            'size': writer.size,
+            'file_url': f'media/{relative_path}',
+        }
+        await self._save_records(message, relative_path, result)
+        self.downloaded += 1
+        return result
+
+    async def _save_records(self, message, relative_path: str, result: dict):
+        await self._save_file(message, relative_path, result)
+        # 消息可能还在批量写入缓冲区中，稍后重试写回
+        flush_interval = getattr(settings, 'TG_MESSAGE_FLUSH_INTERVAL', 1.0)
+        for _ in range(3):
+            if await self._update_message(message, result):
+                return
+            await asyncio.sleep(flush_interval * 2)
+        logger.warning(f"消息 {message.id} 尚未入库，媒体信息未写回")
+
+    @sync_to_async
+    def _save_file(self, message, relative_path: str, result: dict):
+        """文件管理中同一 md5 只登记一次"""
+        if FileList.objects.filter(md5sum=result['md5sum']).exists():
+            return
+        if message.photo:
+            file_type = 0
+        elif message.video:
+            file_type = 1
+        elif message.audio or message.voice:
+            file_type = 2
+        else:
+            file_type = 3
+        FileList.objects.create(
+            name=(message.file.name if message.file else None) or os.path.basename(relative_path),
+            url=relative_path,
+            file_url=result['file_url'],
+            mime_type=(message.file.mime_type if message.file else '') or '',
+            size=str(result['size']),
+            md5sum=result['md5sum'],
+            file_type=file_type,
+        )
+
+    @sync_to_async
+    def _update_message(self, message, result: dict) -> int:
+        return Message.objects.filter(
+            account=self.account,
+            receiver_id=peer_raw_id(message.peer_id),
+            telegram_msg_id=message.id,
+        ).update(media_info={**(parse_media_info(message) or {}), **result})
+
+    async def stop(self):
+        """停止 worker，未完成的下载直接取消（下次按需重新下载）"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for future in self._inflight.values():
+            if not future.done():
+                future.cancel()
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'inflight': len(self._inflight),
+            'downloaded': self.downloaded,
+            'deduplicated': self.deduplicated,
+            'failed': self.failed,
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from telegram_client.models import Message
+from telegram_client.utils.interaction import InteractionCounter
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBatchWriter:
+    """
+    消息批量写入缓冲区
+
+    监听器收到的 message_data 先进入有界 asyncio 队列，由后台任务按
+    “条数达到 batch_size” 或 “距上次写入超过 flush_interval 秒” 两个条件
+    合并为一次 bulk_create，避免每条消息一次数据库往返和线程切换。
+    - 队列满时 put 会等待（背压），不会无限占用内存
+    - stop 时会把队列中剩余消息全部写入
+    - 实际新增的消息（不含重放/重试中已存在的）交给 InteractionCounter 累计联系人互动计数
+    """
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None, max_queue_size: int = None):
+        self.batch_size = batch_size or getattr(settings, 'TG_MESSAGE_BATCH_SIZE', 200)
+        self.flush_interval = flush_interval or getattr(settings, 'TG_MESSAGE_FLUSH_INTERVAL', 1.0)
+        self.max_queue_size = max_queue_size or getattr(settings, 'TG_MESSAGE_QUEUE_SIZE', 5000)
+        self.queue: Optional[asyncio.Queue] = None
+        self.interactions = InteractionCounter()
+        self._worker: Optional[asyncio.Task] = None
+        self._stopping = False
+        # 统计指标
+        self.flush_count = 0
+        self.flushed_messages = 0
+        self.failed_messages = 0
+        self.last_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    def start(self):
+        """启动后台写入任务"""
+        if self._worker and not self._worker.done():
+            return
+        self._stopping = False
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker = asyncio.create_task(self._run())
+        self.interactions.start()
+
+    async def put(self, message_data: dict):
+        """放入一条待写入消息，队列满时等待（背压）"""
+        if self.queue is None:
+            raise RuntimeError("消息写入器未启动")
+        await self.queue.put(message_data)
+
+    async def _run(self):
+        """后台循环：凑满一批或超时即写入"""
+        while True:
+            batch = await self._collect_batch()
+            if batch:
+                await self._flush(batch)
+            if self._stopping and self.queue.empty():
+                break
+
+    async def _collect_batch(self) -> List[dict]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            self.queue.task_done()
+        return batch
+
+    async def _flush(self, batch: List[dict], max_retries: int = 3):
+        start = time.perf_counter()
+        try:
+            # 写入是幂等的（唯一索引 + ignore_conflicts），失败可整批重试
+            for attempt in range(1, max_retries + 1):
+                try:
+                    inserted = await self._bulk_save(batch)
+                    self.flushed_messages += len(batch)
+                    self.interactions.record(inserted)
+                    break
+                except Exception as e:
+                    if attempt >= max_retries:
+                        self.failed_messages += len(batch)
+                        logger.error(f"消息批量保存失败({len(batch)} 条): {str(e)}")
+                        break
+                    logger.warning(f"消息批量保存失败，重试 {attempt}/{max_retries}: {str(e)}")
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+        finally:
+            self.last_flush_latency = time.perf_counter() - start
+            self.total_flush_latency += self.last_flush_latency
+            self.flush_count += 1
+
+    @staticmethod
+    def _message_key(data: dict) -> tuple:
+        return data['account'].id, data['receiver_id'], data['telegram_msg_id']
+
+    @sync_to_async
+    def _bulk_save(self, batch: List[dict]) -> List[dict]:
+        """
+        批量写入数据库（已存在的消息跳过，失败重试不会产生重复）
+        写入前按唯一键查出已存在的消息一并剔除，返回本次实际新增的消息
+        """
+        with transaction.atomic():
+            existing = set(
+                Message.objects.filter(
+                    account_id__in={data['account'].id for data in batch},
+                    telegram_msg_id__in={data['telegram_msg_id'] for data in batch},
+                ).values_list('account_id', 'receiver_id', 'telegram_msg_id')
+            )
+            rows = []
+            for data in batch:
+                key = self._message_key(data)
+                if key in existing:
+                    continue
+                existing.add(key)
+                rows.append(data)
+            Message.objects.bulk_create(
+                [Message(**data) for data in rows],
+                batch_size=self.batch_size,
+                ignore_conflicts=True
+            )
+        return rows
+
+    async def stop(self):
+        """停止写入器并把剩余消息全部落库"""
+        if not self._worker:
+            return
+        self._stopping = True
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            # 被取消时同步写出剩余数据，尽量不丢消息
+            remaining = []
+            while not self.queue.empty():
+                remaining.append(self.queue.get_nowait())
+            if remaining:
+                await self._flush(remaining)
+        self._worker = None
+        await self.interactions.stop()
+        logger.info(f"消息写入器已停止: {self.stats()}")
+
+    def stats(self) -> dict:
+        """当前队列深度和写入耗时统计"""
+        return {
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'flush_count': self.flush_count,
+            'flushed_messages': self.flushed_messages,
+            'failed_messages': self.failed_messages,
+            'last_flush_latency': round(self.last_flush_latency, 4),
+            'avg_flush_latency': round(self.total_flush_latency / self.flush_count, 4) if self.flush_count else 0.0,
+            'interactions': self.interactions.stats(),
+        }
@@ -0,0 +1,86 @@
+from typing import Optional
+
+from telethon.tl.types import PeerUser, PeerChat, PeerChannel, MessageMediaPoll
+
+from telegram_client.models import MessageType
+
+
+def peer_raw_id(peer) -> Optional[int]:
+    """PeerUser/PeerChat/PeerChannel 转为原始ID（与实体的 .id 一致）"""
+    if isinstance(peer, PeerUser):
+        return peer.user_id
+    if isinstance(peer, PeerChat):
+        return peer.chat_id
+    if isinstance(peer, PeerChannel):
+        return peer.channel_id
+    return None
+
+
+def get_message_type(peer) -> MessageType:
+    """判断消息类型 个人 群组 频道，未知类型按私聊处理"""
+    if isinstance(peer, PeerChat):
+        return MessageType.GROUP
+    if isinstance(peer, PeerChannel):
+        return MessageType.CHANNEL
+    return MessageType.PRIVATE
+
+
+def parse_media_info(message) -> Optional[dict]:
+    """解析媒体信息"""
+    if not message.media:
+        return None
+    if isinstance(message.media, MessageMediaPoll):
+        # 处理投票
+        return {
+            "type": "poll",
+            "poll_id": message.media.poll.id,
+            "question": message.media.poll.question.text,
+            "options": [answer.text.text for answer in message.media.poll.answers],
+            "closed": message.media.poll.closed
+        }
+    # 处理其他媒体
+    media_type = "unknown"
+    file_id = None
+    size = None
+
+    if message.photo:
+        media_type = "photo"
+    elif message.video:
+        media_type = "video"
+    elif message.document:
+        media_type = "document"
+        file_id = message.media.document.id
+        size = message.media.document.size
+
+    return {
+        "type": media_type,
+        "file_id": file_id,
+        "size": size
+    }
+
+
+def build_message_data(account, message) -> dict:
+    """
+    Telethon Message 转为 Message 模型字段（实时监听与历史回填共用）
+    发送方/接收方直接取自 from_id/peer_id，无需额外请求实体
+    """
+    receiver_id = peer_raw_id(message.peer_id)
+    if message.from_id is not None:
+        sender_id = peer_raw_id(message.from_id)
+    elif message.out:
+        sender_id = account.telegram_id
+    else:
+        sender_id = receiver_id
+
+    return {
+        "account": account,  # 当前监听账号
+        "direction": "send" if message.out else "in",  # 发送or接收
+        "content": message.raw_text or '',  # 原始消息内容
+        "media_info": parse_media_info(message),  # 媒体信息
+        "timestamp": message.date,  # 消息时间
+        "sender_id": sender_id,  # 发送方ID
+        "receiver_id": receiver_id,  # 接收方ID（会话ID）
+        "telegram_msg_id": message.id,  # Telegram消息ID
+        "is_service_msg": message.action is not None,  # 是否为系统消息
+        "message_type": get_message_type(message.peer_id).value,  # 保存枚举的值
+    }
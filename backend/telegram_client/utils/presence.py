@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from telegram_client.models import Telegram, TelegramContact
+from telegram_client.utils.contact_sync import user_status_text
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    """
+    联系人在线状态跟踪
+
+    监听器收到 UserUpdate 时只在内存中记录每个用户的最新状态，
+    后台任务每 flush_interval 秒把这段时间内变化的状态合并为一次 bulk_update，
+    同一用户多次上下线只写最后一次；stop 时写出剩余状态。
+    """
+
+    def __init__(self, account: Telegram, flush_interval: float = None):
+        self.account = account
+        self.flush_interval = flush_interval or getattr(settings, 'TG_PRESENCE_FLUSH_INTERVAL', 5.0)
+        self._pending: Dict[int, str] = {}
+        self._worker: Optional[asyncio.Task] = None
+        # 统计指标
+        self.received_updates = 0
+        self.flushed_updates = 0
+
+    def start(self):
+        """启动后台写入任务"""
+        if self._worker and not self._worker.done():
+            return
+        self._worker = asyncio.create_task(self._run())
+
+    def update(self, user_id: int, status):
+        """记录用户最新状态（覆盖未写入的旧状态）"""
+        self._pending[user_id] = user_status_text(status)
+        self.received_updates += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            self.flushed_updates += await self._bulk_save(pending)
+        except Exception as e:
+            # 写入失败时放回，较新的状态优先
+            self._pending = {**pending, **self._pending}
+            logger.error(f"联系人状态写入失败({len(pending)} 条): {str(e)}")
+
+    @sync_to_async
+    def _bulk_save(self, pending: Dict[int, str]) -> int:
+        """只更新状态确有变化的联系人，非联系人的用户忽略"""
+        contacts = []
+        for contact in TelegramContact.objects.filter(
+                account=self.account, contact_id__in=list(pending)
+        ).only('id', 'contact_id', 'user_status'):
+            status_text = pending[contact.contact_id]
+            if contact.user_status != status_text:
+                contact.user_status = status_text
+                contacts.append(contact)
+        if contacts:
+            TelegramContact.objects.bulk_update(contacts, ['user_status'], batch_size=500)
+        return len(contacts)
+
+    async def stop(self):
+        """停止后台任务并写出剩余状态"""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'received_updates': self.received_updates,
+            'flushed_updates': self.flushed_updates,
+        }
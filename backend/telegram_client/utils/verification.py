@@ -1,19 +1,100 @@
+import asyncio
+import logging
+
+from django.conf import settings
 from django.utils import timezone
 from telegram_client.models import VerificationCode
 from asgiref.sync import sync_to_async
 from django.db import transaction
 
+logger = logging.getLogger(__name__)
+
+# 验证码到达通知频道，登录中的监听进程订阅自己手机号的频道
+CODE_CHANNEL = 'tg_code_{phone}'
+
+
+def _redis_url() -> str:
+    return getattr(settings, 'TG_NOTIFY_REDIS_URL', None) or settings.CACHES['default']['LOCATION']
+
+
 class CodeManager:
     @staticmethod
     @sync_to_async
     def create_code(phone: str, code: str, expires_minutes=5):
         """异步创建验证码"""
+        return CodeManager.submit_code(phone, code, expires_minutes)
+
+    @staticmethod
+    def submit_code(phone: str, code: str, expires_minutes=5):
+        """保存验证码并通知等待中的登录流程（供视图、Celery 任务同步调用）"""
         expires_at = timezone.now() + timezone.timedelta(minutes=expires_minutes)
-        return VerificationCode.objects.create(
+        record = VerificationCode.objects.create(
             phone=phone,
             code=code,
             expires_at=expires_at
         )
+        # 事务提交后再通知，保证订阅方能读到记录
+        transaction.on_commit(lambda: CodeManager.notify(phone, record.id))
+        return record
+
+    @staticmethod
+    def notify(phone: str, code_id: int):
+        """发布验证码到达通知，失败时登录流程靠兜底检查读取"""
+        import redis
+        try:
+            client = redis.Redis.from_url(_redis_url())
+            try:
+                client.publish(CODE_CHANNEL.format(phone=phone), str(code_id))
+            finally:
+                client.close()
+        except Exception as e:
+            logger.warning(f"验证码通知发布失败: {str(e)}")
+
+    @staticmethod
+    async def wait_for_code(phone: str, timeout: float = 300, fallback_interval: float = 30) -> str:
+        """
+        等待验证码到达并标记为已使用
+        先订阅再查库，避免订阅前已提交的验证码被漏掉；之后只在收到通知时查库，
+        每 fallback_interval 秒兜底查一次（Redis 不可用或通知丢失时仍能取到）
+        """
+        import redis.asyncio as aioredis
+
+        deadline = asyncio.get_running_loop().time() + timeout
+        client = aioredis.Redis.from_url(_redis_url())
+        pubsub = client.pubsub()
+        try:
+            try:
+                await pubsub.subscribe(CODE_CHANNEL.format(phone=phone))
+            except Exception as e:
+                logger.warning(f"验证码通知订阅失败，改为定时检查: {str(e)}")
+                pubsub = None
+
+            while True:
+                valid_code = await CodeManager.get_valid_code(phone)
+                if valid_code and valid_code.code:
+                    await CodeManager.mark_used(valid_code.id)
+                    return valid_code.code
+
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError("验证码等待超时")
+                wait = min(remaining, fallback_interval)
+                if pubsub is None:
+                    await asyncio.sleep(wait)
+                    continue
+                try:
+                    await pubsub.get_message(ignore_subscribe_messages=True, timeout=wait)
+                except Exception as e:
+                    logger.warning(f"验证码通知读取失败，改为定时检查: {str(e)}")
+                    pubsub = None
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.unsubscribe()
+                    await pubsub.close()
+                except Exception:
+                    pass
+            await client.close()
 
     @staticmethod
     @sync_to_async
@@ -1,16 +1,27 @@
 # Create your views here.
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
 from rest_framework import status
 from websockets.legacy.server import HTTPResponse
 from django.core.management import call_command
 
-from telegram_client.models import Telegram,TelegramContact
+from telegram_client.models import Telegram,TelegramContact,BroadcastJob,Message
 from telegram_client.models import VerificationCode
 from telegram_client.serializers import TelegramModelSerializer, TelegramModelCreateUpdateSerializer,TelegramContactModelSerializer,TelegramContactModelCreateUpdateSerializer
+from telegram_client.serializers import BroadcastJobModelSerializer, BroadcastJobModelCreateUpdateSerializer
+from telegram_client.serializers import MessageModelSerializer
+from dvadmin.utils.json_response import ErrorResponse
+from dvadmin.utils.pagination import KeysetPagination
 from dvadmin.utils.viewset import CustomModelViewSet
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from telegram_client.tasks import start_listener,stop_listener,input_code
+from telegram_client.tasks import start_listener,stop_listener,input_code,run_broadcast
 from telegram_client.utils.verification import CodeManager
+from telegram_client.utils import listener_state
 
 class TelegramModelViewSet(CustomModelViewSet):
     """
@@ -24,21 +35,15 @@ class TelegramModelViewSet(CustomModelViewSet):
     @action(detail=True, methods=['post'])
     def start_process(self, request, pk=None):
         instance = self.get_object()
-        task_id = None  # 初始化任务ID
+        async_result = None
 
         if instance.process_result == 1:
-            # 停止任务
+            # 停止任务（停止命令结束进程后迁移到 offline）
             async_result = stop_listener.delay(phone=instance.phone_number)
-            instance.process_result = 3
-            instance.status = "offline"
         elif instance.process_result in [2, 3]:
-            # 启动任务
+            # 启动任务，先迁移到连接中防止重复启动
+            listener_state.transition(instance, listener_state.CONNECTING)
             async_result = start_listener.delay(phone=instance.phone_number)
-            instance.process_result = 1
-            instance.status = "online"
-
-        # 保存实例变更
-        instance.save()
 
         # 返回任务ID（可序列化的字符串）
         return Response({
@@ -52,7 +57,8 @@ class TelegramModelViewSet(CustomModelViewSet):
     def in_code(self, request, pk=None):
         instance = self.get_object()  # 获取当前Telegram账号实例
         code = request.data.get('code')
-        input_code.delay(phone_number=instance.phone_number, code=code)
+        # 直接保存并发布通知，登录中的监听进程立即收到，无需经过 Celery 队列
+        CodeManager.submit_code(instance.phone_number, code)
         return Response({
             "success": True,
         }, status=status.HTTP_200_OK)
@@ -63,6 +69,18 @@ class TelegramModelViewSet(CustomModelViewSet):
     create_serializer_class = TelegramModelCreateUpdateSerializer
     update_serializer_class = TelegramModelCreateUpdateSerializer
 
+    def list(self, request, *args, **kwargs):
+        """监听状态字段以缓存中的实时状态为准（一次 MGET 覆盖整页）"""
+        response = super().list(request, *args, **kwargs)
+        rows = response.data.get('data') or []
+        states = listener_state.get_states(row['phone_number'] for row in rows)
+        for row in rows:
+            state = states.get(row['phone_number'])
+            if state:
+                for field in ('status', 'process_result', 'process_id', 'process_url'):
+                    row[field] = state[field]
+        return response
+
 
 
 class TelegramContactModelViewSet(CustomModelViewSet):
@@ -78,3 +96,93 @@ class TelegramContactModelViewSet(CustomModelViewSet):
     create_serializer_class = TelegramContactModelCreateUpdateSerializer
     update_serializer_class = TelegramContactModelCreateUpdateSerializer
 
+
+
+class BroadcastJobModelViewSet(CustomModelViewSet):
+    """
+    list:查询
+    create:新增
+    update:修改
+    retrieve:单例
+    destroy:删除
+    start:开始/继续群发
+    pause:暂停群发
+    """
+
+    # 开始或断点续发
+    @action(detail=True, methods=['post'])
+    def start(self, request, pk=None):
+        instance = self.get_object()
+        # 条件更新抢占执行权，重复点击只有一次能把任务切到执行中并投递；
+        # 执行中但心跳超时（worker 被杀等）的任务同样可以重新抢占
+        stale_before = timezone.now() - timedelta(seconds=getattr(settings, 'TG_BROADCAST_STALE_SECONDS', 300))
+        claimed = BroadcastJob.objects.filter(
+            Q(status__in=[BroadcastJob.Status.PENDING, BroadcastJob.Status.PAUSED, BroadcastJob.Status.FAILED])
+            | Q(status=BroadcastJob.Status.RUNNING, update_datetime__lt=stale_before),
+            pk=instance.pk,
+        ).update(status=BroadcastJob.Status.RUNNING, update_datetime=timezone.now())
+        if not claimed:
+            return Response({"success": False, "msg": "任务正在执行或已完成"}, status=status.HTTP_200_OK)
+        try:
+            async_result = run_broadcast.delay(job_id=instance.id)
+        except Exception:
+            previous = BroadcastJob.Status.FAILED if instance.status == BroadcastJob.Status.RUNNING else instance.status
+            BroadcastJob.objects.filter(pk=instance.pk).update(status=previous)
+            raise
+        return Response({
+            "success": True,
+            "task_id": async_result.id,
+        }, status=status.HTTP_200_OK)
+
+    # 暂停，执行器在下一个检查点退出
+    @action(detail=True, methods=['post'])
+    def pause(self, request, pk=None):
+        instance = self.get_object()
+        if instance.status == BroadcastJob.Status.RUNNING:
+            instance.status = BroadcastJob.Status.PAUSED
+            instance.save(update_fields=['status'])
+        return Response({
+            "success": True,
+            "status": instance.status
+        }, status=status.HTTP_200_OK)
+
+    queryset = BroadcastJob.objects.all()
+    serializer_class = BroadcastJobModelSerializer
+    create_serializer_class = BroadcastJobModelCreateUpdateSerializer
+    update_serializer_class = BroadcastJobModelCreateUpdateSerializer
+
+
+
+class MessageModelViewSet(CustomModelViewSet):
+    """
+    list:查询
+    retrieve:单例
+    timeline:会话时间线（游标分页）
+    """
+    queryset = Message.objects.all()
+    serializer_class = MessageModelSerializer
+    # 消息由监听器写入，接口只读
+    http_method_names = ['get', 'head', 'options']
+    # 会话时间线按 (timestamp, id) 倒序翻页，对应 (account, receiver_id, timestamp, id) 索引
+    keyset_ordering = ('-timestamp', '-id')
+
+    # 会话聊天记录：?account=账号ID&peer=会话ID&limit=50&cursor=上一页返回的next_cursor[&with_total=1]
+    @action(detail=False, methods=['get'])
+    def timeline(self, request):
+        account = request.query_params.get('account')
+        peer = request.query_params.get('peer')
+        if not account or not peer:
+            return ErrorResponse(msg="account 和 peer 参数必填")
+        try:
+            account, peer = int(account), int(peer)
+        except ValueError:
+            return ErrorResponse(msg="account 和 peer 必须为整数")
+        # 从经过数据权限过滤的查询集开始
+        queryset = self.filter_queryset(self.get_queryset()).filter(account_id=account, receiver_id=peer)
+        paginator = KeysetPagination()
+        try:
+            page = paginator.paginate_queryset(queryset, request, view=self)
+        except ValidationError:
+            return ErrorResponse(msg="无效的游标")
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)